@@ -1,6 +1,6 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
-from .models import User, PartnerOrganisation
+from .models import APIToken, User, PartnerOrganisation
 
 
 @admin.register(PartnerOrganisation)
@@ -16,3 +16,14 @@ class UserAdmin(BaseUserAdmin):
     )
     list_display = ('username', 'email', 'role', 'partner_organisation', 'is_staff')
     list_filter = ('role', 'is_staff')
+
+
+@admin.register(APIToken)
+class APITokenAdmin(admin.ModelAdmin):
+    list_display = ('prefix', 'user', 'name', 'is_signed', 'created_at', 'expires_at')
+    search_fields = ('prefix', 'name', 'user__username')
+    readonly_fields = ('prefix', 'digest', 'signing_key', 'created_at')
+
+    def has_add_permission(self, request):
+        # the raw key is only shown once, by `manage.py create_api_token`
+        return False
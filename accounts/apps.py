@@ -6,5 +6,6 @@ class AccountsConfig(AppConfig):
     name = 'accounts'
 
     def ready(self):
-        # import signals if any in future
-        pass
+        # drop cached API tokens and users when they change
+        import accounts.signals  # noqa: F401
+        import accounts.checks  # noqa: F401
@@ -0,0 +1,159 @@
+"""Token and signed-request authentication for API clients.
+
+``Authorization: Token <prefix>.<secret>`` authenticates with a bearer token;
+``Authorization: Signature key=<prefix>,ts=<unix time>,sig=<hex>`` with an HMAC
+of the request made with a signed token's signing key. The string signed is::
+
+    METHOD \n full path with query string \n ts \n sha256 hex of the body
+
+Tokens and their users are cached, so an authenticated request normally costs
+one hash and no queries instead of a PBKDF2 password check. accounts.signals
+drops the entries when a token or user changes; that reaches other workers only
+through a shared cache backend (see CACHE_BACKEND), otherwise their entries
+live until API_TOKEN_CACHE_SECONDS. Unknown prefixes are remembered for
+MISS_SECONDS only, so a new token works everywhere soon after it is created.
+
+A signature is accepted once: it is remembered for the allowed clock skew on
+either side, and a replay within that window is refused.
+"""
+import hashlib
+import hmac
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.utils import timezone
+from rest_framework import exceptions
+from rest_framework.authentication import BaseAuthentication, get_authorization_header
+
+from .models import APIToken, hash_token
+
+TOKEN_CACHE_KEY = 'accounts:token:{}'
+USER_CACHE_KEY = 'accounts:token-user:{}'
+SIGNATURE_CACHE_KEY = 'accounts:signature:{}:{}'
+MISS_SECONDS = 10
+
+# user columns an authenticated API request needs; the rest stay deferred
+USER_FIELDS = (
+    'id', 'username', 'email', 'role', 'partner_organisation_id',
+    'is_active', 'is_staff', 'is_superuser', 'date_joined',
+)
+
+
+def _timeout():
+    return getattr(settings, 'API_TOKEN_CACHE_SECONDS', 300)
+
+
+def get_token(prefix):
+    """Return the cached token row for ``prefix`` as a dict, or None."""
+    key = TOKEN_CACHE_KEY.format(prefix)
+    data = cache.get(key)
+    if data is None:
+        row = APIToken.objects.filter(prefix=prefix).values('id', 'user_id', 'digest', 'signing_key', 'expires_at').first()
+        # remember misses briefly too, so guessing prefixes does not reach the database
+        data = row or {}
+        cache.set(key, data, _timeout() if row else min(_timeout(), MISS_SECONDS))
+    return data or None
+
+
+def get_user(user_id):
+    """Return the token's user, loaded with USER_FIELDS only and cached."""
+    User = get_user_model()
+    # from_db() expects values in model field order
+    attnames = [f.attname for f in User._meta.concrete_fields if f.attname in USER_FIELDS]
+    key = USER_CACHE_KEY.format(user_id)
+    values = cache.get(key)
+    if values is None:
+        row = User.objects.filter(pk=user_id).values_list(*attnames).first()
+        if row is None:
+            return None
+        values = list(row)
+        cache.set(key, values, _timeout())
+    return User.from_db('default', attnames, values)
+
+
+def forget_token(prefix):
+    cache.delete(TOKEN_CACHE_KEY.format(prefix))
+
+
+def forget_user(user_id):
+    cache.delete(USER_CACHE_KEY.format(user_id))
+
+
+def string_to_sign(request, timestamp):
+    body_hash = hashlib.sha256(request.body or b'').hexdigest()
+    return f'{request.method}\n{request.get_full_path()}\n{timestamp}\n{body_hash}'
+
+
+def sign(signing_key, request, timestamp):
+    return hmac.new(signing_key.encode(), string_to_sign(request, timestamp).encode(), hashlib.sha256).hexdigest()
+
+
+class _CachedTokenAuthentication(BaseAuthentication):
+    keyword = None
+
+    def _credentials(self, request):
+        auth = get_authorization_header(request).split(None, 1)
+        if not auth or auth[0].lower() != self.keyword.lower().encode():
+            return None
+        if len(auth) != 2:
+            raise exceptions.AuthenticationFailed('Invalid authorization header.')
+        try:
+            return auth[1].decode().strip()
+        except UnicodeError:
+            raise exceptions.AuthenticationFailed('Invalid authorization header.')
+
+    def _user_for(self, token):
+        if token['expires_at'] and token['expires_at'] <= timezone.now():
+            raise exceptions.AuthenticationFailed('Token has expired.')
+        user = get_user(token['user_id'])
+        if user is None or not user.is_active:
+            raise exceptions.AuthenticationFailed('User inactive or deleted.')
+        return user
+
+    def authenticate_header(self, request):
+        return self.keyword
+
+
+class TokenAuthentication(_CachedTokenAuthentication):
+    keyword = 'Token'
+
+    def authenticate(self, request):
+        raw_key = self._credentials(request)
+        if raw_key is None:
+            return None
+        prefix = raw_key.split('.', 1)[0]
+        token = get_token(prefix)
+        if token is None or not hmac.compare_digest(token['digest'], hash_token(raw_key)):
+            raise exceptions.AuthenticationFailed('Invalid token.')
+        if token['signing_key']:
+            raise exceptions.AuthenticationFailed('This token must sign its requests.')
+        return self._user_for(token), token
+
+
+class SignatureAuthentication(_CachedTokenAuthentication):
+    keyword = 'Signature'
+
+    def authenticate(self, request):
+        value = self._credentials(request)
+        if value is None:
+            return None
+        try:
+            parts = dict(item.strip().split('=', 1) for item in value.split(','))
+            prefix, timestamp, signature = parts['key'], int(parts['ts']), parts['sig']
+        except (KeyError, ValueError):
+            raise exceptions.AuthenticationFailed('Invalid signature header.')
+        max_skew = getattr(settings, 'API_SIGNATURE_MAX_SKEW', 300)
+        if abs(time.time() - timestamp) > max_skew:
+            raise exceptions.AuthenticationFailed('Signature timestamp out of range.')
+        token = get_token(prefix)
+        if token is None or not token['signing_key']:
+            raise exceptions.AuthenticationFailed('Invalid token.')
+        expected = sign(token['signing_key'], request._request, timestamp)
+        if not hmac.compare_digest(expected, signature):
+            raise exceptions.AuthenticationFailed('Invalid signature.')
+        # the signature covers ts, so it stays usable until ts + max_skew at most
+        if not cache.add(SIGNATURE_CACHE_KEY.format(prefix, signature), 1, 2 * max_skew):
+            raise exceptions.AuthenticationFailed('Signature already used.')
+        return self._user_for(token), token
@@ -0,0 +1,17 @@
+from django.conf import settings
+from django.core.checks import Tags, Warning, register
+
+PER_PROCESS_CACHES = ('django.core.cache.backends.locmem.LocMemCache', 'django.core.cache.backends.dummy.DummyCache')
+
+
+@register(Tags.caches, deploy=True)
+def check_shared_cache(app_configs, **kwargs):
+    """Token, principal, region and bell invalidation needs a cache every worker sees."""
+    if settings.CACHES.get('default', {}).get('BACKEND') not in PER_PROCESS_CACHES:
+        return []
+    return [Warning(
+        'The default cache is per-process, so revoked API tokens, role changes and region edits '
+        'only reach the worker that made them until the cached entries expire.',
+        hint='Set CACHE_BACKEND and CACHE_LOCATION to a shared backend such as Redis or memcached.',
+        id='accounts.W001',
+    )]
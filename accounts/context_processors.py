@@ -0,0 +1,7 @@
+from django.utils.functional import SimpleLazyObject
+
+from .principal import get_principal
+
+
+def principal(request):
+    return {'principal': SimpleLazyObject(lambda: get_principal(request))}
@@ -0,0 +1,34 @@
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from accounts.models import APIToken
+
+
+class Command(BaseCommand):
+    help = 'Create an API token for a user and print it (it cannot be shown again)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('username')
+        parser.add_argument('--name', default='', help='Label for the token, e.g. the integration using it')
+        parser.add_argument('--signed', action='store_true', help='Require HMAC-signed requests instead of a bearer token')
+        parser.add_argument('--expires-days', type=int, default=None)
+
+    def handle(self, *args, **options):
+        User = get_user_model()
+        try:
+            user = User.objects.get(username=options['username'])
+        except User.DoesNotExist:
+            raise CommandError(f"No user named {options['username']}")
+        expires_at = None
+        if options['expires_days']:
+            expires_at = timezone.now() + timedelta(days=options['expires_days'])
+        token, raw_key = APIToken.objects.create_token(user, name=options['name'], signed=options['signed'], expires_at=expires_at)
+        if token.is_signed:
+            self.stdout.write(f'Key id: {token.prefix}')
+            self.stdout.write(f'Signing key: {token.signing_key}')
+        else:
+            self.stdout.write(f'Token: {raw_key}')
+        self.stdout.write(self.style.SUCCESS(f'Created API token {token.prefix} for {user.username} ({user.role})'))
@@ -1,6 +1,7 @@
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
 from django.contrib.auth import get_user_model
 from accounts.models import PartnerOrganisation
+from accounts.synthetic import Generator
 from deals.models import Deal
 from django.utils import timezone
 from django.conf import settings
@@ -13,7 +14,22 @@ User = get_user_model()
 class Command(BaseCommand):
     help = 'Seed demo data: partner orgs, users, and sample deals'
 
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', action='store_true', help='Bulk-load synthetic data at the volumes below instead of the demo set')
+        parser.add_argument('--partners', type=int, default=50)
+        parser.add_argument('--users-per-partner', type=int, default=3)
+        parser.add_argument('--brady-users', type=int, default=5)
+        parser.add_argument('--deals', type=int, default=10000)
+        parser.add_argument('--audit-depth', type=int, default=4, help='Audit rows per deal')
+        parser.add_argument('--notifications', type=int, default=20000)
+        parser.add_argument('--days', type=int, default=730, help='Spread creation dates over this many days')
+        parser.add_argument('--batch-size', type=int, default=2000)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--prefix', default='synthetic', help='Prefix for generated partner and user names')
+
     def handle(self, *args, **options):
+        if options['scale']:
+            return self.handle_scale(options)
         out = self.stdout
         
         # Create 6 partner organisations
@@ -165,3 +181,23 @@ class Command(BaseCommand):
         out.write(f'  Brady users: brady1/brady1pass')
         out.write(f'  Admin users: admin1/admin1pass')
         out.write(f'  Deals created: {deals_created}')
+
+    def handle_scale(self, options):
+        prefix = options['prefix']
+        if PartnerOrganisation.objects.filter(name__startswith=f'{prefix} partner ').exists():
+            raise CommandError(f'Data with prefix "{prefix}" already exists; pass a different --prefix')
+        Generator(
+            partners=options['partners'],
+            users_per_partner=options['users_per_partner'],
+            brady_users=options['brady_users'],
+            deals=options['deals'],
+            audit_depth=options['audit_depth'],
+            notifications=options['notifications'],
+            days=options['days'],
+            batch_size=options['batch_size'],
+            seed=options['seed'],
+            prefix=prefix,
+            password=f'{prefix}pass',
+            log=self.stdout.write,
+        ).run()
+        self.stdout.write(self.style.SUCCESS(f'Seeded synthetic data; every generated user has the password {prefix}pass'))
@@ -1,3 +1,6 @@
+import hashlib
+import secrets
+
 from django.db import models
 from django.contrib.auth.models import AbstractUser
 
@@ -46,3 +49,53 @@ class User(AbstractUser):
 
     def is_admin(self):
         return self.role == "ADMIN"
+
+
+class APITokenManager(models.Manager):
+    def create_token(self, user, name='', signed=False, expires_at=None):
+        """Create a token for ``user`` and return ``(token, raw_key)``.
+
+        Only a SHA-256 digest of ``raw_key`` is stored, so it cannot be shown
+        again. Signed tokens also get an HMAC signing key and are refused as
+        plain bearer tokens.
+        """
+        prefix = secrets.token_hex(6)
+        raw_key = f'{prefix}.{secrets.token_urlsafe(32)}'
+        token = self.create(
+            user=user,
+            name=name,
+            prefix=prefix,
+            digest=hash_token(raw_key),
+            signing_key=secrets.token_urlsafe(32) if signed else '',
+            expires_at=expires_at,
+        )
+        return token, raw_key
+
+
+def hash_token(raw_key):
+    return hashlib.sha256(raw_key.encode()).hexdigest()
+
+
+class APIToken(models.Model):
+    """API credential for automated clients; acts with its user's role and organisation."""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='api_tokens')
+    name = models.CharField(max_length=100, blank=True)
+    # public part of the key, used to find the token without hashing first
+    prefix = models.CharField(max_length=12, unique=True)
+    digest = models.CharField(max_length=64)
+    signing_key = models.CharField(max_length=64, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(null=True, blank=True)
+
+    objects = APITokenManager()
+
+    class Meta:
+        verbose_name = "API Token"
+        verbose_name_plural = "API Tokens"
+
+    def __str__(self):
+        return f"{self.prefix} ({self.user})"
+
+    @property
+    def is_signed(self):
+        return bool(self.signing_key)
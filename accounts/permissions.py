@@ -1,16 +1,23 @@
 from rest_framework import permissions
 
+from .principal import get_principal
 
-class IsPartner(permissions.BasePermission):
-    def has_permission(self, request, view):
-        return bool(request.user and request.user.is_authenticated and request.user.role == 'PARTNER')
 
+class _RolePermission(permissions.BasePermission):
+    role = None
 
-class IsBrady(permissions.BasePermission):
     def has_permission(self, request, view):
-        return bool(request.user and request.user.is_authenticated and request.user.role == 'BRADY')
+        principal = get_principal(request)
+        return bool(principal and principal.role == self.role)
 
 
-class IsAdmin(permissions.BasePermission):
-    def has_permission(self, request, view):
-        return bool(request.user and request.user.is_authenticated and request.user.role == 'ADMIN')
+class IsPartner(_RolePermission):
+    role = 'PARTNER'
+
+
+class IsBrady(_RolePermission):
+    role = 'BRADY'
+
+
+class IsAdmin(_RolePermission):
+    role = 'ADMIN'
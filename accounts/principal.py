@@ -0,0 +1,94 @@
+"""Compact, cached description of who is making a request.
+
+Permission and scoping code compares ids against the principal instead of
+loading ``user.partner_organisation``. Principals are built with one joined
+query and cached per user; accounts.signals drops them when the user or their
+organisation changes.
+
+Signals only clear this process's entries unless the cache is shared, and
+queryset ``update()`` sends none. So a cached principal is used only while its
+role, organisation and superuser flag still match the request's user, which
+authentication loads afresh; a demotion or a move applies on the next request
+everywhere.
+"""
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+
+PRINCIPAL_CACHE_KEY = 'accounts:principal:{}'
+
+STAFF_ROLES = ('BRADY', 'ADMIN')
+
+
+class Principal:
+    __slots__ = ('user_id', 'role', 'partner_id', 'partner_name', 'is_superuser')
+
+    def __init__(self, user_id, role, partner_id=None, partner_name='', is_superuser=False):
+        self.user_id = user_id
+        self.role = role
+        self.partner_id = partner_id
+        self.partner_name = partner_name or ''
+        self.is_superuser = is_superuser
+
+    def __repr__(self):
+        return f'<Principal user={self.user_id} role={self.role} partner={self.partner_id}>'
+
+    @property
+    def is_partner(self):
+        return self.role == 'PARTNER'
+
+    @property
+    def is_admin(self):
+        """Same as ``User.is_admin``: the ADMIN role, whatever the superuser flag."""
+        return self.role == 'ADMIN'
+
+    @property
+    def is_staff_role(self):
+        """Brady and admin users see every partner's deals."""
+        return self.role in STAFF_ROLES
+
+    def has_role(self, *roles):
+        return self.role in roles or self.is_superuser
+
+    def owns(self, deal):
+        return self.partner_id is not None and deal.partner_id == self.partner_id
+
+    def can_view(self, deal):
+        return self.is_staff_role or self.owns(deal)
+
+
+def load_principal(user):
+    key = PRINCIPAL_CACHE_KEY.format(user.pk)
+    values = cache.get(key)
+    if values is None or tuple(values[i] for i in (1, 2, 4)) != (user.role, user.partner_organisation_id, user.is_superuser):
+        User = get_user_model()
+        values = (
+            User.objects.filter(pk=user.pk)
+            .values_list('id', 'role', 'partner_organisation_id', 'partner_organisation__name', 'is_superuser')
+            .first()
+        )
+        if values is None:
+            return None
+        cache.set(key, values, getattr(settings, 'PRINCIPAL_CACHE_SECONDS', 300))
+    return Principal(*values)
+
+
+def get_principal(request):
+    """Return the request's Principal, or None for anonymous requests.
+
+    Works with Django and DRF requests; the result is kept on the underlying
+    HttpRequest so views, permissions and templates share it.
+    """
+    http_request = getattr(request, '_request', request)
+    principal = getattr(http_request, '_principal', None)
+    if principal is None:
+        user = getattr(request, 'user', None)
+        if user is None or not user.is_authenticated:
+            return None
+        principal = load_principal(user)
+        http_request._principal = principal
+    return principal
+
+
+def forget_principals(user_ids):
+    cache.delete_many([PRINCIPAL_CACHE_KEY.format(pk) for pk in user_ids])
@@ -0,0 +1,32 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from . import authentication
+from .models import APIToken, PartnerOrganisation, User
+from .principal import forget_principals
+
+
+@receiver(post_save, sender=APIToken)
+@receiver(post_delete, sender=APIToken)
+def forget_cached_token(sender, instance: APIToken, **kwargs):
+    authentication.forget_token(instance.prefix)
+
+
+@receiver(post_save, sender=User)
+def forget_cached_user(sender, instance: User, update_fields=None, **kwargs):
+    # logins only touch last_login, which API authentication does not read
+    if set(update_fields or ()) != {'last_login'}:
+        authentication.forget_user(instance.pk)
+        forget_principals([instance.pk])
+
+
+@receiver(post_delete, sender=User)
+def forget_deleted_user(sender, instance: User, **kwargs):
+    authentication.forget_user(instance.pk)
+    forget_principals([instance.pk])
+
+
+@receiver(post_save, sender=PartnerOrganisation)
+def forget_organisation_principals(sender, instance: PartnerOrganisation, created, **kwargs):
+    # principals carry the organisation name
+    if not created:
+        forget_principals(instance.users.values_list('pk', flat=True))
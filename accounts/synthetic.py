@@ -0,0 +1,249 @@
+"""Synthetic data at load-testing volume.
+
+Rows are generated batch by batch and written with ``bulk_create``, so memory
+stays bounded by ``batch_size`` whatever the totals. Every user shares one
+precomputed password hash. Values follow rough real-world shapes: a few large
+partners and a long tail, log-normal deal values, and weighted categories,
+statuses and regions. Derived tables are rebuilt once at the end.
+"""
+import random
+from contextlib import contextmanager
+from datetime import timedelta
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.db import transaction
+from django.utils import timezone
+
+from deals import analytics as deal_analytics
+from deals import conflicts as deal_conflicts
+from deals import regions as deal_regions
+from deals import search as deal_search
+from deals import stats as deal_stats
+from deals.models import Deal, DealAudit
+from notifications.models import Notification
+
+from .models import PartnerOrganisation
+
+CATEGORY_WEIGHTS = {'PRINTERS': 30, 'LABELS': 30, 'SCANNERS': 15, 'SOFTWARE': 15, 'RFID': 10}
+DEAL_TYPE_WEIGHTS = {'NEW': 50, 'EXPANSION': 30, 'REPLACEMENT': 20}
+STATUS_WEIGHTS = {
+    'DRAFT': 15, 'SUBMITTED': 20, 'UNDER_REVIEW': 10, 'APPROVED': 20,
+    'REJECTED': 10, 'EXPIRED': 5, 'CLOSED_WON': 10, 'CLOSED_LOST': 10,
+}
+REGION_WEIGHTS = {
+    'UK & Ireland': 30, 'DACH': 15, 'France': 10, 'Benelux': 8, 'Nordics': 7,
+    'Southern Europe': 10, 'North America': 12, 'APAC': 8,
+}
+# the workflow each final status is reached through
+STATUS_PATHS = {
+    'DRAFT': ['DRAFT'],
+    'SUBMITTED': ['DRAFT', 'SUBMITTED'],
+    'UNDER_REVIEW': ['DRAFT', 'SUBMITTED', 'UNDER_REVIEW'],
+    'APPROVED': ['DRAFT', 'SUBMITTED', 'UNDER_REVIEW', 'APPROVED'],
+    'REJECTED': ['DRAFT', 'SUBMITTED', 'UNDER_REVIEW', 'REJECTED'],
+    'EXPIRED': ['DRAFT', 'SUBMITTED', 'APPROVED', 'EXPIRED'],
+    'CLOSED_WON': ['DRAFT', 'SUBMITTED', 'APPROVED', 'CLOSED_WON'],
+    'CLOSED_LOST': ['DRAFT', 'SUBMITTED', 'APPROVED', 'CLOSED_LOST'],
+}
+CUSTOMER_WORDS = ['Acme', 'Global', 'Northern', 'United', 'Summit', 'Harbour', 'Pioneer', 'Crown', 'Atlas', 'Vertex', 'Meridian', 'Orbit']
+CUSTOMER_KINDS = ['Logistics', 'Healthcare', 'Manufacturing', 'Retail', 'Foods', 'Pharma', 'Energy', 'Aerospace', 'Utilities', 'Transport']
+CUSTOMER_SUFFIXES = ['Ltd', 'plc', 'GmbH', 'Inc', 'Group', 'SA', 'BV']
+PROJECT_WORDS = ['Warehouse', 'Line', 'Site', 'Rollout', 'Upgrade', 'Refresh', 'Labelling', 'Tracking', 'Compliance', 'Expansion']
+
+
+class _Weighted:
+    def __init__(self, rng, weights):
+        self.rng = rng
+        self.values = list(weights)
+        self.cum_weights = []
+        total = 0
+        for weight in weights.values():
+            total += weight
+            self.cum_weights.append(total)
+
+    def __call__(self, k=1):
+        picks = self.rng.choices(self.values, cum_weights=self.cum_weights, k=k)
+        return picks if k > 1 else picks[0]
+
+
+@contextmanager
+def explicit_timestamps(*models):
+    """Let bulk inserts keep the created/updated times they were given."""
+    fields = [f for model in models for f in model._meta.concrete_fields if getattr(f, 'auto_now', False) or getattr(f, 'auto_now_add', False)]
+    saved = [(f, f.auto_now, f.auto_now_add) for f in fields]
+    for field in fields:
+        field.auto_now = field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, auto_now, auto_now_add in saved:
+            field.auto_now, field.auto_now_add = auto_now, auto_now_add
+
+
+def _batches(total, size):
+    for start in range(0, total, size):
+        yield start, min(size, total - start)
+
+
+class Generator:
+    def __init__(self, partners=50, users_per_partner=3, brady_users=5, deals=10000, audit_depth=4,
+                 notifications=20000, days=730, batch_size=2000, seed=0, prefix='synthetic', password='synthetic', log=None):
+        self.partner_count = partners
+        self.users_per_partner = users_per_partner
+        self.brady_count = brady_users
+        self.deal_count = deals
+        self.audit_depth = audit_depth
+        self.notification_count = notifications
+        self.days = days
+        self.batch_size = batch_size
+        self.prefix = prefix
+        self.password = password
+        self.rng = random.Random(seed)
+        self.log = log or (lambda message: None)
+        self.now = timezone.now()
+
+    def run(self):
+        with explicit_timestamps(Deal, DealAudit, Notification, PartnerOrganisation):
+            partner_ids, partner_weights = self.create_partners()
+            users = self.create_users(partner_ids)
+            self.create_deals(partner_ids, partner_weights, users)
+            self.create_notifications(users)
+        self.rebuild_derived()
+
+    def create_partners(self):
+        joined = self.now - timedelta(days=self.days)
+        partners = PartnerOrganisation.objects.bulk_create(
+            [PartnerOrganisation(name=f'{self.prefix} partner {i:05d}', created_at=joined, updated_at=joined) for i in range(self.partner_count)],
+            batch_size=self.batch_size,
+        )
+        # a few large partners and a long tail
+        weights = [1 / (rank + 1) ** 0.8 for rank in range(len(partners))]
+        self.log(f'Created {len(partners)} partners')
+        return [p.pk for p in partners], weights
+
+    def create_users(self, partner_ids):
+        User = get_user_model()
+        # one hash for everyone; hashing per user would dominate the run
+        password = make_password(self.password)
+        joined = self.now - timedelta(days=self.days)
+        rows = [
+            User(username=f'{self.prefix}-p{pid}-u{j}', email=f'{self.prefix}-p{pid}-u{j}@example.com', password=password,
+                 role='PARTNER', partner_organisation_id=pid, date_joined=joined)
+            for pid in partner_ids for j in range(self.users_per_partner)
+        ]
+        rows += [
+            User(username=f'{self.prefix}-brady-{i}', email=f'{self.prefix}-brady-{i}@example.com', password=password, role='BRADY', date_joined=joined)
+            for i in range(self.brady_count)
+        ]
+        created = User.objects.bulk_create(rows, batch_size=self.batch_size)
+        self.log(f'Created {len(created)} users')
+        users = {'partner': {}, 'brady': []}
+        for user in created:
+            if user.role == 'BRADY':
+                users['brady'].append(user.pk)
+            else:
+                users['partner'].setdefault(user.partner_organisation_id, []).append(user.pk)
+        return users
+
+    def _deal(self, index, partner_id, owner_ids):
+        rng = self.rng
+        status = self.pick_status()
+        created = self.now - timedelta(days=rng.random() * self.days)
+        path = STATUS_PATHS[status]
+        # each step a few hours to a few weeks after the previous one
+        times = [created]
+        for _ in path[1:]:
+            times.append(min(self.now, times[-1] + timedelta(hours=rng.uniform(2, 24 * 21))))
+        expiry = None
+        if 'APPROVED' in path:
+            approved_at = times[path.index('APPROVED')]
+            expiry = (approved_at + timedelta(days=90)).date()
+            if status == 'EXPIRED':
+                expiry = min(expiry, (self.now - timedelta(days=1)).date())
+        customer = f'{rng.choice(CUSTOMER_WORDS)} {rng.choice(CUSTOMER_KINDS)} {rng.choice(CUSTOMER_SUFFIXES)}'
+        deal = Deal(
+            partner_id=partner_id,
+            end_customer_name=customer,
+            customer_key=deal_conflicts.normalise_customer(customer),
+            project_name=f'{rng.choice(PROJECT_WORDS)} {rng.choice(PROJECT_WORDS)} {index:07d}',
+            estimated_value=Decimal(min(2_000_000, max(500, int(rng.lognormvariate(9.6, 1.0))))),
+            expected_close_date=(created + timedelta(days=rng.randint(30, 270))).date(),
+            product_category=self.pick_category(),
+            region_id=self.pick_region(),
+            deal_type=self.pick_deal_type(),
+            status=status,
+            internal_owner_id=rng.choice(owner_ids) if owner_ids and rng.random() < 0.6 else None,
+            expiry_date=expiry,
+            created_at=created,
+            updated_at=times[-1],
+        )
+        return deal, path, times
+
+    def _history(self, deal, path, times, partner_users, brady_ids):
+        """Workflow rows for the path taken, padded or trimmed to ``audit_depth``."""
+        rng = self.rng
+        rows = []
+        for i in range(1, len(path)):
+            by_partner = path[i] in ('SUBMITTED', 'CLOSED_WON', 'CLOSED_LOST')
+            who = rng.choice(partner_users) if by_partner and partner_users else (rng.choice(brady_ids) if brady_ids and path[i] != 'EXPIRED' else None)
+            rows.append(DealAudit(deal_id=deal.pk, changed_by_id=who, old_status=path[i - 1], new_status=path[i], timestamp=times[i]))
+        while len(rows) < self.audit_depth:
+            at = min(self.now, deal.updated_at + timedelta(hours=rng.uniform(1, 24 * 30)))
+            rows.append(DealAudit(deal_id=deal.pk, changed_by_id=rng.choice(brady_ids) if brady_ids else None,
+                                  old_status=deal.status, new_status=deal.status, timestamp=at, note='Review note'))
+        return rows[-self.audit_depth:] if self.audit_depth else []
+
+    def create_deals(self, partner_ids, partner_weights, users):
+        rng = self.rng
+        self.pick_status = _Weighted(rng, STATUS_WEIGHTS)
+        self.pick_category = _Weighted(rng, CATEGORY_WEIGHTS)
+        self.pick_region = _Weighted(rng, {deal_regions.resolve(name): weight for name, weight in REGION_WEIGHTS.items()})
+        self.pick_deal_type = _Weighted(rng, DEAL_TYPE_WEIGHTS)
+        brady_ids = users['brady']
+        written = 0
+        for start, size in _batches(self.deal_count, self.batch_size):
+            chosen = rng.choices(partner_ids, weights=partner_weights, k=size)
+            generated = [self._deal(start + i, pid, brady_ids) for i, pid in enumerate(chosen)]
+            with transaction.atomic():
+                deals = Deal.objects.bulk_create([d for d, _, _ in generated])
+                audits = []
+                for deal, path, times in generated:
+                    audits.extend(self._history(deal, path, times, users['partner'].get(deal.partner_id, []), brady_ids))
+                DealAudit.objects.bulk_create(audits)
+            written += len(deals)
+            self.log(f'Created {written}/{self.deal_count} deals')
+
+    def create_notifications(self, users):
+        rng = self.rng
+        recipients = [pk for ids in users['partner'].values() for pk in ids] + users['brady']
+        if not recipients:
+            return
+        written = 0
+        for start, size in _batches(self.notification_count, self.batch_size):
+            rows = []
+            for i in range(start, start + size):
+                created = self.now - timedelta(days=rng.random() * self.days)
+                # most changes are made by someone; the rest by the expiry sweep
+                changed_by = rng.choice(recipients) if rng.random() < 0.8 else None
+                if rng.random() < 0.1:
+                    # Brady broadcasts for submissions
+                    rows.append(Notification(audience='BRADY', verb=f'Deal {i} submitted', description='Status changed from DRAFT to SUBMITTED.',
+                                             changed_by_id=changed_by, created_at=created))
+                else:
+                    # older notifications are more likely to have been read
+                    read = rng.random() < min(0.95, (self.now - created).days / 60)
+                    rows.append(Notification(recipient_id=rng.choice(recipients), verb=f'Deal {i} status changed', description='Status changed.',
+                                             changed_by_id=changed_by, created_at=created, read=read))
+            Notification.objects.bulk_create(rows)
+            written += len(rows)
+        self.log(f'Created {written} notifications')
+
+    def rebuild_derived(self):
+        # bulk inserts skip signals, so derived tables are rebuilt in one pass
+        deal_stats.rebuild()
+        deal_search.rebuild()
+        deal_conflicts.rebuild(self.batch_size)
+        deal_analytics.rebuild(batch_size=self.batch_size)
+        self.log('Rebuilt deal stats rollup, search index, duplicate-detection keys and analytics rollups')
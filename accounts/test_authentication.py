@@ -0,0 +1,99 @@
+import base64
+import time
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from accounts.authentication import MISS_SECONDS, sign
+from accounts.checks import check_shared_cache
+from accounts.models import APIToken, PartnerOrganisation
+from deals.models import Deal
+
+User = get_user_model()
+
+
+class APITokenAuthenticationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.org = PartnerOrganisation.objects.create(name='TokenCo')
+        self.other_org = PartnerOrganisation.objects.create(name='OtherCo')
+        self.user = User.objects.create_user(username='integration', password='pass', role='PARTNER', partner_organisation=self.org)
+        Deal.objects.create(partner=self.org, end_customer_name='A', project_name='Mine', estimated_value=1, product_category='PRINTERS', deal_type='NEW')
+        Deal.objects.create(partner=self.other_org, end_customer_name='B', project_name='Theirs', estimated_value=1, product_category='PRINTERS', deal_type='NEW')
+
+    def test_bearer_token_scoped_and_cached(self):
+        token, raw_key = APIToken.objects.create_token(self.user, name='erp')
+        self.assertNotIn(raw_key, token.digest)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {raw_key}')
+        res = self.client.get('/api/deals/')
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual([d['project_name'] for d in res.data['results']], ['Mine'])
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.get('/api/deals/')
+        self.assertFalse(any('accounts_apitoken' in q['sql'] or 'FROM "accounts_user"' in q['sql'] for q in ctx.captured_queries))
+
+    def test_rejects_bad_revoked_and_basic_credentials(self):
+        token, raw_key = APIToken.objects.create_token(self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token.prefix}.wrong')
+        self.assertEqual(self.client.get('/api/deals/').status_code, 401)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {raw_key}')
+        self.assertEqual(self.client.get('/api/deals/').status_code, 200)
+        token.delete()
+        self.assertEqual(self.client.get('/api/deals/').status_code, 401)
+        basic = base64.b64encode(b'integration:pass').decode()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Basic {basic}')
+        self.assertEqual(self.client.get('/api/deals/').status_code, 401)
+
+    def test_deactivating_user_invalidates_cache(self):
+        _, raw_key = APIToken.objects.create_token(self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {raw_key}')
+        self.assertEqual(self.client.get('/api/deals/').status_code, 200)
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.client.get('/api/deals/').status_code, 401)
+
+    def test_signed_requests(self):
+        token, raw_key = APIToken.objects.create_token(self.user, signed=True)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {raw_key}')
+        self.assertEqual(self.client.get('/api/deals/').status_code, 401)
+
+        ts = int(time.time())
+        signature = sign(token.signing_key, RequestFactory().get('/api/deals/?status=DRAFT'), ts)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Signature key={token.prefix},ts={ts},sig={signature}')
+        res = self.client.get('/api/deals/?status=DRAFT')
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(len(res.data['results']), 1)
+        # the signature covers the query string
+        self.assertEqual(self.client.get('/api/deals/?status=APPROVED').status_code, 401)
+        # a captured request cannot be replayed
+        self.client.credentials(HTTP_AUTHORIZATION=f'Signature key={token.prefix},ts={ts},sig={signature}')
+        self.assertEqual(self.client.get('/api/deals/?status=DRAFT').status_code, 401)
+        old = ts - 3600
+        signature = sign(token.signing_key, RequestFactory().get('/api/deals/'), old)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Signature key={token.prefix},ts={old},sig={signature}')
+        self.assertEqual(self.client.get('/api/deals/').status_code, 401)
+
+    def test_new_token_works_soon_after_a_cached_miss(self):
+        token, raw_key = APIToken.objects.create_token(self.user)
+        token.delete()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {raw_key}')
+        self.assertEqual(self.client.get('/api/deals/').status_code, 401)
+        # created by another worker: no signal clears this worker's cached miss
+        APIToken.objects.bulk_create([token])
+        self.assertEqual(self.client.get('/api/deals/').status_code, 401)
+        later = time.time() + MISS_SECONDS + 1
+        with patch('django.core.cache.backends.locmem.time.time', return_value=later):
+            self.assertEqual(self.client.get('/api/deals/').status_code, 200)
+
+
+class SharedCacheCheckTests(SimpleTestCase):
+    def test_deploy_check_warns_about_a_per_process_cache(self):
+        self.assertEqual([w.id for w in check_shared_cache(None)], ['accounts.W001'])
+        with override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': 'redis://cache:6379/0'}}):
+            self.assertEqual(check_shared_cache(None), [])
@@ -0,0 +1,60 @@
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from accounts.models import PartnerOrganisation
+from accounts.principal import load_principal
+from deals.models import Deal
+
+User = get_user_model()
+
+
+class PrincipalTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.org = PartnerOrganisation.objects.create(name='PrincipalCo')
+        self.user = User.objects.create_user(username='pp', password='pass', role='PARTNER', partner_organisation=self.org)
+
+    def test_loaded_with_one_joined_query_then_cached(self):
+        with CaptureQueriesContext(connection) as ctx:
+            principal = load_principal(self.user)
+        self.assertEqual(len(ctx.captured_queries), 1)
+        self.assertIn('JOIN', ctx.captured_queries[0]['sql'])
+        self.assertEqual((principal.role, principal.partner_id, principal.partner_name), ('PARTNER', self.org.pk, 'PrincipalCo'))
+        with self.assertNumQueries(0):
+            load_principal(self.user)
+
+    def test_invalidated_when_user_or_organisation_changes(self):
+        load_principal(self.user)
+        self.org.name = 'Renamed'
+        self.org.save()
+        self.assertEqual(load_principal(self.user).partner_name, 'Renamed')
+        self.user.role = 'BRADY'
+        self.user.partner_organisation = None
+        self.user.save()
+        principal = load_principal(self.user)
+        self.assertTrue(principal.is_staff_role)
+        self.assertIsNone(principal.partner_id)
+
+    def test_stale_entry_is_not_used_after_a_change_without_signals(self):
+        client = APIClient()
+        client.force_login(self.user)
+        self.assertEqual(client.get('/deals/partner/overview/').status_code, 200)
+        # another worker's cache, or a queryset update: nothing drops the cached principal
+        User.objects.filter(pk=self.user.pk).update(role='BRADY', partner_organisation=None)
+        self.assertEqual(client.get('/deals/partner/overview/').status_code, 403)
+        self.assertEqual(client.get('/deals/brady/overview/').status_code, 200)
+
+    def test_api_scoping_compares_ids(self):
+        deal = Deal.objects.create(partner=self.org, end_customer_name='A', project_name='P', estimated_value=1, product_category='PRINTERS', deal_type='NEW')
+        client = APIClient()
+        client.force_authenticate(self.user)
+        client.get(f'/api/deals/{deal.id}/')
+        with CaptureQueriesContext(connection) as ctx:
+            res = client.get(f'/api/deals/{deal.id}/')
+        self.assertEqual(res.status_code, 200)
+        # the deal query joins the partner for display; nothing loads the user's organisation on its own
+        self.assertFalse(any(q['sql'].startswith('SELECT') and 'FROM "accounts_partnerorganisation"' in q['sql'] for q in ctx.captured_queries))
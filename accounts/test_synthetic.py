@@ -0,0 +1,67 @@
+import io
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db.models import Count, Sum
+from django.test import TestCase
+
+from accounts.models import PartnerOrganisation
+from accounts.synthetic import Generator
+from deals.models import Deal, DealAudit, PartnerDealStats
+from notifications.models import Notification
+
+User = get_user_model()
+
+
+class GeneratorTests(TestCase):
+    def generate(self, **kwargs):
+        options = dict(partners=4, users_per_partner=2, brady_users=2, deals=250, audit_depth=3,
+                       notifications=120, batch_size=100, seed=7, prefix='gen')
+        options.update(kwargs)
+        Generator(**options).run()
+
+    def test_volumes_and_shared_password_hash(self):
+        self.generate()
+        self.assertEqual(PartnerOrganisation.objects.count(), 4)
+        self.assertEqual(User.objects.filter(role='PARTNER').count(), 8)
+        self.assertEqual(User.objects.filter(role='BRADY').count(), 2)
+        self.assertEqual(User.objects.values('password').distinct().count(), 1)
+        self.assertTrue(User.objects.get(username='gen-brady-0').check_password('synthetic'))
+        self.assertEqual(Deal.objects.count(), 250)
+        self.assertEqual(DealAudit.objects.count(), 250 * 3)
+        self.assertEqual(Notification.objects.count(), 120)
+
+    def test_rows_are_consistent(self):
+        self.generate()
+        categories = {c for c, _ in Deal.PRODUCT_CATEGORIES}
+        self.assertTrue(set(Deal.objects.values_list('product_category', flat=True)) <= categories)
+        self.assertGreater(Deal.objects.values('status').distinct().count(), 4)
+        self.assertFalse(Deal.objects.filter(region__isnull=True).exists())
+        # the last audit row always ends at the deal's current status
+        for deal in Deal.objects.order_by('?')[:25]:
+            self.assertEqual(deal.audit_trail.order_by('-timestamp', '-pk').first().new_status, deal.status)
+        self.assertFalse(Deal.objects.filter(status='EXPIRED', expiry_date__isnull=True).exists())
+        # internal owners are always Brady staff
+        self.assertFalse(Deal.objects.filter(internal_owner__role='PARTNER').exists())
+
+    def test_same_seed_same_data(self):
+        self.generate(seed=3)
+        first = list(Deal.objects.order_by('pk').values_list('project_name', 'status', 'estimated_value'))
+        Deal.objects.all().delete()
+        PartnerOrganisation.objects.all().delete()
+        User.objects.all().delete()
+        self.generate(seed=3)
+        self.assertEqual(list(Deal.objects.order_by('pk').values_list('project_name', 'status', 'estimated_value')), first)
+
+    def test_stats_rollup_rebuilt(self):
+        self.generate()
+        expected = {(r['partner_id'], r['status']): (r['n'], r['v']) for r in Deal.objects.values('partner_id', 'status').annotate(n=Count('id'), v=Sum('estimated_value'))}
+        actual = {(s.partner_id, s.status): (s.deal_count, s.total_value) for s in PartnerDealStats.objects.filter(deal_count__gt=0)}
+        self.assertEqual(actual, expected)
+
+    def test_seed_demo_scale_mode_refuses_reused_prefix(self):
+        call_command('seed_demo', '--scale', '--partners=2', '--deals=20', '--notifications=5', '--prefix=cmd', stdout=io.StringIO())
+        self.assertEqual(Deal.objects.count(), 20)
+        with self.assertRaises(CommandError):
+            call_command('seed_demo', '--scale', '--partners=2', '--deals=20', '--prefix=cmd', stdout=io.StringIO())
@@ -26,15 +26,18 @@ INSTALLED_APPS = [
     'accounts.apps.AccountsConfig',
     'deals.apps.DealsConfig',
     'notifications.apps.NotificationsConfig',
+    'monitoring.apps.MonitoringConfig',
 ]
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'monitoring.middleware.RequestMetricsMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'monitoring.profiling.ProfilingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -56,6 +59,7 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'accounts.context_processors.principal',
             ],
         },
     },
@@ -92,16 +96,20 @@ STATICFILES_STORAGE = 'django.contrib.staticfiles.storage.ManifestStaticFilesSto
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
-# Caching configuration
+# Caching configuration. API tokens, principals, the region map and navbar bells
+# are invalidated through this cache, so with more than one worker process it must
+# be shared: set CACHE_BACKEND (e.g. django.core.cache.backends.redis.RedisCache)
+# and CACHE_LOCATION (redis://host:6379/0). `manage.py check --deploy` warns while
+# the cache is per-process.
+CACHE_BACKEND = os.getenv('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache')
 CACHES = {
     'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
-        'LOCATION': 'unique-snowflake',
-        'OPTIONS': {
-            'MAX_ENTRIES': 1000
-        }
+        'BACKEND': CACHE_BACKEND,
+        'LOCATION': os.getenv('CACHE_LOCATION', 'unique-snowflake'),
     }
 }
+if CACHE_BACKEND.endswith('.LocMemCache'):
+    CACHES['default']['OPTIONS'] = {'MAX_ENTRIES': 1000}
 
 # Logging configuration for production efficiency
 LOGGING = {
@@ -129,6 +137,12 @@ LOGGING = {
             'level': 'INFO' if DEBUG else 'WARNING',
             'propagate': False,
         },
+        # one JSON line per slow request (monitoring.middleware)
+        'monitoring.requests': {
+            'handlers': ['console'],
+            'level': 'WARNING',
+            'propagate': False,
+        },
     },
 }
 STATIC_URL = '/static/'
@@ -145,8 +159,10 @@ DEFAULT_FROM_EMAIL = os.getenv('DEFAULT_FROM_EMAIL', 'no-reply@brady.example')
 # Django REST Framework
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
+        # API clients use tokens; Basic auth hashed the password on every request
+        'accounts.authentication.TokenAuthentication',
+        'accounts.authentication.SignatureAuthentication',
         'rest_framework.authentication.SessionAuthentication',
-        'rest_framework.authentication.BasicAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': ['rest_framework.permissions.IsAuthenticated'],
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
@@ -159,6 +175,58 @@ CORS_ALLOW_ALL_ORIGINS = True
 # Deal expiry defaults
 DEAL_MIN_EXPIRY_DAYS = int(os.getenv('DEAL_MIN_EXPIRY_DAYS', '90'))
 DEAL_MAX_EXPIRY_DAYS = int(os.getenv('DEAL_MAX_EXPIRY_DAYS', '180'))
+# Deal lists report "N+" instead of running an exact COUNT beyond this many rows
+DEAL_ESTIMATED_COUNT_CAP = int(os.getenv('DEAL_ESTIMATED_COUNT_CAP', '1000'))
+# Duplicate registration checks (deals.conflicts): rows read per blocking key, and
+# the trigram similarity of customer names a candidate needs to be reported
+DEAL_CONFLICT_POSTING_CAP = int(os.getenv('DEAL_CONFLICT_POSTING_CAP', '200'))
+DEAL_CONFLICT_MIN_SIMILARITY = float(os.getenv('DEAL_CONFLICT_MIN_SIMILARITY', '0.5'))
+# Cached region/alias map (deals.regions); dropped on every region or alias change,
+# but only in this process unless the cache is shared, so other workers may use
+# the old map for this long
+REGION_CACHE_SECONDS = int(os.getenv('REGION_CACHE_SECONDS', '60'))
+# Most period buckets one pipeline analytics request (deals.analytics) may ask for
+DEAL_ANALYTICS_MAX_PERIODS = int(os.getenv('DEAL_ANALYTICS_MAX_PERIODS', '400'))
+# Status checkpoints (deals.history) kept by `manage.py snapshot_deal_statuses`
+DEAL_STATUS_SNAPSHOT_KEEP = int(os.getenv('DEAL_STATUS_SNAPSHOT_KEEP', '90'))
+
+# Notification outbox (drained by `manage.py process_outbox`)
+NOTIFICATION_OUTBOX_BATCH_SIZE = int(os.getenv('NOTIFICATION_OUTBOX_BATCH_SIZE', '100'))
+NOTIFICATION_OUTBOX_MAX_ATTEMPTS = int(os.getenv('NOTIFICATION_OUTBOX_MAX_ATTEMPTS', '5'))
+# delay before retrying a failed event, doubled after each further failure
+NOTIFICATION_OUTBOX_RETRY_SECONDS = int(os.getenv('NOTIFICATION_OUTBOX_RETRY_SECONDS', '60'))
+# Navbar bell cache lifetime; use a shared cache backend so invalidation reaches every worker
+NOTIFICATION_BELL_CACHE_SECONDS = int(os.getenv('NOTIFICATION_BELL_CACHE_SECONDS', '300'))
+
+# API tokens: lookup cache lifetime and allowed clock skew for signed requests (a
+# signature is accepted once within it). Revocations reach every worker only
+# through a shared cache
+API_TOKEN_CACHE_SECONDS = int(os.getenv('API_TOKEN_CACHE_SECONDS', '300'))
+API_SIGNATURE_MAX_SKEW = int(os.getenv('API_SIGNATURE_MAX_SKEW', '300'))
+# Cached per-user role/organisation used by permission checks (accounts.principal);
+# an entry is only used while it matches the request's user. Token-authenticated
+# requests read that user from the token cache (API_TOKEN_CACHE_SECONDS)
+PRINCIPAL_CACHE_SECONDS = int(os.getenv('PRINCIPAL_CACHE_SECONDS', '300'))
+
+# Request instrumentation: Server-Timing header and slow-request log thresholds
+SERVER_TIMING_HEADER = os.getenv('SERVER_TIMING_HEADER', 'True') == 'True'
+SLOW_REQUEST_MS = int(os.getenv('SLOW_REQUEST_MS', '500'))
+SLOW_REQUEST_QUERIES = int(os.getenv('SLOW_REQUEST_QUERIES', '50'))
+# a query shape repeated this often in one request is reported as a likely N+1
+REPEATED_QUERY_THRESHOLD = int(os.getenv('REPEATED_QUERY_THRESHOLD', '5'))
+
+# Metrics (/metrics). Set METRICS_DIR to a directory shared by all workers so any
+# of them can report the totals. Scrapers need METRICS_TOKEN or, without one, an
+# address listed in METRICS_ALLOWED_IPS; with neither set /metrics is closed
+METRICS_DIR = os.getenv('METRICS_DIR', '')
+METRICS_FLUSH_SECONDS = int(os.getenv('METRICS_FLUSH_SECONDS', '5'))
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+METRICS_ALLOWED_IPS = [ip for ip in os.getenv('METRICS_ALLOWED_IPS', '').split(',') if ip]
+
+# On-demand profiling for ADMIN users (?_profile=1|sample); viewable at /monitoring/profiles/
+PROFILING_ENABLED = os.getenv('PROFILING_ENABLED', 'True') == 'True'
+PROFILE_DIR = os.getenv('PROFILE_DIR', str(BASE_DIR / 'profiles'))
+PROFILE_KEEP = int(os.getenv('PROFILE_KEEP', '50'))
 
 # Redirects
 LOGIN_REDIRECT_URL = '/deals/dashboard/'  # redirects to role-aware dashboard
@@ -1,6 +1,7 @@
 from django.contrib import admin
 from django.urls import path, include
 from django.views.generic import RedirectView, TemplateView
+from monitoring.views import metrics
 
 urlpatterns = [
     # Root shows a simple demo landing page
@@ -13,4 +14,6 @@ urlpatterns = [
     # Simple server-rendered dashboards & forms
     path('deals/', include('deals.urls')),
     path('notifications/', include('notifications.urls')),
+    path('monitoring/', include('monitoring.urls')),
+    path('metrics', metrics, name='metrics'),
 ]
@@ -1,5 +1,6 @@
 from django.contrib import admin
-from .models import Deal, DealAudit
+from .models import Deal, DealAudit, Region, RegionAlias
+from .search import search
 
 
 @admin.register(Deal)
@@ -8,8 +9,26 @@ class DealAdmin(admin.ModelAdmin):
     list_filter = ('status', 'product_category', 'region', 'deal_type')
     search_fields = ('project_name', 'end_customer_name', 'partner__name')
 
+    def get_search_results(self, request, queryset, search_term):
+        # the full-text index instead of LIKE '%term%' over each search field
+        if not search_term.strip():
+            return queryset, False
+        return search(queryset, search_term), False
+
 
 @admin.register(DealAudit)
 class DealAuditAdmin(admin.ModelAdmin):
     list_display = ('deal', 'old_status', 'new_status', 'changed_by', 'timestamp')
     readonly_fields = ('deal', 'old_status', 'new_status', 'changed_by', 'timestamp', 'note')
+
+
+class RegionAliasInline(admin.TabularInline):
+    model = RegionAlias
+    extra = 1
+
+
+@admin.register(Region)
+class RegionAdmin(admin.ModelAdmin):
+    list_display = ('name', 'code', 'path')
+    search_fields = ('name', 'code', 'aliases__key')
+    inlines = [RegionAliasInline]
@@ -0,0 +1,310 @@
+"""Pipeline analytics from incrementally maintained rollups.
+
+DealRollupTotal holds the current count and value of deals per (partner,
+product category, region, deal type, status). DealDailyRollup holds each
+day's changes to those figures (``net_*``) and the deals that entered each
+status that day (``entered_*``). StatsDelta feeds both from the same deal
+saves, transitions and expiry sweeps that maintain PartnerDealStats, with one
+upsert statement per table.
+
+``report()`` answers any filter and group-by combination from the two tables.
+Flows such as registrations, wins and losses are sums of ``entered_*`` over a
+period. The pipeline at the end of a period is the current total less the net
+changes since then. Neither reads the deal table, so the cost follows the days
+and dimension combinations in range rather than the number of deals.
+"""
+from collections import defaultdict
+from datetime import date, timedelta
+from decimal import Decimal
+
+from django.db import connection
+from django.db.models import Count, F, Q, Sum
+from django.db.models.functions import TruncDate, TruncMonth, TruncQuarter, TruncWeek, TruncYear
+from django.utils import timezone
+
+from accounts.models import PartnerOrganisation
+
+from . import regions
+from .models import Deal, DealAudit, DealDailyRollup, DealRollupTotal
+
+# what management means by "the pipeline" unless a request names statuses
+PIPELINE_STATUSES = ('SUBMITTED', 'UNDER_REVIEW', 'APPROVED')
+WON, LOST = 'CLOSED_WON', 'CLOSED_LOST'
+DIMENSIONS = ('partner', 'product_category', 'region', 'deal_type', 'status')
+INTERVALS = {'day': None, 'week': TruncWeek, 'month': TruncMonth, 'quarter': TruncQuarter, 'year': TruncYear}
+
+_KEY_COLUMNS = ('partner_id', 'product_category', 'region_id', 'deal_type', 'status')
+_UPSERT_CHUNK = 500
+
+
+def dims_of(deal):
+    """The analytics dimensions of a deal besides partner and status."""
+    return (deal.product_category, deal.region_id, deal.deal_type)
+
+
+class RollupDelta:
+    """Accumulates rollup changes per day and dimensions before applying them."""
+
+    def __init__(self):
+        self.daily = defaultdict(lambda: [0, Decimal('0'), 0, Decimal('0')])
+        self.totals = defaultdict(lambda: [0, Decimal('0')])
+
+    def add(self, partner_id, dims, status, count, value, entered=False, day=None):
+        value = Decimal(value or 0)
+        key = (partner_id, *dims, status)
+        total = self.totals[key]
+        total[0] += count
+        total[1] += value
+        daily = self.daily[(day or timezone.localdate(), *key)]
+        daily[0] += count
+        daily[1] += value
+        if entered:
+            daily[2] += count
+            daily[3] += value
+
+    def apply(self):
+        _upsert(DealDailyRollup, ('day', *_KEY_COLUMNS), ('net_count', 'net_value', 'entered_count', 'entered_value'), self.daily)
+        _upsert(DealRollupTotal, _KEY_COLUMNS, ('deal_count', 'total_value'), self.totals)
+        self.daily.clear()
+        self.totals.clear()
+
+
+def _upsert(model, keys, sums, changes):
+    """Add ``changes`` ({key tuple: [sums]}) to ``model`` with INSERT ... ON CONFLICT DO UPDATE."""
+    rows = [(key, values) for key, values in changes.items() if any(values)]
+    if not rows:
+        return
+    qn = connection.ops.quote_name
+    table = qn(model._meta.db_table)
+    # must match the expression in the unique index exactly
+    target = ', '.join(f'COALESCE({qn(k)}, 0)' if k == 'region_id' else qn(k) for k in keys)
+    columns = ', '.join(qn(c) for c in keys + sums)
+    updates = ', '.join(f'{qn(c)} = {table}.{qn(c)} + excluded.{qn(c)}' for c in sums)
+    row_sql = '(' + ', '.join(['%s'] * (len(keys) + len(sums))) + ')'
+    with connection.cursor() as cursor:
+        for i in range(0, len(rows), _UPSERT_CHUNK):
+            chunk = rows[i:i + _UPSERT_CHUNK]
+            cursor.execute(
+                f"INSERT INTO {table} ({columns}) VALUES {', '.join([row_sql] * len(chunk))} "
+                f'ON CONFLICT ({target}) DO UPDATE SET {updates}',
+                [p for key, values in chunk for p in (*key, *values)],
+            )
+
+
+def rebuild(batch_size=2000):
+    """Recompute both rollups from deals and their audit trail.
+
+    Each deal counts as registered in DRAFT on its creation day. Every audited
+    status change moves it on that day at its current value. Whatever the audit
+    trail cannot explain, such as trimmed history or raw SQL edits, is booked
+    today so the totals always match the deal table.
+    """
+    today = timezone.localdate()
+
+    totals = {}
+    for row in Deal.objects.order_by().values(*_KEY_COLUMNS).annotate(n=Count('id'), value=Sum('estimated_value')):
+        totals[tuple(row[c] for c in _KEY_COLUMNS)] = [row['n'], row['value'] or Decimal('0')]
+
+    daily = defaultdict(lambda: [0, Decimal('0'), 0, Decimal('0')])
+    created = Deal.objects.order_by().annotate(day=TruncDate('created_at')).values('day', *_KEY_COLUMNS[:-1]).annotate(n=Count('id'), value=Sum('estimated_value'))
+    for row in created:
+        entry = daily[(row['day'], *(row[c] for c in _KEY_COLUMNS[:-1]), 'DRAFT')]
+        value = row['value'] or Decimal('0')
+        entry[0] += row['n']
+        entry[1] += value
+        entry[2] += row['n']
+        entry[3] += value
+    moves = (
+        DealAudit.objects.order_by().exclude(old_status='').exclude(old_status=F('new_status'))
+        .annotate(day=TruncDate('timestamp'))
+        .values('day', 'deal__partner_id', 'deal__product_category', 'deal__region_id', 'deal__deal_type', 'old_status', 'new_status')
+        .annotate(n=Count('id'), value=Sum('deal__estimated_value'))
+    )
+    for row in moves:
+        dims = (row['deal__partner_id'], row['deal__product_category'], row['deal__region_id'], row['deal__deal_type'])
+        value = row['value'] or Decimal('0')
+        leaving = daily[(row['day'], *dims, row['old_status'])]
+        leaving[0] -= row['n']
+        leaving[1] -= value
+        entering = daily[(row['day'], *dims, row['new_status'])]
+        entering[0] += row['n']
+        entering[1] += value
+        entering[2] += row['n']
+        entering[3] += value
+
+    explained = defaultdict(lambda: [0, Decimal('0')])
+    for (_, *key), (count, value, _, _) in daily.items():
+        explained[tuple(key)][0] += count
+        explained[tuple(key)][1] += value
+    for key in set(totals) | set(explained):
+        count, value = totals.get(key, (0, Decimal('0')))
+        if (count, value) != tuple(explained[key]):
+            correction = daily[(today, *key)]
+            correction[0] += count - explained[key][0]
+            correction[1] += value - explained[key][1]
+
+    DealDailyRollup.objects.all().delete()
+    DealRollupTotal.objects.all().delete()
+    DealRollupTotal.objects.bulk_create(
+        (DealRollupTotal(**dict(zip(_KEY_COLUMNS, key)), deal_count=count, total_value=value) for key, (count, value) in totals.items()),
+        batch_size=batch_size,
+    )
+    DealDailyRollup.objects.bulk_create(
+        (DealDailyRollup(**dict(zip(('day', *_KEY_COLUMNS), key)), net_count=v[0], net_value=v[1], entered_count=v[2], entered_value=v[3])
+         for key, v in daily.items() if any(v)),
+        batch_size=batch_size,
+    )
+
+
+def bucket_start(day, interval):
+    if interval == 'week':
+        return day - timedelta(days=day.weekday())
+    if interval == 'month':
+        return day.replace(day=1)
+    if interval == 'quarter':
+        return day.replace(month=(day.month - 1) // 3 * 3 + 1, day=1)
+    if interval == 'year':
+        return day.replace(month=1, day=1)
+    return day
+
+
+def next_bucket(day, interval):
+    if interval == 'day':
+        return day + timedelta(days=1)
+    if interval == 'week':
+        return day + timedelta(days=7)
+    months = {'month': 1, 'quarter': 3, 'year': 12}[interval]
+    month = day.month - 1 + months
+    return date(day.year + month // 12, month % 12 + 1, 1)
+
+
+def default_range(today=None):
+    """The last twelve calendar months, this one included."""
+    end = today or timezone.localdate()
+    month = end.month - 11
+    return date(end.year + (month - 1) // 12, (month - 1) % 12 + 1, 1), end
+
+
+def report(group_by=(), interval='month', start=None, end=None, statuses=PIPELINE_STATUSES, partners=None,
+           product_categories=None, deal_types=None, region_ids=None):
+    """Pipeline figures per group; see the module docstring.
+
+    ``group_by`` names dimensions from DIMENSIONS, plus ``period`` to split the
+    range into ``interval`` buckets. Filters are lists of allowed values, or
+    None for all. Each row has the group's keys and:
+
+    - ``count``/``value``: deals in ``statuses`` at the end of the period.
+    - ``entered_count``/``entered_value``: deals that moved into ``statuses`` during it.
+    - ``won_*``/``lost_*``/``win_rate``: deals closed won or lost during it,
+      unless the rows are grouped by status.
+    """
+    today = timezone.localdate()
+    default_start, default_end = default_range(today)
+    start, end = start or default_start, min(end or default_end, today)
+    by_period = 'period' in group_by
+    dims = [d for d in DIMENSIONS if d in group_by]
+    columns = [f'{d}_id' if d in ('partner', 'region') else d for d in dims]
+    with_outcomes = 'status' not in dims
+    wanted = set(statuses) | ({WON, LOST} if with_outcomes else set())
+
+    def narrow(qs):
+        qs = qs.order_by().filter(status__in=sorted(wanted))
+        if partners is not None:
+            qs = qs.filter(partner_id__in=partners)
+        if product_categories is not None:
+            qs = qs.filter(product_category__in=product_categories)
+        if deal_types is not None:
+            qs = qs.filter(deal_type__in=deal_types)
+        if region_ids is not None:
+            qs = qs.filter(region_id__in=sorted(region_ids))
+        return qs
+
+    # current stock, then the daily changes since the start of the range
+    stock = defaultdict(lambda: [0, Decimal('0')])
+    for row in narrow(DealRollupTotal.objects).values(*columns, 'status').annotate(n=Sum('deal_count'), value=Sum('total_value')):
+        key = tuple(row[c] for c in columns)
+        if row['status'] in statuses:
+            stock[key][0] += row['n'] or 0
+            stock[key][1] += row['value'] or Decimal('0')
+
+    in_range = Q(day__lte=end)
+    daily = narrow(DealDailyRollup.objects).filter(day__gte=start)
+    if by_period and interval != 'day':
+        daily = daily.annotate(period=INTERVALS[interval]('day'))
+    elif by_period:
+        daily = daily.annotate(period=F('day'))
+    aggregates = daily.values(*(['period'] if by_period else []), *columns, 'status').annotate(
+        net_n=Sum('net_count', filter=in_range), net_v=Sum('net_value', filter=in_range),
+        after_n=Sum('net_count', filter=~in_range), after_v=Sum('net_value', filter=~in_range),
+        entered_n=Sum('entered_count', filter=in_range), entered_v=Sum('entered_value', filter=in_range),
+    )
+    flows = defaultdict(lambda: defaultdict(lambda: [0, Decimal('0'), 0, Decimal('0'), 0, Decimal('0'), 0, Decimal('0')]))
+    for row in aggregates:
+        key = tuple(row[c] for c in columns)
+        period = row['period'] if by_period else None
+        status = row['status']
+        if status in statuses:
+            # changes after the range are undone to find the stock at its end
+            stock[key][0] -= row['after_n'] or 0
+            stock[key][1] -= row['after_v'] or Decimal('0')
+        if period is not None and period > end:
+            continue
+        entry = flows[key][period]
+        if status in statuses:
+            entry[0] += row['net_n'] or 0
+            entry[1] += row['net_v'] or Decimal('0')
+            entry[2] += row['entered_n'] or 0
+            entry[3] += row['entered_v'] or Decimal('0')
+        if status == WON:
+            entry[4] += row['entered_n'] or 0
+            entry[5] += row['entered_v'] or Decimal('0')
+        elif status == LOST:
+            entry[6] += row['entered_n'] or 0
+            entry[7] += row['entered_v'] or Decimal('0')
+
+    if by_period:
+        periods = []
+        period = bucket_start(start, interval)
+        while period <= end:
+            periods.append(period)
+            period = next_bucket(period, interval)
+    else:
+        periods = [None]
+
+    rows = []
+    for key in sorted(set(stock) | set(flows), key=lambda k: tuple((v is None, v) for v in k)):
+        count, value = stock[key]
+        group_rows = []
+        # walk back from the end of the range, undoing each period's changes
+        for period in reversed(periods):
+            entry = flows[key].get(period) if key in flows else None
+            entry = entry or [0, Decimal('0'), 0, Decimal('0'), 0, Decimal('0'), 0, Decimal('0')]
+            row = dict(zip(dims, key))
+            if by_period:
+                row['period'] = period
+            row.update(count=count, value=value, entered_count=entry[2], entered_value=entry[3])
+            if with_outcomes:
+                closed = entry[4] + entry[6]
+                row.update(won_count=entry[4], won_value=entry[5], lost_count=entry[6], lost_value=entry[7],
+                           win_rate=round(entry[4] / closed, 4) if closed else None)
+            if count or any(entry):
+                group_rows.append(row)
+            count -= entry[0]
+            value -= entry[1]
+        rows.extend(reversed(group_rows))
+    label(rows, dims)
+    return {'start': start, 'end': end, 'interval': interval if by_period else None, 'group_by': list(group_by),
+            'statuses': list(statuses), 'rows': rows}
+
+
+def label(rows, dims):
+    """Add partner names and region codes and names to report rows."""
+    if 'partner' in dims:
+        names = dict(PartnerOrganisation.objects.filter(pk__in={r['partner'] for r in rows}).values_list('id', 'name'))
+        for row in rows:
+            row['partner_name'] = names.get(row['partner'])
+    if 'region' in dims:
+        dimension = regions.dimension()['regions']
+        for row in rows:
+            code, name, _ = dimension.get(row['region'], (None, None, None))
+            row['region'], row['region_name'] = code, name
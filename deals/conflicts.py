@@ -0,0 +1,192 @@
+"""Duplicate and conflicting registration detection.
+
+Each deal stores a normalised ``customer_key`` (accents, punctuation and legal
+suffixes removed) and a set of blocking keys in DealBlockingKey: one per
+customer-name token and one per character trigram, all prefixed with the
+product category. Candidates for a deal are the active deals sharing its
+keys; a batch of deals is scored in one query. Each key reads at most ``DEAL_CONFLICT_POSTING_CAP`` newest active rows
+from the ``(key, deal)`` index, so a lookup costs the same across a million deals.
+Candidates are then scored by trigram similarity of their customer keys.
+"""
+import re
+import unicodedata
+
+from django.conf import settings
+from django.db import connection, transaction
+
+from .models import Deal, DealBlockingKey
+
+# words that say nothing about which customer it is
+STOPWORDS = {
+    'ltd', 'limited', 'plc', 'inc', 'incorporated', 'llc', 'llp', 'gmbh', 'ag', 'sa', 'sas', 'srl', 'bv', 'nv',
+    'co', 'corp', 'corporation', 'company', 'group', 'holdings', 'the', 'and', 'of',
+}
+# statuses whose registrations no longer block anyone
+INACTIVE_STATUSES = ('REJECTED', 'EXPIRED', 'CLOSED_LOST')
+# score per shared key: the exact customer key, a token, a trigram
+WEIGHTS = {'k': 10, 't': 3, 'g': 1}
+# UNION ALL branches per scoring query; SQLite allows 500 compound SELECTs
+MAX_UNION_PARTS = 400
+_TOKEN = re.compile(r'[a-z0-9]+')
+
+
+def normalise_customer(name):
+    text = unicodedata.normalize('NFKD', name or '').encode('ascii', 'ignore').decode().lower().replace('&', ' and ')
+    return ' '.join(t for t in _TOKEN.findall(text) if t not in STOPWORDS)[:255]
+
+
+def trigrams(customer_key):
+    compact = customer_key.replace(' ', '')
+    return {compact[i:i + 3] for i in range(len(compact) - 2)}
+
+
+def blocking_keys(customer_key, category):
+    if not customer_key:
+        return []
+    keys = [f'{category}:k:{customer_key[:100]}']
+    keys += [f'{category}:t:{token}' for token in dict.fromkeys(customer_key.split()) if len(token) > 2]
+    keys += [f'{category}:g:{gram}' for gram in sorted(trigrams(customer_key))]
+    return keys
+
+
+def similarity(a, b):
+    grams_a, grams_b = trigrams(a), trigrams(b)
+    if not grams_a or not grams_b:
+        return 1.0 if a == b else 0.0
+    return len(grams_a & grams_b) / len(grams_a | grams_b)
+
+
+def index_deal(deal, created=False):
+    """Replace the deal's blocking keys with ones for its current name and category."""
+    if not created:
+        DealBlockingKey.objects.filter(deal_id=deal.pk).delete()
+    DealBlockingKey.objects.bulk_create(DealBlockingKey(deal_id=deal.pk, key=key) for key in blocking_keys(deal.customer_key, deal.product_category))
+
+
+def rebuild(batch_size=2000):
+    """Recompute every customer key and blocking key, e.g. after bulk loads or raw updates."""
+    with transaction.atomic():
+        DealBlockingKey.objects.all().delete()
+        rows = Deal.objects.order_by('pk').values_list('pk', 'end_customer_name', 'customer_key', 'product_category')
+        stale, keys = [], []
+        for pk, name, customer_key, category in rows.iterator(chunk_size=batch_size):
+            fresh = normalise_customer(name)
+            if fresh != customer_key:
+                stale.append(Deal(pk=pk, customer_key=fresh))
+            keys += [DealBlockingKey(deal_id=pk, key=key) for key in blocking_keys(fresh, category)]
+            if len(keys) >= batch_size:
+                DealBlockingKey.objects.bulk_create(keys)
+                keys = []
+            if len(stale) >= batch_size:
+                Deal.objects.bulk_update(stale, ['customer_key'])
+                stale = []
+        DealBlockingKey.objects.bulk_create(keys, batch_size=batch_size)
+        Deal.objects.bulk_update(stale, ['customer_key'], batch_size=batch_size)
+
+
+def _candidate_scores(keys_by_deal, limit):
+    """``{deal_id: {candidate_id: score}}`` with each deal's ``limit`` best-scoring candidates."""
+    cap = settings.DEAL_CONFLICT_POSTING_CAP
+    qn = connection.ops.quote_name
+    table = qn(DealBlockingKey._meta.db_table)
+    deals = qn(Deal._meta.db_table)
+    inactive = ', '.join(['%s'] * len(INACTIVE_STATUSES))
+    scores = {deal_id: {} for deal_id in keys_by_deal}
+    # a deal's keys always share one statement, so its sums are complete
+    batches, batch = [], []
+    for deal_id, keys in keys_by_deal.items():
+        if batch and sum(len(k) for _, k in batch) + len(keys) > MAX_UNION_PARTS:
+            batches.append(batch)
+            batch = []
+        batch.append((deal_id, keys))
+    if batch:
+        batches.append(batch)
+    for batch in batches:
+        # one capped index range per key; frequent keys cannot blow up the lookup, and
+        # inactive registrations are skipped inside the cap so they cannot crowd out live ones
+        parts, params = [], []
+        for deal_id, keys in batch:
+            for key in keys:
+                parts.append(
+                    f'SELECT * FROM (SELECT %s AS src, b.deal_id, {WEIGHTS[key.split(":", 2)[1]]} AS weight FROM {table} b '
+                    f'JOIN {deals} d ON d.id = b.deal_id '
+                    f'WHERE b.{qn("key")} = %s AND b.deal_id <> %s AND d.status NOT IN ({inactive}) '
+                    f'ORDER BY b.deal_id DESC LIMIT {cap}) k{len(parts)}'
+                )
+                params += [deal_id, key, deal_id, *INACTIVE_STATUSES]
+        sql = (
+            'SELECT src, deal_id, score FROM ('
+            'SELECT src, deal_id, SUM(weight) AS score, '
+            'ROW_NUMBER() OVER (PARTITION BY src ORDER BY SUM(weight) DESC, deal_id DESC) AS position '
+            f"FROM ({' UNION ALL '.join(parts)}) candidates GROUP BY src, deal_id"
+            f') ranked WHERE position <= {int(limit)}'
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            for src, deal_id, score in cursor.fetchall():
+                scores[src][deal_id] = score
+    return scores
+
+
+def find_conflicts_for(deals, limit=20):
+    """``find_conflicts()`` for many deals at once: ``{deal_id: [(candidate, similarity)]}``.
+
+    Costs one scoring query per ``MAX_UNION_PARTS`` blocking keys and one
+    candidate query, however many deals there are.
+    """
+    deals = list(deals)
+    keys = {deal.pk: blocking_keys(deal.customer_key, deal.product_category) for deal in deals}
+    scores = _candidate_scores({pk: k for pk, k in keys.items() if k}, limit * 3)
+    ids = {pk for found in scores.values() for pk in found}
+    candidates = {}
+    if ids:
+        candidates = (
+            Deal.objects.filter(pk__in=sorted(ids))
+            .exclude(status__in=INACTIVE_STATUSES)
+            .select_related('partner')
+            .only('id', 'partner__id', 'partner__name', 'project_name', 'end_customer_name', 'customer_key', 'product_category', 'status', 'estimated_value', 'created_at')
+            .in_bulk()
+        )
+    threshold = settings.DEAL_CONFLICT_MIN_SIMILARITY
+    results = {}
+    for deal in deals:
+        found = scores.get(deal.pk, {})
+        matches = [
+            (c, round(similarity(deal.customer_key, c.customer_key), 3))
+            for c in (candidates.get(pk) for pk in found)
+            if c is not None and c.product_category == deal.product_category
+        ]
+        matches = [m for m in matches if m[1] >= threshold]
+        matches.sort(key=lambda m: (-m[1], -found[m[0].pk], -m[0].pk))
+        results[deal.pk] = matches[:limit]
+    return results
+
+
+def find_conflicts(deal, limit=20):
+    """Active deals that look like registrations of the same customer and product, best first.
+
+    Returns ``[(candidate, similarity)]``; candidates have ``partner`` loaded.
+    """
+    return find_conflicts_for([deal], limit)[deal.pk]
+
+
+def submission_notes(deal_ids):
+    """Audit notes for newly submitted deals that may duplicate another registration."""
+    notes = {}
+    deal_ids = list(deal_ids)
+    if not deal_ids:
+        return notes
+    deals = list(Deal.objects.filter(pk__in=deal_ids).order_by().only('id', 'partner_id', 'customer_key', 'product_category'))
+    partners = {deal.pk: deal.partner_id for deal in deals}
+    for deal_id, matches in find_conflicts_for(deals).items():
+        if not matches:
+            continue
+        others = sum(1 for c, _ in matches if c.partner_id != partners[deal_id])
+        same = len(matches) - others
+        parts = []
+        if others:
+            parts.append(f'{others} from other partners')
+        if same:
+            parts.append(f'{same} from the same partner')
+        notes[deal_id] = f'Possible duplicate registration: {len(matches)} similar deal(s) for this customer and product ({", ".join(parts)}).'
+    return notes
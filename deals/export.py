@@ -0,0 +1,118 @@
+"""Streaming deal export.
+
+Rows are read with ``values_list`` in fixed-size chunks (the partner name comes
+from the join, not from a per-row lookup) and encoded lazily, so an export
+holds at most one chunk in memory regardless of how many deals match.
+"""
+import csv
+import json
+import struct
+import zlib
+
+EXPORT_COLUMNS = ['id', 'partner', 'project_name', 'end_customer_name', 'status', 'estimated_value', 'expiry_date']
+_EXPORT_FIELDS = ['id', 'partner__name', 'project_name', 'end_customer_name', 'status', 'estimated_value', 'expiry_date']
+
+DEFAULT_CHUNK_SIZE = 2000
+
+COLUMNAR_MAGIC = b'BDXC1\n'
+
+
+def iter_rows(qs, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Yield export rows as tuples, in the column order of EXPORT_COLUMNS."""
+    return qs.values_list(*_EXPORT_FIELDS).iterator(chunk_size=chunk_size)
+
+
+def iter_chunks(rows, chunk_size=DEFAULT_CHUNK_SIZE):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _plain(value):
+    if value is None:
+        return None
+    if isinstance(value, (int, str)):
+        return value
+    # Decimal and date values are exported in their canonical string form
+    return str(value)
+
+
+class _Echo:
+    """File-like object whose write() hands the encoded line straight back."""
+
+    def write(self, value):
+        return value
+
+
+def stream_csv(rows, chunk_size=DEFAULT_CHUNK_SIZE):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(EXPORT_COLUMNS)
+    for chunk in iter_chunks(rows, chunk_size):
+        yield ''.join(writer.writerow(['' if v is None else _plain(v) for v in row]) for row in chunk)
+
+
+def stream_ndjson(rows, chunk_size=DEFAULT_CHUNK_SIZE):
+    for chunk in iter_chunks(rows, chunk_size):
+        yield ''.join(
+            json.dumps(dict(zip(EXPORT_COLUMNS, (_plain(v) for v in row))), separators=(',', ':')) + '\n'
+            for row in chunk
+        )
+
+
+def _frame(payload):
+    return struct.pack('>I', len(payload)) + payload
+
+
+def stream_columnar(rows, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Encode rows in a compact, Parquet-style columnar layout.
+
+    The stream is the magic bytes, a length-prefixed JSON header naming the
+    columns, then one row group per chunk: the row count followed by each
+    column as a length-prefixed, zlib-compressed JSON array. A zero row count
+    terminates the stream. ``read_columnar`` is the matching decoder.
+    """
+    yield COLUMNAR_MAGIC + _frame(json.dumps({'version': 1, 'columns': EXPORT_COLUMNS}).encode())
+    for chunk in iter_chunks(rows, chunk_size):
+        parts = [struct.pack('>I', len(chunk))]
+        for column in zip(*chunk):
+            encoded = json.dumps([_plain(v) for v in column], separators=(',', ':')).encode()
+            parts.append(_frame(zlib.compress(encoded)))
+        yield b''.join(parts)
+    yield struct.pack('>I', 0)
+
+
+def _read_exact(fp, size):
+    data = fp.read(size)
+    if len(data) != size:
+        raise ValueError('Truncated columnar export')
+    return data
+
+
+def read_columnar(fp):
+    """Decode a stream written by ``stream_columnar`` into a list of row dicts."""
+    if _read_exact(fp, len(COLUMNAR_MAGIC)) != COLUMNAR_MAGIC:
+        raise ValueError('Not a columnar deal export')
+    (size,) = struct.unpack('>I', _read_exact(fp, 4))
+    columns = json.loads(_read_exact(fp, size))['columns']
+    rows = []
+    while True:
+        (count,) = struct.unpack('>I', _read_exact(fp, 4))
+        if not count:
+            return rows
+        values = []
+        for _ in columns:
+            (size,) = struct.unpack('>I', _read_exact(fp, 4))
+            values.append(json.loads(zlib.decompress(_read_exact(fp, size))))
+        rows.extend(dict(zip(columns, row)) for row in zip(*values))
+
+
+EXPORT_FORMATS = {
+    'csv': (stream_csv, 'text/csv', 'csv'),
+    'ndjson': (stream_ndjson, 'application/x-ndjson', 'ndjson'),
+    'columnar': (stream_columnar, 'application/octet-stream', 'bdxc'),
+}
@@ -1,13 +1,28 @@
 import django_filters
 from .models import Deal
+from . import regions
+from .search import search
 
 
 class DealFilter(django_filters.FilterSet):
+    q = django_filters.CharFilter(method='filter_search')
     status = django_filters.CharFilter(field_name='status')
     partner = django_filters.NumberFilter(field_name='partner__id')
-    region = django_filters.CharFilter(field_name='region', lookup_expr='icontains')
+    # code, name or alias; region_prefix also takes a path such as "emea" and includes sub-regions
+    region = django_filters.CharFilter(method='filter_region')
+    region_prefix = django_filters.CharFilter(method='filter_region_prefix')
     product_category = django_filters.CharFilter(field_name='product_category')
 
     class Meta:
         model = Deal
         fields = ['status', 'partner', 'region', 'product_category']
+
+    def filter_region(self, queryset, name, value):
+        return regions.filter_exact(queryset, value)
+
+    def filter_region_prefix(self, queryset, name, value):
+        return regions.filter_prefix(queryset, value)
+
+    def filter_search(self, queryset, name, value):
+        # full-text match, best first; keyset pages re-sort by search_rank themselves
+        return search(queryset, value).order_by('search_rank', 'id')
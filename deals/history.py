@@ -0,0 +1,121 @@
+"""Point-in-time ("as of") deal statuses from the audit trail.
+
+A deal's status at a moment is the ``new_status`` of its latest audit row at
+or before it. ``deals_as_of()`` finds that for every deal at once with a
+correlated subquery, which the ``(deal, timestamp, id)`` audit index answers with
+one seek per deal. A deal with no audit row by then still has the
+``old_status`` of its first later one, or its current status if it never
+changed.
+
+Status snapshots are checkpoints. ``take_snapshot()`` records every deal's
+status at a moment, and ``manage.py snapshot_deal_statuses`` runs it
+periodically. A query after a checkpoint reads only the audit rows written
+since, and takes any other deal's status from the snapshot. The audit trail
+holds statuses only, so values and the other dimensions are the deals'
+current ones.
+"""
+from decimal import Decimal
+
+from django.db import connection, transaction
+from django.db.models import CharField, Count, F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce, NullIf
+from django.utils import timezone
+
+from . import analytics
+from .models import Deal, DealAudit, DealStatusSnapshot, DealStatusSnapshotRow
+
+_LATEST = object()
+
+
+def latest_snapshot(at):
+    """The newest checkpoint taken at or before ``at``, or None."""
+    return DealStatusSnapshot.objects.filter(taken_at__lte=at).order_by('-taken_at').first()
+
+
+def status_as_of(at, snapshot=None):
+    """An expression for the status of the outer deal at ``at``."""
+    audits = DealAudit.objects.filter(deal=OuterRef('pk')).order_by()
+    changed = audits.filter(timestamp__lte=at)
+    if snapshot is not None:
+        changed = changed.filter(timestamp__gt=snapshot.taken_at)
+    sources = [Subquery(changed.order_by('-timestamp', '-id').values('new_status')[:1])]
+    if snapshot is not None:
+        sources.append(Subquery(DealStatusSnapshotRow.objects.filter(snapshot=snapshot, deal=OuterRef('pk')).values('status')[:1]))
+    # the status a deal was in before its first change after ``at``
+    later = audits.filter(timestamp__gt=at).order_by('timestamp', 'id').values('old_status')[:1]
+    sources.append(NullIf(Subquery(later), Value('')))
+    sources.append(F('status'))
+    return Coalesce(*sources, output_field=CharField())
+
+
+def deals_as_of(at, queryset=None, snapshot=_LATEST):
+    """``queryset`` (default all deals) narrowed to deals that existed at ``at``, annotated with ``as_of_status``.
+
+    ``snapshot`` defaults to the latest checkpoint before ``at``; pass None to read the whole audit trail.
+    """
+    if snapshot is _LATEST:
+        snapshot = latest_snapshot(at)
+    qs = Deal.objects.all() if queryset is None else queryset
+    return qs.order_by().filter(created_at__lte=at).annotate(as_of_status=status_as_of(at, snapshot))
+
+
+def take_snapshot(at=None):
+    """Checkpoint every deal's status at ``at`` (default now) with one INSERT ... SELECT."""
+    at = at or timezone.now()
+    with transaction.atomic():
+        previous = DealStatusSnapshot.objects.filter(taken_at__lt=at).order_by('-taken_at').first()
+        snapshot, _ = DealStatusSnapshot.objects.get_or_create(taken_at=at)
+        snapshot.rows.all().delete()
+        rows = deals_as_of(at, snapshot=previous).values_list('id', 'as_of_status')
+        sql, params = rows.query.sql_with_params()
+        qn = connection.ops.quote_name
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {qn(DealStatusSnapshotRow._meta.db_table)} ({qn("snapshot_id")}, {qn("deal_id")}, {qn("status")}) '
+                f'SELECT %s, * FROM ({sql}) {qn("as_of")}',
+                [snapshot.pk, *params],
+            )
+            snapshot.deal_count = cursor.rowcount
+        snapshot.save(update_fields=['deal_count'])
+    return snapshot
+
+
+def prune_snapshots(keep):
+    """Delete all but the newest ``keep`` checkpoints; returns how many went."""
+    stale = list(DealStatusSnapshot.objects.order_by('-taken_at').values_list('id', flat=True)[keep:])
+    DealStatusSnapshotRow.objects.filter(snapshot_id__in=stale).delete()
+    DealStatusSnapshot.objects.filter(pk__in=stale).delete()
+    return len(stale)
+
+
+def report(at, group_by=('status',), statuses=None, partners=None, product_categories=None, deal_types=None, region_ids=None):
+    """Deal count and value per group as of ``at``.
+
+    ``group_by`` names dimensions from ``analytics.DIMENSIONS``; ``status`` is
+    the status at ``at``. Filters are lists of allowed values, or None for all.
+    """
+    snapshot = latest_snapshot(at)
+    qs = deals_as_of(at, snapshot=snapshot)
+    if statuses is not None:
+        qs = qs.filter(as_of_status__in=statuses)
+    if partners is not None:
+        qs = qs.filter(partner_id__in=partners)
+    if product_categories is not None:
+        qs = qs.filter(product_category__in=product_categories)
+    if deal_types is not None:
+        qs = qs.filter(deal_type__in=deal_types)
+    if region_ids is not None:
+        qs = qs.filter(region_id__in=sorted(region_ids))
+    dims = [d for d in analytics.DIMENSIONS if d in group_by]
+    columns = {'partner': 'partner_id', 'region': 'region_id', 'status': 'as_of_status'}
+    if dims:
+        grouped = qs.values(*(columns.get(d, d) for d in dims)).annotate(n=Count('id'), value=Sum('estimated_value'))
+    else:
+        grouped = [qs.aggregate(n=Count('id'), value=Sum('estimated_value'))]
+    rows = [
+        {**{d: row[columns.get(d, d)] for d in dims}, 'count': row['n'], 'value': row['value'] or Decimal('0')}
+        for row in grouped
+    ]
+    rows.sort(key=lambda r: tuple((r[d] is None, r[d]) for d in dims))
+    analytics.label(rows, dims)
+    return {'at': at, 'snapshot': snapshot.taken_at if snapshot else None, 'group_by': dims, 'rows': rows}
@@ -1,4 +1,6 @@
 from django.core.management.base import BaseCommand
+from django.db import transaction
+from deals import conflicts, search
 from deals.models import Deal
 
 
@@ -7,5 +9,9 @@ class Command(BaseCommand):
 
     def handle(self, *args, **options):
         # In a real implementation, you'd use retention policies, audit and strict logging
-        affected = Deal.objects.exclude(end_customer_name__startswith='ANON').update(end_customer_name='ANONYMIZED')
+        with transaction.atomic():
+            affected = Deal.objects.exclude(end_customer_name__startswith='ANON').update(end_customer_name='ANONYMIZED')
+            # update() skips the signals that keep the search index and blocking keys current
+            search.rebuild()
+            conflicts.rebuild()
         self.stdout.write(self.style.SUCCESS(f'Anonymized {affected} deals'))
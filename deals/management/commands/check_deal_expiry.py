@@ -1,29 +1,139 @@
+from collections import defaultdict
+
 from django.core.management.base import BaseCommand
 from django.utils import timezone
 from datetime import timedelta
 from django.conf import settings
-from deals.models import Deal
-from django.core.mail import send_mail
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Q
+from deals.models import Deal, DealAudit, DealExpiryAlert
+from deals.stats import StatsDelta
+from deals.transitions import count_transitions
+from monitoring.metrics import EMAIL_SEND, EXPIRY_SWEEP, registry
+from django.core.mail import get_connection, send_mail
+
+# deals in these states are finished and are neither expired nor warned about
+FINAL_STATUSES = ('EXPIRED', 'CLOSED_WON', 'CLOSED_LOST')
 
 
 class Command(BaseCommand):
     help = 'Check deal expiry statuses and notify if nearing expiry or expired'
 
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=500)
+        parser.add_argument('--warn-days', type=int, default=7, help='Warn about deals expiring within this many days')
+
     def handle(self, *args, **options):
         today = timezone.now().date()
-        # expire deals past expiry_date
-        expired = Deal.objects.filter(expiry_date__lt=today).exclude(status='EXPIRED')
-        count = expired.update(status='EXPIRED')
+        chunk_size = options['chunk_size']
+        count = self.expire(today, chunk_size)
         self.stdout.write(self.style.SUCCESS(f'Marked {count} deals as EXPIRED'))
 
-        # warn deals approaching expiry in next 7 days
-        warn_date = today + timedelta(days=7)
-        expiring = Deal.objects.filter(expiry_date__range=(today, warn_date)).exclude(status__in=('EXPIRED', 'CLOSED_WON', 'CLOSED_LOST'))
-        for deal in expiring:
-            recipients = [u.email for u in deal.partner.users.all() if u.email]
-            if deal.internal_owner and deal.internal_owner.email:
-                recipients.append(deal.internal_owner.email)
-            recipients = list(set(recipients))
-            if recipients:
-                send_mail(f'Deal {deal} nearing expiry', f'Deal {deal} will expire on {deal.expiry_date}', settings.DEFAULT_FROM_EMAIL, recipients, fail_silently=True)
-        self.stdout.write(self.style.SUCCESS(f'Alerted {expiring.count()} deals nearing expiry'))
+        warn_date = today + timedelta(days=options['warn_days'])
+        alerted, emails, failed = self.warn(today, warn_date, chunk_size)
+        self.stdout.write(self.style.SUCCESS(f'Alerted {alerted} deals nearing expiry ({emails} digest emails)'))
+        if failed:
+            self.stderr.write(f'{failed} digest emails failed; their deals will be retried on the next run')
+
+        EXPIRY_SWEEP.inc(result='runs')
+        EXPIRY_SWEEP.inc(count, result='expired')
+        EXPIRY_SWEEP.inc(alerted, result='alerted')
+        EXPIRY_SWEEP.inc(emails, result='digests')
+        EXPIRY_SWEEP.inc(failed, result='failed_digests')
+        registry.flush()
+
+    def expire(self, today, chunk_size):
+        """Expire past-due deals chunk by chunk, writing their audit rows in bulk."""
+        pending = Deal.objects.filter(expiry_date__lt=today).exclude(status__in=FINAL_STATUSES).order_by('id')
+        total = 0
+        while True:
+            with transaction.atomic():
+                rows = list(pending.values_list('id', 'status', 'partner_id', 'estimated_value', 'product_category', 'region_id', 'deal_type')[:chunk_size])
+                if not rows:
+                    return total
+                by_status = defaultdict(list)
+                for row in rows:
+                    by_status[row[1]].append(row)
+                delta = StatsDelta()
+                audits = []
+                for old_status, group in by_status.items():
+                    ids = [r[0] for r in group]
+                    # re-check the status so a concurrent transition is not overwritten
+                    updated = Deal.objects.filter(pk__in=ids, status=old_status).update(status='EXPIRED', updated_at=timezone.now())
+                    if updated != len(ids):
+                        ids = set(Deal.objects.filter(pk__in=ids, status='EXPIRED').values_list('id', flat=True))
+                        group = [r for r in group if r[0] in ids]
+                    for deal_id, _, partner_id, value, *dims in group:
+                        delta.move(partner_id, old_status, 'EXPIRED', value, dims=tuple(dims))
+                        audits.append(DealAudit(deal_id=deal_id, old_status=old_status, new_status='EXPIRED', note='Expired by check_deal_expiry'))
+                DealAudit.objects.bulk_create(audits)
+                # bulk update bypasses signals; keep the stats and analytics rollups in step by hand
+                delta.apply()
+                count_transitions((a.old_status, 'EXPIRED') for a in audits)
+                total += len(audits)
+
+    def warn(self, today, warn_date, chunk_size):
+        """Email each recipient a digest of their deals nearing expiry, chunk by chunk.
+
+        A recipient gets one digest per chunk of deals that lists theirs. A deal is
+        recorded as alerted for its current expiry date, so reruns skip it, once
+        every digest that lists it has gone out; deals in a failed or interrupted
+        send are tried again by the next run. Returns ``(alerted, sent, failed)``.
+        """
+        User = get_user_model()
+        already_alerted = DealExpiryAlert.objects.filter(deal=OuterRef('pk'), expiry_date=OuterRef('expiry_date'))
+        expiring = (
+            Deal.objects.filter(expiry_date__range=(today, warn_date))
+            .exclude(status__in=FINAL_STATUSES)
+            .filter(~Exists(already_alerted))
+            .order_by('id')
+            .values_list('id', 'project_name', 'end_customer_name', 'partner_id', 'partner__name', 'internal_owner_id', 'expiry_date')
+        )
+
+        connection = get_connection()
+        alerted = sent = failed = 0
+        last_id = 0
+        while True:
+            chunk = list(expiring.filter(pk__gt=last_id)[:chunk_size])
+            if not chunk:
+                break
+            last_id = chunk[-1][0]
+            partner_ids = {row[3] for row in chunk}
+            owner_ids = {row[5] for row in chunk if row[5]}
+            # all recipients for the chunk in one query
+            users = User.objects.filter(Q(partner_organisation_id__in=partner_ids) | Q(pk__in=owner_ids)).exclude(email='')
+            by_partner = defaultdict(set)
+            emails = {}
+            for user_id, email, partner_id in users.values_list('id', 'email', 'partner_organisation_id'):
+                emails[user_id] = email
+                if partner_id:
+                    by_partner[partner_id].add(email)
+            digests = defaultdict(list)
+            recipients_of = {}
+            for deal_id, project, customer, partner_id, partner_name, owner_id, expiry in chunk:
+                recipients = set(by_partner.get(partner_id, ()))
+                if owner_id in emails:
+                    recipients.add(emails[owner_id])
+                line = f'Deal {project or customer} - {partner_name} will expire on {expiry}'
+                for email in recipients:
+                    digests[email].append(line)
+                recipients_of[deal_id] = (expiry, recipients)
+
+            delivered = set()
+            with EMAIL_SEND.time(source='expiry'):
+                for email, lines in digests.items():
+                    subject = f'{len(lines)} deal(s) nearing expiry'
+                    try:
+                        send_mail(subject, '\n'.join(lines), settings.DEFAULT_FROM_EMAIL, [email], connection=connection)
+                    except Exception as exc:
+                        self.stderr.write(f'Could not send the expiry digest to {email}: {exc}')
+                    else:
+                        delivered.add(email)
+            alerts = [DealExpiryAlert(deal_id=deal_id, expiry_date=expiry) for deal_id, (expiry, recipients) in recipients_of.items() if recipients <= delivered]
+            with transaction.atomic():
+                DealExpiryAlert.objects.bulk_create(alerts, ignore_conflicts=True)
+            alerted += len(alerts)
+            sent += len(delivered)
+            failed += len(digests) - len(delivered)
+        return alerted, sent, failed
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from deals import analytics
+from deals.models import DealDailyRollup, DealRollupTotal
+
+
+class Command(BaseCommand):
+    help = 'Recompute the pipeline analytics rollups from deals and their audit trail'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        analytics.rebuild(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Rebuilt {DealRollupTotal.objects.count()} total and {DealDailyRollup.objects.count()} daily rollup rows'
+        ))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from deals import conflicts
+from deals.models import DealBlockingKey
+
+
+class Command(BaseCommand):
+    help = 'Recompute customer keys and duplicate-detection blocking keys for every deal'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        conflicts.rebuild(options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Wrote {DealBlockingKey.objects.count()} blocking keys'))
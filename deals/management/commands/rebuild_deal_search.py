@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from deals import search
+from deals.models import DealSearchEntry
+
+
+class Command(BaseCommand):
+    help = 'Refill the deal full-text search index from the deal table'
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            search.rebuild()
+        self.stdout.write(self.style.SUCCESS(f'Indexed {DealSearchEntry.objects.count()} deals'))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+from deals.models import PartnerDealStats
+from deals.stats import rebuild
+
+
+class Command(BaseCommand):
+    help = 'Recompute the per-partner deal statistics rollup from the deal table'
+
+    def handle(self, *args, **options):
+        rebuild()
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {PartnerDealStats.objects.count()} partner/status rows'))
@@ -0,0 +1,16 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from deals import history
+
+
+class Command(BaseCommand):
+    help = 'Checkpoint every deal status so as-of queries only read newer audit rows'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--keep', type=int, default=settings.DEAL_STATUS_SNAPSHOT_KEEP, help='How many of the newest checkpoints to keep')
+
+    def handle(self, *args, **options):
+        snapshot = history.take_snapshot()
+        pruned = history.prune_snapshots(max(options['keep'], 1))
+        self.stdout.write(self.style.SUCCESS(f'Recorded {snapshot.deal_count} deal statuses at {snapshot.taken_at:%Y-%m-%d %H:%M}; pruned {pruned} old checkpoints'))
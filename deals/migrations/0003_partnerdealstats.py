@@ -0,0 +1,40 @@
+# Generated by Django 4.2.30 on 2026-10-18 16:19
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def populate_stats(apps, schema_editor):
+    Deal = apps.get_model('deals', 'Deal')
+    PartnerDealStats = apps.get_model('deals', 'PartnerDealStats')
+    grouped = Deal.objects.order_by().values('partner_id', 'status').annotate(n=models.Count('id'), value=models.Sum('estimated_value'))
+    PartnerDealStats.objects.bulk_create([
+        PartnerDealStats(partner_id=row['partner_id'], status=row['status'], deal_count=row['n'], total_value=row['value'] or 0)
+        for row in grouped
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0002_alter_partnerorganisation_created_at_and_more'),
+        ('deals', '0002_alter_deal_created_at_alter_deal_end_customer_name_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PartnerDealStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('DRAFT', 'Draft'), ('SUBMITTED', 'Submitted'), ('UNDER_REVIEW', 'Under Review'), ('APPROVED', 'Approved'), ('REJECTED', 'Rejected'), ('EXPIRED', 'Expired'), ('CLOSED_WON', 'Closed Won'), ('CLOSED_LOST', 'Closed Lost')], max_length=20)),
+                ('deal_count', models.IntegerField(default=0)),
+                ('total_value', models.DecimalField(decimal_places=2, default=0, max_digits=16)),
+                ('partner', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='deal_stats', to='accounts.partnerorganisation')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='partnerdealstats',
+            constraint=models.UniqueConstraint(fields=('partner', 'status'), name='uniq_partner_deal_stats'),
+        ),
+        migrations.RunPython(populate_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 4.2.30 on 2026-10-18 16:21
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('deals', '0003_partnerdealstats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DealExpiryAlert',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('expiry_date', models.DateField()),
+                ('alerted_at', models.DateTimeField(auto_now_add=True)),
+                ('deal', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='expiry_alerts', to='deals.deal')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='dealexpiryalert',
+            constraint=models.UniqueConstraint(fields=('deal', 'expiry_date'), name='uniq_deal_expiry_alert'),
+        ),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 4.2.30 on 2026-10-18 16:59
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+# kept inline so the migration does not change when deals.search does
+SQLITE_CREATE = [
+    "CREATE VIRTUAL TABLE deals_deal_fts USING fts5(project_name, end_customer_name, description, partner_name, tokenize='unicode61 remove_diacritics 2')",
+    "INSERT INTO deals_deal_fts(deals_deal_fts, rank) VALUES ('rank', 'bm25(10.0, 5.0, 1.0, 3.0)')",
+    'INSERT INTO deals_deal_fts(rowid, project_name, end_customer_name, description, partner_name) '
+    'SELECT d.id, d.project_name, d.end_customer_name, d.description, p.name '
+    'FROM deals_deal d JOIN accounts_partnerorganisation p ON p.id = d.partner_id',
+]
+POSTGRES_CREATE = [
+    'CREATE TABLE deals_deal_fts (rowid bigint PRIMARY KEY REFERENCES deals_deal (id) ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED, deals_deal_fts tsvector NOT NULL)',
+    'CREATE INDEX deals_deal_fts_gin ON deals_deal_fts USING gin (deals_deal_fts)',
+    "INSERT INTO deals_deal_fts (rowid, deals_deal_fts) SELECT d.id, "
+    "setweight(to_tsvector('simple', d.project_name), 'A') || setweight(to_tsvector('simple', d.end_customer_name), 'B') "
+    "|| setweight(to_tsvector('simple', p.name), 'B') || setweight(to_tsvector('simple', d.description), 'C') "
+    'FROM deals_deal d JOIN accounts_partnerorganisation p ON p.id = d.partner_id',
+]
+
+
+def create_search_index(apps, schema_editor):
+    statements = {'sqlite': SQLITE_CREATE, 'postgresql': POSTGRES_CREATE}.get(schema_editor.connection.vendor, [])
+    for sql in statements:
+        schema_editor.execute(sql)
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor in ('sqlite', 'postgresql'):
+        schema_editor.execute('DROP TABLE IF EXISTS deals_deal_fts')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('deals', '0004_dealexpiryalert'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DealSearchEntry',
+            fields=[
+                ('deal', models.OneToOneField(db_column='rowid', db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='search_entry', serialize=False, to='deals.deal')),
+                ('document', models.TextField(db_column='deals_deal_fts')),
+                ('rank', models.FloatField()),
+            ],
+            options={
+                'db_table': 'deals_deal_fts',
+                'managed': False,
+            },
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,81 @@
+# Generated by Django 4.2.30 on 2026-10-18 17:07
+
+import re
+import unicodedata
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+# kept inline so the migration does not change when deals.conflicts does
+STOPWORDS = {
+    'ltd', 'limited', 'plc', 'inc', 'incorporated', 'llc', 'llp', 'gmbh', 'ag', 'sa', 'sas', 'srl', 'bv', 'nv',
+    'co', 'corp', 'corporation', 'company', 'group', 'holdings', 'the', 'and', 'of',
+}
+TOKEN = re.compile(r'[a-z0-9]+')
+
+
+def normalise_customer(name):
+    text = unicodedata.normalize('NFKD', name or '').encode('ascii', 'ignore').decode().lower().replace('&', ' and ')
+    return ' '.join(t for t in TOKEN.findall(text) if t not in STOPWORDS)[:255]
+
+
+def blocking_keys(customer_key, category):
+    if not customer_key:
+        return []
+    compact = customer_key.replace(' ', '')
+    keys = [f'{category}:k:{customer_key[:100]}']
+    keys += [f'{category}:t:{token}' for token in dict.fromkeys(customer_key.split()) if len(token) > 2]
+    keys += [f'{category}:g:{gram}' for gram in sorted({compact[i:i + 3] for i in range(len(compact) - 2)})]
+    return keys
+
+
+def backfill_customer_keys(apps, schema_editor):
+    Deal = apps.get_model('deals', 'Deal')
+    DealBlockingKey = apps.get_model('deals', 'DealBlockingKey')
+    deals, keys = [], []
+    for pk, name, category in Deal.objects.order_by('pk').values_list('pk', 'end_customer_name', 'product_category').iterator(chunk_size=2000):
+        customer_key = normalise_customer(name)
+        deals.append(Deal(pk=pk, customer_key=customer_key))
+        keys += [DealBlockingKey(deal_id=pk, key=key) for key in blocking_keys(customer_key, category)]
+        if len(deals) >= 2000:
+            Deal.objects.bulk_update(deals, ['customer_key'])
+            DealBlockingKey.objects.bulk_create(keys)
+            deals, keys = [], []
+    Deal.objects.bulk_update(deals, ['customer_key'])
+    DealBlockingKey.objects.bulk_create(keys)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('deals', '0005_deal_search'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DealBlockingKey',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=120)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='deal',
+            name='customer_key',
+            field=models.CharField(blank=True, editable=False, max_length=255),
+        ),
+        migrations.AddIndex(
+            model_name='deal',
+            index=models.Index(fields=['customer_key', 'product_category'], name='deals_deal_custome_1f95a2_idx'),
+        ),
+        migrations.AddField(
+            model_name='dealblockingkey',
+            name='deal',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='blocking_keys', to='deals.deal'),
+        ),
+        migrations.AddConstraint(
+            model_name='dealblockingkey',
+            constraint=models.UniqueConstraint(fields=('key', 'deal'), name='uniq_deal_blocking_key'),
+        ),
+        migrations.RunPython(backfill_customer_keys, migrations.RunPython.noop),
+    ]
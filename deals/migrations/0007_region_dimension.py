@@ -0,0 +1,135 @@
+# Generated by Django 4.2.30 on 2026-10-18 17:16
+
+import re
+import unicodedata
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+# kept inline so the migration does not change when deals.regions does
+SEPARATORS = re.compile(r'[^a-z0-9/]+')
+DROPPED = re.compile(r"[.']")
+
+
+def normalise_region(text):
+    text = unicodedata.normalize('NFKD', text or '').encode('ascii', 'ignore').decode().lower().replace('&', ' and ')
+    return ' '.join(SEPARATORS.sub(' ', DROPPED.sub('', text)).split())
+
+
+# (code, name, parent code, aliases)
+REGIONS = [
+    ('EMEA', 'EMEA', None, ['europe', 'europe middle east and africa']),
+    ('UKI', 'UK & Ireland', 'EMEA', ['uk', 'united kingdom', 'great britain', 'gb', 'ireland', 'uk ireland']),
+    ('DACH', 'DACH', 'EMEA', ['germany', 'austria', 'switzerland', 'deutschland']),
+    ('FR', 'France', 'EMEA', []),
+    ('BENELUX', 'Benelux', 'EMEA', ['belgium', 'netherlands', 'holland', 'luxembourg']),
+    ('NORDICS', 'Nordics', 'EMEA', ['nordic', 'scandinavia', 'sweden', 'norway', 'denmark', 'finland']),
+    ('SEUR', 'Southern Europe', 'EMEA', ['spain', 'portugal', 'italy', 'greece', 'iberia']),
+    ('AMER', 'Americas', None, ['america']),
+    ('NA', 'North America', 'AMER', ['usa', 'us', 'united states', 'canada']),
+    ('LATAM', 'Latin America', 'AMER', ['south america', 'mexico', 'brazil']),
+    ('APAC', 'APAC', None, ['asia pacific', 'asia', 'australia', 'anz']),
+]
+
+
+def seed_regions(apps, schema_editor):
+    Region = apps.get_model('deals', 'Region')
+    RegionAlias = apps.get_model('deals', 'RegionAlias')
+    paths = {}
+    for code, name, parent, aliases in REGIONS:
+        paths[code] = f'{paths[parent]}/{code.lower()}' if parent else code.lower()
+        region = Region.objects.create(code=code, name=name, path=paths[code])
+        RegionAlias.objects.bulk_create(RegionAlias(region=region, key=normalise_region(alias)) for alias in aliases)
+
+
+def backfill_regions(apps, schema_editor):
+    """Point each deal at the region its free-text value names; unknown spellings become regions under Other."""
+    Deal = apps.get_model('deals', 'Deal')
+    Region = apps.get_model('deals', 'Region')
+    RegionAlias = apps.get_model('deals', 'RegionAlias')
+    keys = dict(RegionAlias.objects.values_list('key', 'region_id'))
+
+    def learn(region):
+        for key in (normalise_region(region.code), normalise_region(region.name), region.path):
+            keys.setdefault(key, region.pk)
+
+    for region in Region.objects.all():
+        learn(region)
+    other = None
+    texts = Deal.objects.exclude(region_text='').order_by().values_list('region_text', flat=True).distinct()
+    for text in texts:
+        key = normalise_region(text)
+        if not key:
+            continue
+        if key not in keys and other is None:
+            other, _ = Region.objects.get_or_create(code='OTHER', defaults={'name': 'Other', 'path': 'other'})
+            learn(other)
+        if key not in keys:
+            code = re.sub(r'[^A-Z0-9]', '', key.upper())[:20] or f'R{len(keys)}'
+            while Region.objects.filter(code=code).exists():
+                code = f'{code[:16]}{len(keys)}'
+            name = text.strip()[:100]
+            while Region.objects.filter(name=name).exists():
+                name = f'{name[:90]} ({code})'
+            region = Region.objects.create(code=code, name=name, path=f'{other.path}/{code.lower()}')
+            RegionAlias.objects.get_or_create(key=key, defaults={'region': region})
+            keys[key] = region.pk
+            learn(region)
+        Deal.objects.filter(region_text=text).update(region=keys[key])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('deals', '0006_deal_conflicts'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Region',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('code', models.CharField(max_length=20, unique=True)),
+                ('name', models.CharField(max_length=100, unique=True)),
+                ('path', models.CharField(max_length=200, unique=True)),
+            ],
+            options={
+                'ordering': ['path'],
+            },
+        ),
+        migrations.CreateModel(
+            name='RegionAlias',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=200, unique=True)),
+                ('region', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='aliases', to='deals.region')),
+            ],
+            options={
+                'verbose_name_plural': 'Region aliases',
+            },
+        ),
+        migrations.RunPython(seed_regions, migrations.RunPython.noop),
+        migrations.RenameField(
+            model_name='deal',
+            old_name='region',
+            new_name='region_text',
+        ),
+        migrations.AddField(
+            model_name='deal',
+            name='region',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='deals', to='deals.region'),
+        ),
+        migrations.RunPython(backfill_regions, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='deal',
+            name='region_text',
+        ),
+        migrations.AddIndex(
+            model_name='deal',
+            index=models.Index(fields=['region', 'status', 'estimated_value'], name='deals_deal_region__f8b685_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='deal',
+            index=models.Index(fields=['partner', 'region', 'status', 'estimated_value'], name='deals_deal_partner_5cac57_idx'),
+        ),
+    ]
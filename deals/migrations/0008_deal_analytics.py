@@ -0,0 +1,127 @@
+# Generated by Django 4.2.30 on 2026-10-18 17:23
+
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import migrations, models
+from django.db.models import Count, F, Sum
+import django.db.models.deletion
+import django.db.models.functions.comparison
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+# kept inline so the migration does not change when deals.analytics does
+KEY_COLUMNS = ('partner_id', 'product_category', 'region_id', 'deal_type', 'status')
+
+
+def backfill_rollups(apps, schema_editor):
+    """Fill both rollups from deals and their audit trail.
+
+    Each deal counts as registered in DRAFT on its creation day and moves on
+    each audited status change; whatever that does not explain is booked today.
+    """
+    Deal = apps.get_model('deals', 'Deal')
+    DealAudit = apps.get_model('deals', 'DealAudit')
+    Daily = apps.get_model('deals', 'DealDailyRollup')
+    Total = apps.get_model('deals', 'DealRollupTotal')
+    today = timezone.localdate()
+
+    totals = {}
+    for row in Deal.objects.order_by().values(*KEY_COLUMNS).annotate(n=Count('id'), value=Sum('estimated_value')):
+        totals[tuple(row[c] for c in KEY_COLUMNS)] = [row['n'], row['value'] or Decimal('0')]
+
+    daily = defaultdict(lambda: [0, Decimal('0'), 0, Decimal('0')])
+
+    def book(key, count, value, entered):
+        entry = daily[key]
+        entry[0] += count
+        entry[1] += value
+        if entered:
+            entry[2] += count
+            entry[3] += value
+
+    created = Deal.objects.order_by().annotate(day=TruncDate('created_at')).values('day', *KEY_COLUMNS[:-1]).annotate(n=Count('id'), value=Sum('estimated_value'))
+    for row in created:
+        book((row['day'], *(row[c] for c in KEY_COLUMNS[:-1]), 'DRAFT'), row['n'], row['value'] or Decimal('0'), True)
+    moves = (
+        DealAudit.objects.order_by().exclude(old_status='').exclude(old_status=F('new_status'))
+        .annotate(day=TruncDate('timestamp'))
+        .values('day', 'deal__partner_id', 'deal__product_category', 'deal__region_id', 'deal__deal_type', 'old_status', 'new_status')
+        .annotate(n=Count('id'), value=Sum('deal__estimated_value'))
+    )
+    for row in moves:
+        dims = (row['deal__partner_id'], row['deal__product_category'], row['deal__region_id'], row['deal__deal_type'])
+        value = row['value'] or Decimal('0')
+        book((row['day'], *dims, row['old_status']), -row['n'], -value, False)
+        book((row['day'], *dims, row['new_status']), row['n'], value, True)
+
+    explained = defaultdict(lambda: [0, Decimal('0')])
+    for (_, *key), (count, value, _, _) in list(daily.items()):
+        explained[tuple(key)][0] += count
+        explained[tuple(key)][1] += value
+    for key in set(totals) | set(explained):
+        count, value = totals.get(key, (0, Decimal('0')))
+        book((today, *key), count - explained[key][0], value - explained[key][1], False)
+
+    Total.objects.bulk_create(
+        (Total(**dict(zip(KEY_COLUMNS, key)), deal_count=count, total_value=value) for key, (count, value) in totals.items()),
+        batch_size=2000,
+    )
+    Daily.objects.bulk_create(
+        (Daily(**dict(zip(('day', *KEY_COLUMNS), key)), net_count=v[0], net_value=v[1], entered_count=v[2], entered_value=v[3])
+         for key, v in daily.items() if any(v)),
+        batch_size=2000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0003_api_tokens'),
+        ('deals', '0007_region_dimension'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DealRollupTotal',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('product_category', models.CharField(choices=[('PRINTERS', 'Printers'), ('LABELS', 'Labels'), ('RFID', 'RFID'), ('SCANNERS', 'Scanners'), ('SOFTWARE', 'Software')], max_length=50)),
+                ('deal_type', models.CharField(choices=[('NEW', 'New'), ('EXPANSION', 'Expansion'), ('REPLACEMENT', 'Replacement')], max_length=20)),
+                ('status', models.CharField(choices=[('DRAFT', 'Draft'), ('SUBMITTED', 'Submitted'), ('UNDER_REVIEW', 'Under Review'), ('APPROVED', 'Approved'), ('REJECTED', 'Rejected'), ('EXPIRED', 'Expired'), ('CLOSED_WON', 'Closed Won'), ('CLOSED_LOST', 'Closed Lost')], max_length=20)),
+                ('deal_count', models.IntegerField(default=0)),
+                ('total_value', models.DecimalField(decimal_places=2, default=0, max_digits=16)),
+                ('partner', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='accounts.partnerorganisation')),
+                ('region', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='deals.region')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='DealDailyRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('product_category', models.CharField(choices=[('PRINTERS', 'Printers'), ('LABELS', 'Labels'), ('RFID', 'RFID'), ('SCANNERS', 'Scanners'), ('SOFTWARE', 'Software')], max_length=50)),
+                ('deal_type', models.CharField(choices=[('NEW', 'New'), ('EXPANSION', 'Expansion'), ('REPLACEMENT', 'Replacement')], max_length=20)),
+                ('status', models.CharField(choices=[('DRAFT', 'Draft'), ('SUBMITTED', 'Submitted'), ('UNDER_REVIEW', 'Under Review'), ('APPROVED', 'Approved'), ('REJECTED', 'Rejected'), ('EXPIRED', 'Expired'), ('CLOSED_WON', 'Closed Won'), ('CLOSED_LOST', 'Closed Lost')], max_length=20)),
+                ('entered_count', models.IntegerField(default=0)),
+                ('entered_value', models.DecimalField(decimal_places=2, default=0, max_digits=16)),
+                ('net_count', models.IntegerField(default=0)),
+                ('net_value', models.DecimalField(decimal_places=2, default=0, max_digits=16)),
+                ('partner', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='accounts.partnerorganisation')),
+                ('region', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='deals.region')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='dealrolluptotal',
+            constraint=models.UniqueConstraint(models.F('partner'), models.F('product_category'), django.db.models.functions.comparison.Coalesce('region', 0), models.F('deal_type'), models.F('status'), name='uniq_deal_rollup_total'),
+        ),
+        migrations.AddIndex(
+            model_name='dealdailyrollup',
+            index=models.Index(fields=['partner', 'day'], name='deals_deald_partner_a3a587_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='dealdailyrollup',
+            constraint=models.UniqueConstraint(models.F('day'), models.F('partner'), models.F('product_category'), django.db.models.functions.comparison.Coalesce('region', 0), models.F('deal_type'), models.F('status'), name='uniq_deal_daily_rollup'),
+        ),
+        migrations.RunPython(backfill_rollups, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 4.2.30 on 2026-10-18 17:37
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('deals', '0008_deal_analytics'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DealStatusSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('taken_at', models.DateTimeField(unique=True)),
+                ('deal_count', models.IntegerField(default=0)),
+            ],
+            options={
+                'ordering': ['-taken_at'],
+            },
+        ),
+        migrations.CreateModel(
+            name='DealStatusSnapshotRow',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('DRAFT', 'Draft'), ('SUBMITTED', 'Submitted'), ('UNDER_REVIEW', 'Under Review'), ('APPROVED', 'Approved'), ('REJECTED', 'Rejected'), ('EXPIRED', 'Expired'), ('CLOSED_WON', 'Closed Won'), ('CLOSED_LOST', 'Closed Lost')], max_length=20)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='dealaudit',
+            index=models.Index(fields=['deal', 'timestamp', 'id'], name='deals_deala_deal_id_7aea7f_idx'),
+        ),
+        migrations.AddField(
+            model_name='dealstatussnapshotrow',
+            name='deal',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='deals.deal'),
+        ),
+        migrations.AddField(
+            model_name='dealstatussnapshotrow',
+            name='snapshot',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='rows', to='deals.dealstatussnapshot'),
+        ),
+        migrations.AddConstraint(
+            model_name='dealstatussnapshotrow',
+            constraint=models.UniqueConstraint(fields=('snapshot', 'deal'), name='uniq_deal_status_snapshot_row'),
+        ),
+    ]
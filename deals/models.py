@@ -1,10 +1,42 @@
-from django.db import models
+from django.db import models, transaction
 from django.conf import settings
 from django.utils import timezone
 from django.core.validators import MinValueValidator
+from django.db.models.functions import Coalesce
+from .tracking import FieldTrackingMixin
 
 
-class Deal(models.Model):
+class Region(models.Model):
+    """A sales region; ``path`` places it in the hierarchy, e.g. ``emea/dach``."""
+    code = models.CharField(max_length=20, unique=True)
+    name = models.CharField(max_length=100, unique=True)
+    path = models.CharField(max_length=200, unique=True)
+
+    class Meta:
+        ordering = ['path']
+
+    def __str__(self):
+        return self.name
+
+
+class RegionAlias(models.Model):
+    """A normalised spelling that resolves to a region (see deals.regions)."""
+    region = models.ForeignKey(Region, on_delete=models.CASCADE, related_name='aliases')
+    key = models.CharField(max_length=200, unique=True)
+
+    class Meta:
+        verbose_name_plural = 'Region aliases'
+
+    def __str__(self):
+        return self.key
+
+    def save(self, *args, **kwargs):
+        from .regions import normalise_region
+        self.key = normalise_region(self.key)
+        super().save(*args, **kwargs)
+
+
+class Deal(FieldTrackingMixin, models.Model):
     PRODUCT_CATEGORIES = [
         ('PRINTERS', 'Printers'),
         ('LABELS', 'Labels'),
@@ -26,14 +58,27 @@ class Deal(models.Model):
         ('CLOSED_LOST', 'Closed Lost'),
     ]
 
+    # target status -> statuses it may be entered from (see deals.transitions)
+    TRANSITIONS = {
+        'SUBMITTED': ('DRAFT',),
+        'UNDER_REVIEW': ('SUBMITTED',),
+        'APPROVED': ('SUBMITTED', 'UNDER_REVIEW'),
+        'REJECTED': ('SUBMITTED', 'UNDER_REVIEW'),
+        'CLOSED_WON': ('APPROVED',),
+        'CLOSED_LOST': ('APPROVED',),
+    }
+
     partner = models.ForeignKey('accounts.PartnerOrganisation', on_delete=models.CASCADE, related_name='deals', db_index=True)
     end_customer_name = models.CharField(max_length=255, db_index=True)
+    # end_customer_name normalised for duplicate detection (see deals.conflicts)
+    customer_key = models.CharField(max_length=255, blank=True, editable=False)
     project_name = models.CharField(max_length=255, blank=True, db_index=True)
     description = models.TextField(blank=True)
     estimated_value = models.DecimalField(max_digits=12, decimal_places=2, validators=[MinValueValidator(0)], db_index=True)
     expected_close_date = models.DateField(null=True, blank=True)
     product_category = models.CharField(max_length=50, choices=PRODUCT_CATEGORIES, db_index=True)
-    region = models.CharField(max_length=100, blank=True)
+    # the (region, status, estimated_value) index serves region filters
+    region = models.ForeignKey(Region, null=True, blank=True, on_delete=models.PROTECT, related_name='deals', db_index=False)
     deal_type = models.CharField(max_length=20, choices=DEAL_TYPES)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='DRAFT', db_index=True)
     internal_owner = models.ForeignKey(settings.AUTH_USER_MODEL, null=True, blank=True, on_delete=models.SET_NULL, related_name='owned_deals', db_index=True)
@@ -47,11 +92,26 @@ class Deal(models.Model):
             models.Index(fields=['status', '-created_at']),
             models.Index(fields=['partner', 'status']),
             models.Index(fields=['-updated_at']),
+            models.Index(fields=['customer_key', 'product_category']),
+            # cover the region rollup, for all partners and for one
+            models.Index(fields=['region', 'status', 'estimated_value']),
+            models.Index(fields=['partner', 'region', 'status', 'estimated_value']),
         ]
 
     def __str__(self):
         return f"{self.project_name or self.end_customer_name} - {self.partner.name}"
 
+    def save(self, *args, **kwargs):
+        from .conflicts import normalise_customer
+        self.customer_key = normalise_customer(self.end_customer_name)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'end_customer_name' in update_fields:
+            kwargs['update_fields'] = {*update_fields, 'customer_key'}
+        # the audit row and notification outbox event are written by signals;
+        # keep them in the same transaction as the status change itself
+        with transaction.atomic(using=kwargs.get('using')):
+            super().save(*args, **kwargs)
+
 
 class DealAudit(models.Model):
     deal = models.ForeignKey(Deal, on_delete=models.CASCADE, related_name='audit_trail', db_index=True)
@@ -65,7 +125,138 @@ class DealAudit(models.Model):
         ordering = ['-timestamp']
         indexes = [
             models.Index(fields=['deal', '-timestamp']),
+            # as-of lookups seek the latest row before, or the first after, a moment (deals.history)
+            models.Index(fields=['deal', 'timestamp', 'id']),
         ]
 
     def __str__(self):
         return f"Deal {self.deal_id} changed to {self.new_status} at {self.timestamp}"
+
+
+class PartnerDealStats(models.Model):
+    """Materialised deal count and value per (partner, status).
+
+    Maintained incrementally by ``deals.stats``; ``manage.py rebuild_deal_stats``
+    recomputes it from scratch.
+    """
+    partner = models.ForeignKey('accounts.PartnerOrganisation', on_delete=models.CASCADE, related_name='deal_stats')
+    status = models.CharField(max_length=20, choices=Deal.STATUS_CHOICES)
+    deal_count = models.IntegerField(default=0)
+    total_value = models.DecimalField(max_digits=16, decimal_places=2, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['partner', 'status'], name='uniq_partner_deal_stats'),
+        ]
+
+    def __str__(self):
+        return f"{self.partner_id} {self.status}: {self.deal_count}"
+
+
+class DealRollupTotal(models.Model):
+    """Current deal count and value per analytics dimension combination and status.
+
+    Maintained with DealDailyRollup by ``deals.analytics``; ``manage.py
+    rebuild_deal_analytics`` recomputes both.
+    """
+    partner = models.ForeignKey('accounts.PartnerOrganisation', on_delete=models.CASCADE, related_name='+')
+    product_category = models.CharField(max_length=50, choices=Deal.PRODUCT_CATEGORIES)
+    region = models.ForeignKey(Region, null=True, on_delete=models.CASCADE, related_name='+')
+    deal_type = models.CharField(max_length=20, choices=Deal.DEAL_TYPES)
+    status = models.CharField(max_length=20, choices=Deal.STATUS_CHOICES)
+    deal_count = models.IntegerField(default=0)
+    total_value = models.DecimalField(max_digits=16, decimal_places=2, default=0)
+
+    class Meta:
+        constraints = [
+            # NULL regions would never conflict; the upsert targets this expression index
+            models.UniqueConstraint('partner', 'product_category', Coalesce('region', 0), 'deal_type', 'status', name='uniq_deal_rollup_total'),
+        ]
+
+
+class DealDailyRollup(models.Model):
+    """Per-day changes per analytics dimension combination and status.
+
+    ``entered_*`` counts deals that moved into ``status`` that day;
+    ``net_*`` is the change in the number and value of deals in ``status``.
+    """
+    day = models.DateField()
+    partner = models.ForeignKey('accounts.PartnerOrganisation', on_delete=models.CASCADE, related_name='+')
+    product_category = models.CharField(max_length=50, choices=Deal.PRODUCT_CATEGORIES)
+    region = models.ForeignKey(Region, null=True, on_delete=models.CASCADE, related_name='+')
+    deal_type = models.CharField(max_length=20, choices=Deal.DEAL_TYPES)
+    status = models.CharField(max_length=20, choices=Deal.STATUS_CHOICES)
+    entered_count = models.IntegerField(default=0)
+    entered_value = models.DecimalField(max_digits=16, decimal_places=2, default=0)
+    net_count = models.IntegerField(default=0)
+    net_value = models.DecimalField(max_digits=16, decimal_places=2, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint('day', 'partner', 'product_category', Coalesce('region', 0), 'deal_type', 'status', name='uniq_deal_daily_rollup'),
+        ]
+        indexes = [
+            models.Index(fields=['partner', 'day']),
+        ]
+
+
+class DealStatusSnapshot(models.Model):
+    """A checkpoint of every deal's status at ``taken_at``, so as-of queries read only later audit rows.
+
+    Taken by ``manage.py snapshot_deal_statuses``; see ``deals.history``.
+    """
+    taken_at = models.DateTimeField(unique=True)
+    deal_count = models.IntegerField(default=0)
+
+    class Meta:
+        ordering = ['-taken_at']
+
+    def __str__(self):
+        return f"Deal statuses at {self.taken_at}"
+
+
+class DealStatusSnapshotRow(models.Model):
+    snapshot = models.ForeignKey(DealStatusSnapshot, on_delete=models.CASCADE, related_name='rows')
+    deal = models.ForeignKey(Deal, on_delete=models.CASCADE, related_name='+')
+    status = models.CharField(max_length=20, choices=Deal.STATUS_CHOICES)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['snapshot', 'deal'], name='uniq_deal_status_snapshot_row'),
+        ]
+
+
+class DealExpiryAlert(models.Model):
+    """Records that the nearing-expiry warning went out for a deal's current expiry date."""
+    deal = models.ForeignKey(Deal, on_delete=models.CASCADE, related_name='expiry_alerts')
+    expiry_date = models.DateField()
+    alerted_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['deal', 'expiry_date'], name='uniq_deal_expiry_alert'),
+        ]
+
+
+class DealBlockingKey(models.Model):
+    """A blocking key of a deal's customer name; deals sharing keys are duplicate candidates."""
+    deal = models.ForeignKey(Deal, on_delete=models.CASCADE, related_name='blocking_keys')
+    key = models.CharField(max_length=120)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['key', 'deal'], name='uniq_deal_blocking_key'),
+        ]
+
+
+class DealSearchEntry(models.Model):
+    """A row of the full-text index over deals; the table is created and filled by deals.search."""
+    deal = models.OneToOneField(Deal, primary_key=True, db_column='rowid', db_constraint=False, on_delete=models.DO_NOTHING, related_name='search_entry')
+    # the FTS5 column named after its table; matched against, never read
+    document = models.TextField(db_column='deals_deal_fts')
+    # FTS5 bm25 score of the current match (SQLite only)
+    rank = models.FloatField()
+
+    class Meta:
+        managed = False
+        db_table = 'deals_deal_fts'
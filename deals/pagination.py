@@ -0,0 +1,222 @@
+"""Keyset (cursor) pagination for deal lists.
+
+Pages are addressed by the sort value and id of the last row seen, so fetching
+page N costs the same as page 1: ``WHERE (sort, id) < (value, last_id)
+ORDER BY sort, id LIMIT n`` walks the ``-updated_at`` / ``(status, -created_at)``
+/ ``(partner, status)`` indexes instead of skipping OFFSET rows. Counting is
+optional and can be estimated instead of running an exact ``COUNT(*)``.
+"""
+import base64
+import binascii
+import json
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import connections
+from django.db.models import Q
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+SORT_FIELDS = ('updated_at', 'created_at', 'estimated_value', 'project_name')
+DEFAULT_SORT = '-updated_at'
+# annotation added by deals.search; search results sort by it unless asked otherwise
+SEARCH_RANK = 'search_rank'
+
+SORT_OPTIONS = [
+    ('-updated_at', 'Last Updated (Newest)'),
+    ('updated_at', 'Last Updated (Oldest)'),
+    ('-created_at', 'Created (Newest)'),
+    ('created_at', 'Created (Oldest)'),
+    ('-estimated_value', 'Value (High to Low)'),
+    ('estimated_value', 'Value (Low to High)'),
+    ('project_name', 'Project Name (A-Z)'),
+    ('-project_name', 'Project Name (Z-A)'),
+]
+
+
+def clean_sort(value, fields=SORT_FIELDS, default=DEFAULT_SORT):
+    """Return ``value`` if it is an allowed sort, else the default."""
+    if value and value.lstrip('-') in fields:
+        return value
+    return default
+
+
+def encode_cursor(position):
+    raw = json.dumps(position, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        position = json.loads(raw)
+    except (binascii.Error, ValueError, TypeError):
+        return None
+    if not isinstance(position, dict) or not {'s', 'v', 'id', 'r'} <= set(position):
+        return None
+    return position
+
+
+def estimate_count(qs, cap=None):
+    """Return ``(count, is_estimate)`` without an exact COUNT over the whole match.
+
+    PostgreSQL reads the planner's row estimate; other backends count at most
+    ``cap`` + 1 rows and report the cap when there are more.
+    """
+    cap = cap or getattr(settings, 'DEAL_ESTIMATED_COUNT_CAP', 1000)
+    connection = connections[qs.db]
+    qs = qs.order_by()
+    if connection.vendor == 'postgresql':
+        sql, params = qs.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN (FORMAT JSON) ' + sql, params)
+            plan = cursor.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return int(plan[0]['Plan']['Plan Rows']), True
+    found = qs[:cap + 1].count()
+    return min(found, cap), found > cap
+
+
+class KeysetPage:
+    def __init__(self, items, sort, has_next, has_previous, count=None, count_is_estimate=False):
+        self.items = items
+        self.sort = sort
+        self.has_next = has_next
+        self.has_previous = has_previous
+        self.count = count
+        self.count_is_estimate = count_is_estimate
+
+    def _cursor(self, row, reverse):
+        field = self.sort.lstrip('-')
+        value = getattr(row, field)
+        return encode_cursor({'s': self.sort, 'v': value if isinstance(value, str) else str(value), 'id': row.pk, 'r': reverse})
+
+    @property
+    def next_cursor(self):
+        return self._cursor(self.items[-1], False) if self.has_next and self.items else None
+
+    @property
+    def previous_cursor(self):
+        return self._cursor(self.items[0], True) if self.has_previous and self.items else None
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+
+def paginate_keyset(qs, sort=DEFAULT_SORT, cursor=None, page_size=20, count=None, sort_fields=SORT_FIELDS):
+    """Return one KeysetPage of ``qs``.
+
+    ``count`` is None (no count), ``'estimate'`` or ``'exact'``. ``sort`` must
+    be one of ``sort_fields`` (optionally ``-`` prefixed); anything else falls
+    back to the first of them, descending. Search results also accept
+    ``search_rank`` and default to it, best match first.
+    """
+    default = '-' + sort_fields[0]
+    if SEARCH_RANK in qs.query.annotations:
+        sort_fields, default = (SEARCH_RANK, *sort_fields), SEARCH_RANK
+    sort = clean_sort(sort, sort_fields, default=default)
+    field = sort.lstrip('-')
+    descending = sort.startswith('-')
+    position = decode_cursor(cursor) if cursor else None
+    if position and position['s'] != sort:
+        # the sort changed since the cursor was issued; start from the top
+        position = None
+
+    total, is_estimate = None, False
+    if count == 'exact':
+        total = qs.order_by().count()
+    elif count == 'estimate':
+        total, is_estimate = estimate_count(qs)
+
+    reverse = bool(position and position['r'])
+    # walking backwards flips both the comparison and the ordering
+    forward_desc = descending != reverse
+    if position:
+        annotation = qs.query.annotations.get(field)
+        target = annotation.output_field if annotation is not None else qs.model._meta.get_field(field)
+        try:
+            value = target.to_python(position['v'])
+        except ValidationError:
+            value = None
+        if value is not None:
+            op = 'lt' if forward_desc else 'gt'
+            qs = qs.filter(Q(**{f'{field}__{op}': value}) | Q(**{field: value, f'id__{op}': position['id']}))
+    prefix = '-' if forward_desc else ''
+    rows = list(qs.order_by(f'{prefix}{field}', f'{prefix}id')[:page_size + 1])
+    more = len(rows) > page_size
+    rows = rows[:page_size]
+    if reverse:
+        rows.reverse()
+        return KeysetPage(rows, sort, has_next=True, has_previous=more, count=total, count_is_estimate=is_estimate)
+    return KeysetPage(rows, sort, has_next=more, has_previous=position is not None, count=total, count_is_estimate=is_estimate)
+
+
+class DealKeysetPagination(BasePagination):
+    """DRF adapter: ``?sort=``, ``?cursor=``, ``?page_size=`` and ``?count=exact|estimate``."""
+    page_size = 25
+    max_page_size = 200
+    sort_fields = SORT_FIELDS
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        try:
+            page_size = min(int(request.query_params.get('page_size', self.page_size)), self.max_page_size)
+        except ValueError:
+            page_size = self.page_size
+        count = request.query_params.get('count')
+        self.page = paginate_keyset(
+            queryset,
+            sort=request.query_params.get('sort'),
+            cursor=request.query_params.get('cursor'),
+            page_size=max(page_size, 1),
+            count=count if count in ('exact', 'estimate') else None,
+            sort_fields=self.sort_fields,
+        )
+        return self.page.items
+
+    def _link(self, cursor):
+        if cursor is None:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, 'cursor', cursor)
+
+    def get_paginated_response(self, data):
+        payload = OrderedDict([
+            ('next', self._link(self.page.next_cursor)),
+            ('previous', self._link(self.page.previous_cursor)),
+        ])
+        if self.page.count is not None:
+            payload['count'] = self.page.count
+            payload['count_is_estimate'] = self.page.count_is_estimate
+        payload['results'] = data
+        return Response(payload)
+
+
+class AuditKeysetPagination(DealKeysetPagination):
+    """Newest-first audit history, walking the ``(deal, -timestamp)`` index."""
+    page_size = 50
+    sort_fields = ('timestamp',)
+
+
+def page_links(request, page):
+    """Query strings for the web dashboards' newer/older links."""
+    def link(cursor):
+        if cursor is None:
+            return None
+        params = request.GET.copy()
+        params['cursor'] = cursor
+        return '?' + params.urlencode()
+
+    first = request.GET.copy()
+    first.pop('cursor', None)
+    return {
+        'next_url': link(page.next_cursor),
+        'previous_url': link(page.previous_cursor),
+        'first_url': '?' + first.urlencode(),
+    }
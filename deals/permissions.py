@@ -1,5 +1,7 @@
 from rest_framework import permissions
 
+from accounts.principal import get_principal
+
 
 class DealPermissions(permissions.BasePermission):
     """Role & object-level permission enforcement"""
@@ -11,14 +13,14 @@ class DealPermissions(permissions.BasePermission):
         return True
 
     def has_object_permission(self, request, view, obj):
-        user = request.user
-        if user.role == 'ADMIN':
-            return True
-        if user.role == 'BRADY':
+        principal = get_principal(request)
+        if principal is None:
+            return False
+        if principal.is_staff_role:
             return True
-        if user.role == 'PARTNER':
+        if principal.is_partner:
             # partners can only access deals in their organisation
-            if obj.partner_id != getattr(user.partner_organisation, 'id', None):
+            if not principal.owns(obj):
                 return False
             # partners can edit only when status is Draft or Submitted
             if request.method in permissions.SAFE_METHODS:
@@ -0,0 +1,125 @@
+"""The region dimension.
+
+Regions are a small table, so the alias -> region map is cached whole and
+resolving what a user typed costs no query. Filters then become an exact
+``region_id IN (...)`` on the deal table, which the region index serves.
+Lookups are case-, accent- and punctuation-insensitive. A prefix lookup matches
+alias keys and region paths, so ``emea`` selects every region under EMEA.
+The deal signals drop the cache when a region or alias changes. That reaches
+other workers only through a shared cache (see ``CACHES``); with a per-process
+one they keep the old map for up to ``REGION_CACHE_SECONDS``, hence its short
+default.
+"""
+import re
+import unicodedata
+from bisect import bisect_left
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Sum
+
+from .models import Deal, Region, RegionAlias
+
+REGION_CACHE_KEY = 'deals:regions'
+_SEPARATORS = re.compile(r'[^a-z0-9/]+')
+_DROPPED = re.compile(r"[.']")
+
+
+def normalise_region(text):
+    text = unicodedata.normalize('NFKD', text or '').encode('ascii', 'ignore').decode().lower().replace('&', ' and ')
+    # "U.K." and "UK" are the same key
+    return ' '.join(_SEPARATORS.sub(' ', _DROPPED.sub('', text)).split())
+
+
+def _load():
+    regions = {pk: (code, name, path) for pk, code, name, path in Region.objects.values_list('id', 'code', 'name', 'path')}
+    keys = {}
+    for pk, (code, name, path) in regions.items():
+        for key in (normalise_region(code), normalise_region(name), path):
+            keys.setdefault(key, pk)
+    keys.update(RegionAlias.objects.values_list('key', 'region_id'))
+    return {'regions': regions, 'keys': sorted(keys.items())}
+
+
+def dimension():
+    """``{'regions': {id: (code, name, path)}, 'keys': [(key, id), ...]}``, keys sorted."""
+    data = cache.get(REGION_CACHE_KEY)
+    if data is None:
+        data = _load()
+        cache.set(REGION_CACHE_KEY, data, settings.REGION_CACHE_SECONDS)
+    return data
+
+
+def invalidate():
+    cache.delete(REGION_CACHE_KEY)
+
+
+def resolve(text):
+    """The id of the region ``text`` names (code, name, path or alias), or None."""
+    key = normalise_region(text)
+    keys = dimension()['keys']
+    i = bisect_left(keys, (key,))
+    if i < len(keys) and keys[i][0] == key:
+        return keys[i][1]
+    return None
+
+
+def resolve_prefix(text):
+    """Ids of every region with a key or path starting with ``text``."""
+    prefix = normalise_region(text)
+    if not prefix:
+        return set()
+    keys = dimension()['keys']
+    ids = set()
+    for key, pk in keys[bisect_left(keys, (prefix,)):]:
+        if not key.startswith(prefix):
+            break
+        ids.add(pk)
+    # a key naming a parent region also selects the regions below it
+    regions = dimension()['regions']
+    paths = [regions[pk][2] + '/' for pk in ids]
+    ids.update(pk for pk, (_, _, path) in regions.items() if path.startswith(tuple(paths)))
+    return ids
+
+
+def filter_exact(qs, text):
+    pk = resolve(text)
+    return qs.filter(region_id=pk) if pk is not None else qs.none()
+
+
+def filter_prefix(qs, text):
+    ids = resolve_prefix(text)
+    return qs.filter(region_id__in=sorted(ids)) if ids else qs.none()
+
+
+def label(pk):
+    region = dimension()['regions'].get(pk)
+    return region[1] if region else None
+
+
+def choices():
+    """``(path, label)`` for every region in hierarchy order, children indented."""
+    regions = sorted(dimension()['regions'].values(), key=lambda r: r[2])
+    # an em space survives HTML whitespace collapsing inside <option>
+    return [(path, '\u2003' * path.count('/') + name) for _, name, path in regions]
+
+
+def rollup(partner_id=None):
+    """Deal count and value per region and status, from the covering (partner, region, status, value) index."""
+    qs = Deal.objects.order_by()
+    if partner_id is not None:
+        qs = qs.filter(partner_id=partner_id)
+    grouped = qs.values('region_id', 'status').annotate(n=Count('id'), value=Sum('estimated_value'))
+    regions = dimension()['regions']
+    rows = {}
+    for row in grouped:
+        pk = row['region_id']
+        code, name, path = regions.get(pk, (None, None, None))
+        entry = rows.setdefault(pk, {'region': code, 'name': name, 'path': path, 'count': 0, 'value': Decimal('0'), 'by_status': {}})
+        value = row['value'] or Decimal('0')
+        entry['count'] += row['n']
+        entry['value'] += value
+        entry['by_status'][row['status']] = {'count': row['n'], 'value': value}
+    # unassigned deals last
+    return sorted(rows.values(), key=lambda r: (r['path'] is None, r['path'] or ''))
@@ -0,0 +1,114 @@
+"""Full-text search over deals.
+
+The index lives in ``deals_deal_fts``, keyed by deal id. On SQLite it is an
+FTS5 table with one column per searched field; on PostgreSQL it is a plain
+table holding a weighted ``tsvector`` behind a GIN index. The deal signals
+keep it in step with every save and delete; migration 0005 creates it and sets
+the FTS5 column weights. ``manage.py rebuild_deal_search`` refills it after
+bulk loads or raw SQL updates.
+
+``search(qs, text)`` matches every word of ``text`` as a prefix and annotates
+``search_rank``; lower ranks are better on both backends.
+"""
+import re
+
+from django.db import connection
+from django.db.models import F, FloatField, Func, Lookup, Value
+
+from .models import DealSearchEntry
+
+TABLE = 'deals_deal_fts'
+_WORD = re.compile(r'\w+', re.UNICODE)
+
+_SQLITE_SELECT = (
+    'SELECT d.id, d.project_name, d.end_customer_name, d.description, p.name '
+    'FROM deals_deal d JOIN accounts_partnerorganisation p ON p.id = d.partner_id'
+)
+_POSTGRES_SELECT = (
+    "SELECT d.id, setweight(to_tsvector('simple', d.project_name), 'A') "
+    "|| setweight(to_tsvector('simple', d.end_customer_name), 'B') "
+    "|| setweight(to_tsvector('simple', p.name), 'B') "
+    "|| setweight(to_tsvector('simple', d.description), 'C') "
+    'FROM deals_deal d JOIN accounts_partnerorganisation p ON p.id = d.partner_id'
+)
+
+INDEXED_FIELDS = ('project_name', 'end_customer_name', 'description', 'partner_id')
+
+
+def _write(conn, where, params):
+    if conn.vendor == 'sqlite':
+        with conn.cursor() as cursor:
+            # FTS5 honours OR REPLACE on rowid, dropping the old terms
+            cursor.execute(f'INSERT OR REPLACE INTO {TABLE}(rowid, project_name, end_customer_name, description, partner_name) {_SQLITE_SELECT} WHERE {where}', params)
+    elif conn.vendor == 'postgresql':
+        with conn.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {TABLE} (rowid, {TABLE}) {_POSTGRES_SELECT} WHERE {where} '
+                f'ON CONFLICT (rowid) DO UPDATE SET {TABLE} = EXCLUDED.{TABLE}',
+                params,
+            )
+
+
+def index_deals(ids, conn=connection):
+    """Re-index the given deals from their current rows."""
+    ids = list(ids)
+    if ids:
+        _write(conn, f"d.id IN ({', '.join(['%s'] * len(ids))})", ids)
+
+
+def index_partner(partner_id, conn=connection):
+    """Re-index every deal of a partner, e.g. after the partner was renamed."""
+    _write(conn, 'd.partner_id = %s', [partner_id])
+
+
+def remove_deals(ids, conn=connection):
+    ids = list(ids)
+    if ids and conn.vendor in ('sqlite', 'postgresql'):
+        with conn.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {TABLE} WHERE rowid IN ({', '.join(['%s'] * len(ids))})", ids)
+
+
+def rebuild(conn=connection):
+    """Refill the whole index from the deal table."""
+    if conn.vendor not in ('sqlite', 'postgresql'):
+        return
+    with conn.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {TABLE}')
+    _write(conn, '1 = 1', [])
+
+
+def match_expression(text, vendor=None):
+    """Turn user input into a backend query matching every word as a prefix, or None."""
+    words = _WORD.findall((text or '').lower())
+    if not words:
+        return None
+    if (vendor or connection.vendor) == 'postgresql':
+        return ' & '.join(f'{word}:*' for word in words)
+    return ' '.join(f'"{word}"*' for word in words)
+
+
+class Match(Lookup):
+    lookup_name = 'match'
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        if connection.vendor == 'postgresql':
+            return f"{lhs} @@ to_tsquery('simple', {rhs})", lhs_params + rhs_params
+        return f'{lhs} MATCH {rhs}', lhs_params + rhs_params
+
+
+DealSearchEntry._meta.get_field('document').register_lookup(Match)
+
+
+def search(queryset, text):
+    """Deals in ``queryset`` matching ``text``, annotated with ``search_rank`` (lower is better)."""
+    expression = match_expression(text)
+    if expression is None:
+        return queryset.annotate(search_rank=Value(0.0, output_field=FloatField())).none()
+    queryset = queryset.filter(search_entry__document__match=expression)
+    if connection.vendor == 'postgresql':
+        query = Func(Value('simple'), Value(expression), function='to_tsquery')
+        score = Func(F('search_entry__document'), query, function='ts_rank', output_field=FloatField())
+        return queryset.annotate(search_rank=Value(0.0) - score)
+    return queryset.annotate(search_rank=F('search_entry__rank'))
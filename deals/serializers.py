@@ -1,5 +1,72 @@
+from datetime import datetime, time, timedelta
+
+from django.conf import settings
+from django.utils import timezone
 from rest_framework import serializers
+from rest_framework.permissions import SAFE_METHODS
 from .models import Deal, DealAudit
+from . import analytics, regions
+from accounts.principal import get_principal
+
+
+def query_list(request, name):
+    """Parse a comma separated query parameter such as ``?fields=id,status``."""
+    value = request.query_params.get(name, '') if request is not None else ''
+    return {part.strip() for part in value.split(',') if part.strip()}
+
+
+class SparseFieldsetMixin:
+    """Apply ``?fields=`` and ``?expand=`` to read requests.
+
+    Names in ``Meta.expandable_fields`` are dropped unless listed in ``?expand=``
+    (or ``Meta.expanded_by_default``); ``?fields=`` narrows everything else.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        request = self.context.get('request')
+        if request is None or request.method not in SAFE_METHODS:
+            return
+        expandable = getattr(self.Meta, 'expandable_fields', ())
+        expand = query_list(request, 'expand') | set(getattr(self.Meta, 'expanded_by_default', ()))
+        wanted = query_list(request, 'fields')
+        for name in list(self.fields):
+            if name in expandable:
+                keep = name in expand
+            else:
+                keep = not wanted or name in wanted or name == 'id'
+            if not keep:
+                self.fields.pop(name)
+
+
+class RegionField(serializers.Field):
+    """A region by name on the way out; any code, name or alias on the way in.
+
+    Reads and writes ``region_id`` through the cached region map, so neither
+    costs a query per deal.
+    """
+
+    def __init__(self, **kwargs):
+        kwargs.setdefault('source', 'region_id')
+        kwargs.setdefault('required', False)
+        kwargs.setdefault('allow_null', True)
+        super().__init__(**kwargs)
+
+    def to_representation(self, value):
+        return regions.label(value)
+
+    def to_internal_value(self, data):
+        if data in ('', None):
+            return None
+        pk = regions.resolve(str(data))
+        if pk is None:
+            raise serializers.ValidationError(f'Unknown region "{data}"')
+        return pk
+
+    def validate_empty_values(self, data):
+        if data == '':
+            return True, None
+        return super().validate_empty_values(data)
 
 
 class DealAuditSerializer(serializers.ModelSerializer):
@@ -8,36 +75,44 @@ class DealAuditSerializer(serializers.ModelSerializer):
         fields = ['id', 'deal', 'changed_by', 'old_status', 'new_status', 'timestamp', 'note']
 
 
-class DealSerializer(serializers.ModelSerializer):
+class AuditEntrySerializer(DealAuditSerializer):
+    """Audit row for the paged timeline; ``changed_by`` is joined, not fetched per row."""
+    changed_by_username = serializers.CharField(source='changed_by.username', default=None, read_only=True)
+
+    class Meta(DealAuditSerializer.Meta):
+        fields = DealAuditSerializer.Meta.fields + ['changed_by_username']
+
+
+class DealSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
+    """Detail representation; includes the audit trail."""
     audit_trail = DealAuditSerializer(read_only=True, many=True)
+    region = RegionField()
 
     class Meta:
         model = Deal
         fields = '__all__'
-        read_only_fields = ('created_at', 'updated_at', 'expiry_date')
+        expandable_fields = ('audit_trail',)
+        expanded_by_default = ('audit_trail',)
+        # status only moves through the submit/approve/reject actions (deals.transitions)
+        read_only_fields = ('created_at', 'updated_at', 'expiry_date', 'status')
         extra_kwargs = {
             'partner': {'read_only': True},
         }
 
-    def create(self, validated_data):
-        request = self.context.get('request')
-        user = getattr(request, 'user', None)
-        if user and user.role == 'PARTNER':
-            validated_data['partner'] = user.partner_organisation
-        return super().create(validated_data)
-
     def validate(self, data):
-        user = self.context['request'].user
-        if user.is_authenticated and user.role == 'PARTNER':
+        principal = get_principal(self.context['request'])
+        if self.instance is None and (principal is None or not principal.is_partner):
+            # partner is read-only here, so only a partner's own organisation can be filled in
+            raise serializers.ValidationError('Only partner users can register deals')
+        if principal is not None and principal.is_partner:
             # Partner cannot create/edit deals for other organisations
-            partner = getattr(user, 'partner_organisation', None)
-            if not partner:
+            if principal.partner_id is None:
                 raise serializers.ValidationError('Partner user must belong to an organisation')
             if self.instance is None:
-                data['partner'] = partner
+                data['partner_id'] = principal.partner_id
             else:
                 # ensure partner didn't change partner field
-                if 'partner' in data and data['partner'] != self.instance.partner:
+                if 'partner' in data and data['partner'].pk != self.instance.partner_id:
                     raise serializers.ValidationError('Cannot change partner organisation')
             # check status editing rules
             if self.instance and self.instance.status not in ('DRAFT', 'SUBMITTED'):
@@ -55,3 +130,103 @@ class DealSerializer(serializers.ModelSerializer):
     def create(self, validated_data):
         request = self.context.get('request')
         return super().create(validated_data)
+
+
+class DealListSerializer(DealSerializer):
+    """List representation; the audit trail only with ``?expand=audit_trail``."""
+
+    class Meta(DealSerializer.Meta):
+        expanded_by_default = ()
+
+
+class BulkTransitionSerializer(serializers.Serializer):
+    ids = serializers.ListField(child=serializers.IntegerField(min_value=1), allow_empty=False, max_length=500)
+    status = serializers.ChoiceField(choices=list(Deal.TRANSITIONS))
+    note = serializers.CharField(required=False, allow_blank=True, default='')
+
+
+class CommaListField(serializers.ListField):
+    """A list given as comma separated query parameters, such as ``?status=SUBMITTED,APPROVED``."""
+
+    def to_internal_value(self, data):
+        if isinstance(data, str):
+            data = [data]
+        parts = [part.strip() for item in data for part in str(item).split(',') if part.strip()]
+        return super().to_internal_value(parts)
+
+
+class PipelineFilterSerializer(serializers.Serializer):
+    """Query parameter filters shared by the pipeline reports."""
+    status = CommaListField(child=serializers.ChoiceField(choices=Deal.STATUS_CHOICES), required=False, allow_empty=False)
+    partner = CommaListField(child=serializers.IntegerField(min_value=1), required=False, allow_empty=False)
+    product_category = CommaListField(child=serializers.ChoiceField(choices=Deal.PRODUCT_CATEGORIES), required=False, allow_empty=False)
+    deal_type = CommaListField(child=serializers.ChoiceField(choices=Deal.DEAL_TYPES), required=False, allow_empty=False)
+    region = serializers.CharField(required=False)
+    region_prefix = serializers.CharField(required=False)
+
+    default_statuses = None
+
+    def report_kwargs(self):
+        """Keyword arguments for the report function."""
+        data = self.validated_data
+        region_ids = None
+        if 'region' in data:
+            pk = regions.resolve(data['region'])
+            region_ids = {pk} if pk is not None else set()
+        if 'region_prefix' in data:
+            prefixed = regions.resolve_prefix(data['region_prefix'])
+            region_ids = prefixed if region_ids is None else region_ids & prefixed
+        return {
+            'group_by': list(dict.fromkeys(data['group_by'])),
+            'statuses': data.get('status', self.default_statuses),
+            'partners': data.get('partner'),
+            'product_categories': data.get('product_category'),
+            'deal_types': data.get('deal_type'),
+            'region_ids': region_ids,
+        }
+
+
+class AnalyticsQuerySerializer(PipelineFilterSerializer):
+    group_by = CommaListField(child=serializers.ChoiceField(choices=[*analytics.DIMENSIONS, 'period']), required=False, default=list)
+    interval = serializers.ChoiceField(choices=list(analytics.INTERVALS), default='month')
+    start = serializers.DateField(required=False)
+    end = serializers.DateField(required=False)
+
+    default_statuses = analytics.PIPELINE_STATUSES
+
+    def validate(self, attrs):
+        default_start, default_end = analytics.default_range()
+        start, end = attrs.get('start', default_start), attrs.get('end', default_end)
+        if start > end:
+            raise serializers.ValidationError({'start': 'start must not be after end.'})
+        if 'period' in attrs['group_by']:
+            periods, period = 0, analytics.bucket_start(start, attrs['interval'])
+            while period <= end and periods <= settings.DEAL_ANALYTICS_MAX_PERIODS:
+                periods += 1
+                period = analytics.next_bucket(period, attrs['interval'])
+            if periods > settings.DEAL_ANALYTICS_MAX_PERIODS:
+                raise serializers.ValidationError({'interval': f'At most {settings.DEAL_ANALYTICS_MAX_PERIODS} periods; use a longer interval or a shorter range.'})
+        return attrs
+
+    def report_kwargs(self):
+        data = self.validated_data
+        return {**super().report_kwargs(), 'interval': data['interval'], 'start': data.get('start'), 'end': data.get('end')}
+
+
+class AsOfField(serializers.DateTimeField):
+    """A timestamp; a bare date means the end of that day."""
+
+    def to_internal_value(self, value):
+        if isinstance(value, str) and len(value.strip()) == 10:
+            day = serializers.DateField().to_internal_value(value)
+            end_of_day = datetime.combine(day + timedelta(days=1), time.min) - timedelta(microseconds=1)
+            return timezone.make_aware(end_of_day)
+        return super().to_internal_value(value)
+
+
+class AsOfQuerySerializer(PipelineFilterSerializer):
+    at = AsOfField()
+    group_by = CommaListField(child=serializers.ChoiceField(choices=analytics.DIMENSIONS), required=False, default=lambda: ['status'])
+
+    def report_kwargs(self):
+        return {**super().report_kwargs(), 'at': self.validated_data['at']}
@@ -1,64 +1,110 @@
-from django.db.models.signals import pre_save, post_save
+from django.db.models.signals import pre_save, post_save, post_delete
 from django.dispatch import receiver
-from django.conf import settings
-from django.utils import timezone
-from django.core.mail import send_mail
-from django.contrib.auth import get_user_model
-from .models import Deal, DealAudit
+from accounts.models import PartnerOrganisation
+from .models import Deal, DealAudit, Region, RegionAlias
+from . import conflicts, regions, search, stats
+from .transitions import count_transitions
+
+# columns the status audit and the stats and analytics rollups depend on
+_ROLLUP_FIELDS = stats.ROLLUP_FIELDS
+_UNLOADED = object()
+
+
+def _previous_values(instance: Deal):
+    # compare against the values the instance was loaded with; no query
+    if instance.is_tracked:
+        # region_id may legitimately be None, so deferred columns need a sentinel
+        previous = {f: instance.get_original(f, _UNLOADED) for f in _ROLLUP_FIELDS}
+        if _UNLOADED not in previous.values():
+            return previous
+    return Deal.objects.filter(pk=instance.pk).values(*_ROLLUP_FIELDS).first()
 
 
 @receiver(pre_save, sender=Deal)
 def log_status_change(sender, instance: Deal, **kwargs):
+    instance._status_change = None
+    instance._previous = None
     if not instance.pk:
         # new deal
         return
-    try:
-        old = Deal.objects.get(pk=instance.pk)
-    except Deal.DoesNotExist:
+    previous = _previous_values(instance)
+    if previous is None:
         return
-    if old.status != instance.status:
+    instance._previous = previous
+    old_status = previous['status']
+    if old_status != instance.status:
         # create audit entry
-        DealAudit.objects.create(deal=instance, changed_by=getattr(instance, '_changed_by', None), old_status=old.status, new_status=instance.status)
+        DealAudit.objects.create(deal=instance, changed_by=getattr(instance, '_changed_by', None), old_status=old_status, new_status=instance.status)
+        instance._status_change = (old_status, instance.status)
+
+
+@receiver(post_save, sender=Deal)
+def update_stats(sender, instance: Deal, created, **kwargs):
+    previous = getattr(instance, '_previous', None)
+    if created or previous is None or any(previous[f] != getattr(instance, f) for f in _ROLLUP_FIELDS):
+        stats.record_saved(instance, created, previous)
+
+
+@receiver(post_delete, sender=Deal)
+def remove_from_stats(sender, instance: Deal, **kwargs):
+    stats.record_deleted(instance)
 
 
 @receiver(post_save, sender=Deal)
 def notify_on_status_change(sender, instance: Deal, created, **kwargs):
-    # simple in-app/email notification; in prod, use async tasks
-    if created:
+    # fan-out happens in `manage.py process_outbox`; here we only record the event
+    change = getattr(instance, '_status_change', None)
+    if created or not change:
         return
-    # check latest audit if status changed recently
-    latest = instance.audit_trail.order_by('-timestamp').first()
-    if latest:
-        User = get_user_model()
-        recipients_users = set()
-        # partner users
-        if instance.partner:
-            for u in instance.partner.users.all():
-                recipients_users.add(u)
-        # for submitted deals, notify Brady users as well
-        if latest.new_status == 'SUBMITTED':
-            for u in User.objects.filter(role='BRADY'):
-                recipients_users.add(u)
-        # always include internal owner if present
-        if instance.internal_owner:
-            recipients_users.add(instance.internal_owner)
-
-        # create in-app notifications
-        try:
-            from notifications.models import Notification
-            for u in recipients_users:
-                Notification.objects.create(
-                    recipient=u,
-                    changed_by=latest.changed_by,
-                    verb=f"Deal {instance} status changed to {latest.new_status}",
-                    description=f"Status changed from {latest.old_status} to {latest.new_status}."
-                )
-        except Exception:
-            # notifications app may not be present or may fail; don't break flow
-            pass
-
-        # send emails to those that have addresses
-        recipients = [u.email for u in recipients_users if u.email]
-        subject = f"Deal {instance} status changed to {latest.new_status}"
-        if recipients:
-            send_mail(subject, f"Status changed from {latest.old_status} to {latest.new_status}.", settings.DEFAULT_FROM_EMAIL, recipients, fail_silently=True)
+    instance._status_change = None
+    from notifications.outbox import enqueue_status_change
+    enqueue_status_change(instance, *change, changed_by=getattr(instance, '_changed_by', None))
+    count_transitions([change])
+
+
+@receiver(post_save, sender=Deal)
+def update_search_index(sender, instance: Deal, created, update_fields=None, **kwargs):
+    if not created:
+        if update_fields is not None and not set(update_fields) & {'project_name', 'end_customer_name', 'description', 'partner', 'partner_id'}:
+            return
+        if instance.is_tracked and not set(instance.get_dirty_fields()) & set(search.INDEXED_FIELDS):
+            return
+    search.index_deals([instance.pk])
+
+
+@receiver(post_save, sender=Deal)
+def update_blocking_keys(sender, instance: Deal, created, update_fields=None, **kwargs):
+    if not created:
+        if update_fields is not None and not set(update_fields) & {'customer_key', 'product_category'}:
+            return
+        if instance.is_tracked and not set(instance.get_dirty_fields()) & {'customer_key', 'product_category'}:
+            return
+    conflicts.index_deal(instance, created)
+
+
+@receiver(post_delete, sender=Deal)
+def remove_from_search_index(sender, instance: Deal, **kwargs):
+    search.remove_deals([instance.pk])
+
+
+@receiver(pre_save, sender=PartnerOrganisation)
+def note_partner_rename(sender, instance: PartnerOrganisation, update_fields=None, **kwargs):
+    # one lookup of the stored name saves reindexing every deal on unrelated saves
+    instance._renamed = False
+    if instance.pk and (update_fields is None or 'name' in update_fields):
+        old_name = PartnerOrganisation.objects.filter(pk=instance.pk).values_list('name', flat=True).first()
+        instance._renamed = old_name is not None and old_name != instance.name
+
+
+@receiver(post_save, sender=PartnerOrganisation)
+def reindex_partner_deals(sender, instance: PartnerOrganisation, created, **kwargs):
+    # the partner name is indexed with each deal
+    if not created and getattr(instance, '_renamed', False):
+        instance._renamed = False
+        search.index_partner(instance.pk)
+
+
+@receiver([post_save, post_delete], sender=Region)
+@receiver([post_save, post_delete], sender=RegionAlias)
+def drop_region_cache(sender, **kwargs):
+    regions.invalidate()
@@ -0,0 +1,108 @@
+"""Incremental maintenance of PartnerDealStats and the overview figures built on it.
+
+Changes that carry the deal's analytics dimensions also feed the
+deals.analytics rollups when the delta is applied.
+"""
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Sum
+
+from .analytics import RollupDelta, dims_of
+from .models import Deal, PartnerDealStats
+
+OVERVIEW_STATUSES = ('DRAFT', 'SUBMITTED', 'APPROVED', 'REJECTED')
+# deal columns the rollups are keyed or summed by
+ROLLUP_FIELDS = ('partner_id', 'status', 'estimated_value', 'product_category', 'region_id', 'deal_type')
+
+
+class StatsDelta:
+    """Accumulates count/value changes per (partner_id, status) before applying them."""
+
+    def __init__(self):
+        self.changes = defaultdict(lambda: [0, Decimal('0')])
+        self.rollup = RollupDelta()
+
+    def add(self, partner_id, status, count, value, dims=None, entered=False):
+        """``dims`` is ``analytics.dims_of(deal)``; ``entered`` marks a deal arriving in ``status``."""
+        entry = self.changes[(partner_id, status)]
+        entry[0] += count
+        entry[1] += Decimal(value or 0)
+        if dims is not None:
+            self.rollup.add(partner_id, dims, status, count, value, entered=entered)
+
+    def move(self, partner_id, old_status, new_status, value, count=1, dims=None):
+        self.add(partner_id, old_status, -count, -Decimal(value or 0), dims)
+        self.add(partner_id, new_status, count, value, dims, entered=True)
+
+    def apply(self):
+        for (partner_id, status), (count, value) in self.changes.items():
+            if count or value:
+                _apply_one(partner_id, status, count, value)
+        self.changes.clear()
+        self.rollup.apply()
+
+
+def _apply_one(partner_id, status, count, value):
+    rows = PartnerDealStats.objects.filter(partner_id=partner_id, status=status)
+    if rows.update(deal_count=F('deal_count') + count, total_value=F('total_value') + value):
+        return
+    try:
+        with transaction.atomic():
+            PartnerDealStats.objects.create(partner_id=partner_id, status=status, deal_count=count, total_value=value)
+    except IntegrityError:
+        # another writer created the row first
+        rows.update(deal_count=F('deal_count') + count, total_value=F('total_value') + value)
+
+
+def record_saved(deal, created, previous=None):
+    """Update the rollup after ``deal`` was inserted or saved.
+
+    ``previous`` holds the pre-save values of the columns in ``ROLLUP_FIELDS``.
+    """
+    delta = StatsDelta()
+    if created or previous is None:
+        delta.add(deal.partner_id, deal.status, 1, deal.estimated_value, dims_of(deal), entered=True)
+    else:
+        before = (previous['product_category'], previous['region_id'], previous['deal_type'])
+        delta.add(previous['partner_id'], previous['status'], -1, -Decimal(previous['estimated_value'] or 0), before)
+        delta.add(deal.partner_id, deal.status, 1, deal.estimated_value, dims_of(deal), entered=previous['status'] != deal.status)
+    delta.apply()
+
+
+def record_deleted(deal):
+    delta = StatsDelta()
+    delta.add(deal.partner_id, deal.status, -1, -Decimal(deal.estimated_value or 0), dims_of(deal))
+    delta.apply()
+
+
+def rebuild():
+    """Recompute every row from the deal table."""
+    grouped = Deal.objects.order_by().values('partner_id', 'status').annotate(n=Count('id'), value=Sum('estimated_value'))
+    with transaction.atomic():
+        PartnerDealStats.objects.all().delete()
+        PartnerDealStats.objects.bulk_create([
+            PartnerDealStats(partner_id=row['partner_id'], status=row['status'], deal_count=row['n'], total_value=row['value'] or 0)
+            for row in grouped
+        ])
+
+
+def overview(partner_id=None, all_partners=False):
+    """Overview dashboard figures, read from the rollup rather than the deal table.
+
+    Figures cover ``partner_id`` only, so None gives zeros; pass
+    ``all_partners=True`` for the whole pipeline.
+    """
+    qs = PartnerDealStats.objects.all()
+    if not all_partners:
+        qs = qs.filter(partner_id=partner_id)
+    by_status = {
+        row['status']: {'count': row['n'] or 0, 'value': row['value'] or Decimal('0')}
+        for row in qs.order_by().values('status').annotate(n=Sum('deal_count'), value=Sum('total_value'))
+    }
+    stats = {f'{status.lower()}_deals': by_status.get(status, {}).get('count', 0) for status in OVERVIEW_STATUSES}
+    stats['total_deals'] = sum(s['count'] for s in by_status.values())
+    stats['total_value'] = sum((s['value'] for s in by_status.values()), Decimal('0'))
+    stats['by_status'] = by_status
+    return stats
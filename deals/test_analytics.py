@@ -0,0 +1,145 @@
+import io
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from deals import analytics, regions
+from deals.models import Deal, DealAudit, DealDailyRollup, DealRollupTotal
+from deals.testing import DealFixturesMixin
+from deals.transitions import bulk_transition, transition
+
+
+def totals():
+    return {
+        (r.partner_id, r.product_category, r.region_id, r.deal_type, r.status): (r.deal_count, r.total_value)
+        for r in DealRollupTotal.objects.all() if r.deal_count or r.total_value
+    }
+
+
+def daily_net():
+    net = {}
+    for r in DealDailyRollup.objects.all():
+        key = (r.partner_id, r.product_category, r.region_id, r.deal_type, r.status)
+        count, value = net.get(key, (0, Decimal('0')))
+        net[key] = (count + r.net_count, value + r.net_value)
+    return {key: v for key, v in net.items() if any(v)}
+
+
+class PipelineAnalyticsTests(DealFixturesMixin, TestCase):
+    def deal(self, value=1000, org=None, **fields):
+        return super().deal(org, **{'estimated_value': value, 'region': self.uki, **fields})
+
+    def backdate(self, deal, created, moves):
+        """Move ``deal``'s creation and its audited status changes to the given days."""
+        Deal.objects.filter(pk=deal.pk).update(created_at=timezone.make_aware(datetime.combine(created, time(12))))
+        for new_status, day in moves.items():
+            DealAudit.objects.filter(deal=deal, new_status=new_status).update(timestamp=timezone.make_aware(datetime.combine(day, time(12))))
+
+    def test_incremental_rollups_match_a_rebuild(self):
+        a = self.deal(100)
+        b = self.deal(200, self.other_org, region=self.dach, product_category='RFID')
+        c = self.deal(300, deal_type='EXPANSION', region=None)
+        d = self.deal(400)
+        transition(a, 'SUBMITTED')
+        transition(a, 'APPROVED')
+        a.estimated_value = 150
+        a.region = self.dach
+        a.save()
+        bulk_transition(Deal.objects.all(), [b.pk, c.pk], 'SUBMITTED')
+        transition(Deal.objects.get(pk=b.pk), 'APPROVED')
+        Deal.objects.filter(pk=b.pk).update(expiry_date=timezone.localdate() - timedelta(days=1))
+        call_command('check_deal_expiry', stdout=io.StringIO())
+        d.delete()
+
+        incremental = totals()
+        self.assertEqual(incremental[(self.org.pk, 'LABELS', self.dach.pk, 'NEW', 'APPROVED')], (1, Decimal('150')))
+        self.assertEqual(incremental[(self.other_org.pk, 'RFID', self.dach.pk, 'NEW', 'EXPIRED')], (1, Decimal('200')))
+        self.assertEqual(incremental[(self.org.pk, 'LABELS', None, 'EXPANSION', 'SUBMITTED')], (1, Decimal('300')))
+        self.assertEqual(len(incremental), 3)
+        self.assertEqual(daily_net(), incremental)
+
+        call_command('rebuild_deal_analytics', stdout=io.StringIO())
+        self.assertEqual(totals(), incremental)
+        self.assertEqual(daily_net(), incremental)
+
+    def test_period_stock_flows_and_win_rate(self):
+        today = timezone.localdate()
+        this_month = today.replace(day=1)
+        last_month = (this_month - timedelta(days=1)).replace(day=1)
+        two_ago = (last_month - timedelta(days=1)).replace(day=1)
+        a = self.deal(100)
+        b = self.deal(10)
+        c = self.deal(1)
+        for deal, targets in ((a, ['SUBMITTED', 'APPROVED', 'CLOSED_WON']), (b, ['SUBMITTED', 'APPROVED', 'CLOSED_LOST']), (c, ['SUBMITTED'])):
+            for target in targets:
+                transition(deal, target)
+        self.backdate(a, two_ago + timedelta(days=4), {'SUBMITTED': two_ago + timedelta(days=5), 'APPROVED': last_month + timedelta(days=2), 'CLOSED_WON': today})
+        self.backdate(b, last_month, {'SUBMITTED': last_month, 'APPROVED': last_month + timedelta(days=3), 'CLOSED_LOST': last_month + timedelta(days=10)})
+        analytics.rebuild()
+
+        result = analytics.report(group_by=['period'], start=two_ago)
+        rows = [(r['period'], r['count'], r['value'], r['entered_count'], r['won_count'], r['lost_count'], r['win_rate']) for r in result['rows']]
+        self.assertEqual(rows, [
+            (two_ago, 1, Decimal('100'), 1, 0, 0, None),
+            (last_month, 1, Decimal('100'), 3, 0, 1, 0.0),
+            (this_month, 1, Decimal('1'), 1, 1, 0, 1.0),
+        ])
+
+        # a range ending last month sees the stock as it was then
+        result = analytics.report(start=last_month, end=this_month - timedelta(days=1))
+        self.assertEqual([(r['count'], r['entered_count'], r['lost_count']) for r in result['rows']], [(1, 3, 1)])
+        by_status = analytics.report(group_by=['status'], start=two_ago, statuses=['CLOSED_WON', 'CLOSED_LOST'])
+        self.assertEqual([(r['status'], r['count'], r['value']) for r in by_status['rows']], [('CLOSED_LOST', 1, Decimal('10')), ('CLOSED_WON', 1, Decimal('100'))])
+        self.assertNotIn('win_rate', by_status['rows'][0])
+
+    def test_query_count_does_not_grow_with_deals(self):
+        self.deal(status='SUBMITTED')
+        regions.dimension()
+
+        def queries():
+            with CaptureQueriesContext(connection) as ctx:
+                analytics.report(group_by=['partner', 'region', 'period'], interval='week')
+            return len(ctx.captured_queries)
+
+        before = queries()
+        Deal.objects.bulk_create(Deal(partner=self.org, project_name='P', end_customer_name='C', estimated_value=5, product_category='RFID', deal_type='NEW', status='SUBMITTED') for _ in range(300))
+        analytics.rebuild()
+        self.assertEqual(queries(), before)
+        self.assertEqual(before, 3)
+
+    def test_api_filters_groups_and_scopes_partners(self):
+        self.deal(100, status='SUBMITTED')
+        self.deal(50, status='APPROVED', region=self.dach)
+        self.deal(7, self.other_org, status='SUBMITTED', product_category='RFID')
+        self.deal(1, status='DRAFT')
+        client = APIClient()
+        client.force_authenticate(self.brady)
+        body = client.get('/api/deals/analytics/', {'group_by': 'partner,region'}).json()
+        self.assertEqual(body['statuses'], list(analytics.PIPELINE_STATUSES))
+        rows = [(r['partner_name'], r['region'], r['region_name'], r['count'], r['value']) for r in body['rows']]
+        self.assertEqual(sorted(rows), [('Contoso', 'UKI', 'UK & Ireland', 1, 7), ('Northwind', 'DACH', 'DACH', 1, 50), ('Northwind', 'UKI', 'UK & Ireland', 1, 100)])
+
+        body = client.get('/api/deals/analytics/', {'region_prefix': 'emea', 'product_category': 'LABELS', 'status': 'SUBMITTED,APPROVED,DRAFT'}).json()
+        self.assertEqual([(r['count'], r['value']) for r in body['rows']], [(3, 151)])
+        body = client.get('/api/deals/analytics/', {'region': 'germany', 'group_by': 'status'}).json()
+        self.assertEqual([(r['status'], r['count']) for r in body['rows']], [('APPROVED', 1)])
+        body = client.get('/api/deals/analytics/', {'region': 'atlantis'}).json()
+        self.assertEqual(body['rows'], [])
+
+        client.force_authenticate(self.partner)
+        body = client.get('/api/deals/analytics/', {'group_by': 'partner', 'partner': str(self.other_org.pk)}).json()
+        self.assertEqual([(r['partner'], r['count']) for r in body['rows']], [(self.org.pk, 2)])
+
+    def test_api_rejects_bad_queries(self):
+        client = APIClient()
+        client.force_authenticate(self.brady)
+        for query in ({'group_by': 'colour'}, {'interval': 'fortnight'}, {'status': 'LOST'}, {'start': '2026-05-01', 'end': '2026-04-01'},
+                      {'group_by': 'period', 'interval': 'day', 'start': '2020-01-01', 'end': '2026-01-01'}):
+            response = client.get('/api/deals/analytics/', query)
+            self.assertEqual(response.status_code, 400, query)
@@ -0,0 +1,131 @@
+import io
+
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from deals.conflicts import blocking_keys, find_conflicts, find_conflicts_for, normalise_customer
+from deals.models import Deal, DealAudit, DealBlockingKey
+from deals.testing import DealFixturesMixin
+from deals.transitions import bulk_transition, transition
+
+
+class DealConflictTests(DealFixturesMixin, TestCase):
+    def deal(self, customer, org=None, **fields):
+        return super().deal(org, end_customer_name=customer, **fields)
+
+    def conflicts(self, deal):
+        return [other.pk for other, _ in find_conflicts(Deal.objects.get(pk=deal.pk))]
+
+    def test_normalise_customer(self):
+        self.assertEqual(normalise_customer('  Müller & Söhne GmbH '), 'muller sohne')
+        self.assertEqual(normalise_customer('The ACME Group, Ltd.'), 'acme')
+        self.assertEqual(normalise_customer('Acme Holdings plc'), 'acme')
+        self.assertEqual(normalise_customer('Ltd'), '')
+        self.assertEqual(blocking_keys('', 'LABELS'), [])
+        self.assertIn('LABELS:t:muller', blocking_keys('muller sohne', 'LABELS'))
+
+    def test_variants_of_the_same_customer_conflict_within_a_category(self):
+        original = self.deal('Acme Logistics Ltd', self.other_org, status='APPROVED')
+        same_partner = self.deal('ACME Logistics Limited', status='SUBMITTED')
+        self.deal('Acme Logistics', product_category='PRINTERS')
+        self.deal('Globex Logistics')
+        self.deal('Acme Logistic Ltd', self.other_org, status='REJECTED')
+        new = self.deal('Acme Logistics, Inc.')
+        self.assertEqual(sorted(self.conflicts(new)), sorted([original.pk, same_partner.pk]))
+        # a dropped letter still leaves most trigrams shared
+        typo = self.deal('Acme Logistcs')
+        self.assertIn(original.pk, self.conflicts(typo))
+
+    def test_keys_follow_renames_and_category_changes(self):
+        deal = self.deal('Initech')
+        other = self.deal('Initrode', self.other_org)
+        self.assertEqual(self.conflicts(other), [])
+        deal = Deal.objects.get(pk=deal.pk)
+        deal.end_customer_name = 'Initrode Ltd'
+        deal.save()
+        self.assertEqual(deal.customer_key, 'initrode')
+        self.assertEqual(self.conflicts(other), [deal.pk])
+        Deal.objects.get(pk=deal.pk).save(update_fields=['end_customer_name'])
+        deal.product_category = 'RFID'
+        deal.save()
+        self.assertEqual(self.conflicts(other), [])
+        deal.delete()
+        self.assertFalse(DealBlockingKey.objects.filter(deal_id=deal.pk).exists())
+
+    def test_saves_that_do_not_touch_the_customer_skip_the_keys(self):
+        deal = Deal.objects.get(pk=self.deal('Hooli').pk)
+        deal.project_name = 'Renamed'
+        with CaptureQueriesContext(connection) as ctx:
+            deal.save()
+        self.assertFalse([q for q in ctx.captured_queries if 'deals_dealblockingkey' in q['sql']])
+
+    @override_settings(DEAL_CONFLICT_POSTING_CAP=5)
+    def test_lookup_reads_a_bounded_number_of_rows_per_key(self):
+        Deal.objects.bulk_create(Deal(partner=self.other_org, project_name='Bulk', end_customer_name='Umbrella Corp', customer_key='umbrella',
+                                      estimated_value=1, product_category='LABELS', deal_type='NEW') for _ in range(40))
+        call_command('rebuild_deal_conflicts', stdout=io.StringIO())
+        deal = self.deal('Umbrella Corporation')
+        found = self.conflicts(deal)
+        # the newest rows per key, not every registration of the customer
+        self.assertTrue(0 < len(found) <= 5)
+        self.assertEqual(found, sorted(found, reverse=True))
+
+    @override_settings(DEAL_CONFLICT_POSTING_CAP=5)
+    def test_inactive_registrations_do_not_crowd_out_live_ones(self):
+        live = self.deal('Soylent Corp', self.other_org, status='APPROVED')
+        Deal.objects.bulk_create(Deal(partner=self.other_org, project_name='Old', end_customer_name='Soylent', customer_key='soylent',
+                                      estimated_value=1, product_category='LABELS', deal_type='NEW', status=status)
+                                 for status in ['REJECTED', 'EXPIRED', 'CLOSED_LOST'] * 10)
+        call_command('rebuild_deal_conflicts', stdout=io.StringIO())
+        self.assertEqual(self.conflicts(self.deal('Soylent Ltd')), [live.pk])
+
+    def test_submission_notes_possible_duplicates(self):
+        self.deal('Stark Industries', self.other_org, status='APPROVED')
+        deal = self.deal('Stark Industries Inc')
+        transition(deal, 'SUBMITTED', user=self.partner)
+        note = DealAudit.objects.get(deal=deal, new_status='SUBMITTED').note
+        self.assertEqual(note, 'Possible duplicate registration: 1 similar deal(s) for this customer and product (1 from other partners).')
+
+        clean = self.deal('Wayne Enterprises')
+        transition(clean, 'SUBMITTED', user=self.partner)
+        self.assertEqual(DealAudit.objects.get(deal=clean, new_status='SUBMITTED').note, '')
+
+    def test_bulk_submission_scores_the_batch_at_once(self):
+        self.deal('Stark Industries', self.other_org, status='APPROVED')
+        self.deal('Wayne Enterprises', self.other_org, status='APPROVED')
+
+        def submit(names):
+            ids = [self.deal(name).pk for name in names]
+            with CaptureQueriesContext(connection) as ctx:
+                results = bulk_transition(Deal.objects.all(), ids, 'SUBMITTED', user=self.partner)
+            self.assertTrue(all(ok for ok, _ in results.values()))
+            return ids, [q['sql'] for q in ctx.captured_queries if 'deals_dealblockingkey' in q['sql']]
+
+        few, scoring = submit(['Stark Industries Ltd', 'Acme'])
+        many, more_scoring = submit(['Stark Industries Ltd', 'Wayne Enterprises Inc', 'Initech'] * 10)
+        self.assertEqual(len(scoring), 1)
+        self.assertEqual(len(more_scoring), 1)
+        notes = dict(DealAudit.objects.filter(deal__in=few + many, new_status='SUBMITTED').values_list('deal_id', 'note'))
+        self.assertIn('1 from other partners', notes[few[0]])
+        self.assertEqual(notes[few[1]], '')
+        # deals in the same batch count as well
+        self.assertIn('(1 from other partners, 10 from the same partner)', notes[many[0]])
+        self.assertIn('9 similar deal(s)', notes[many[2]])
+        self.assertEqual({pk: [c.pk for c, _ in found] for pk, found in find_conflicts_for(Deal.objects.filter(pk__in=many[:3])).items()},
+                         {pk: self.conflicts(Deal(pk=pk)) for pk in many[:3]})
+
+    def test_conflicts_endpoint_is_for_reviewers(self):
+        other = self.deal('Cyberdyne Systems', self.other_org, status='SUBMITTED')
+        deal = self.deal('Cyberdyne Systems Ltd', status='SUBMITTED')
+        client = APIClient()
+        client.force_authenticate(self.partner)
+        self.assertEqual(client.get(f'/api/deals/{deal.pk}/conflicts/').status_code, 403)
+
+        client.force_authenticate(self.brady)
+        body = client.get(f'/api/deals/{deal.pk}/conflicts/').json()
+        self.assertEqual(body['customer_key'], 'cyberdyne systems')
+        self.assertEqual([(c['id'], c['partner_name'], c['same_partner'], c['similarity']) for c in body['conflicts']],
+                         [(other.pk, 'Contoso', False, 1.0)])
@@ -3,9 +3,19 @@ from django.contrib.auth import get_user_model
 from rest_framework.test import APIClient
 from django.utils import timezone
 from django.core.management import call_command
+from django.db import DatabaseError, connection, transaction
+from django.db.models.signals import pre_save
+from django.test.utils import CaptureQueriesContext
 from unittest.mock import patch
-from deals.models import Deal, DealAudit
+import io
+import json
+from deals import stats as deal_stats
+from deals.export import read_columnar
+from deals.transitions import TRANSITION_FIELDS, InvalidTransition, TransitionConflict, transition
+from notifications.models import OutboxEvent
+from deals.models import Deal, DealAudit, DealExpiryAlert, PartnerDealStats
 from accounts.models import PartnerOrganisation
+from accounts.principal import load_principal
 
 
 User = get_user_model()
@@ -88,7 +98,8 @@ class DealTests(TestCase):
         self.client.login(username='p1', password='pass')
         res = self.client.get('/api/deals/export_csv/')
         self.assertEqual(res.status_code, 200)
-        content = res.content.decode()
+        self.assertTrue(res.streaming)
+        content = b''.join(res.streaming_content).decode()
         self.assertIn('D1', content)
         self.assertNotIn('D2', content)
 
@@ -96,10 +107,28 @@ class DealTests(TestCase):
         self.client.login(username='b1', password='pass')
         res = self.client.get('/api/deals/export_csv/')
         self.assertEqual(res.status_code, 200)
-        content = res.content.decode()
+        content = b''.join(res.streaming_content).decode()
         self.assertIn('D1', content)
         self.assertIn('D2', content)
 
+    def test_export_formats_honour_filters(self):
+        self.client.login(username='b1', password='pass')
+        res = self.client.get('/api/deals/export/', {'export_format': 'ndjson', 'product_category': 'LABELS'})
+        self.assertEqual(res.status_code, 200)
+        rows = [json.loads(line) for line in b''.join(res.streaming_content).decode().splitlines()]
+        self.assertEqual([r['project_name'] for r in rows], ['D2'])
+        self.assertEqual(rows[0]['partner'], 'PartnerTwo')
+        self.assertEqual(rows[0]['estimated_value'], '2000.00')
+
+        res = self.client.get('/api/deals/export/', {'export_format': 'columnar', 'partner': self.partner_org.id})
+        self.assertEqual(res.status_code, 200)
+        rows = read_columnar(io.BytesIO(b''.join(res.streaming_content)))
+        self.assertEqual({r['project_name'] for r in rows}, {'D1', 'Expired', 'SoonExp'})
+        self.assertEqual({r['partner'] for r in rows}, {'PartnerCo'})
+
+        res = self.client.get('/api/deals/export/', {'export_format': 'xlsx'})
+        self.assertEqual(res.status_code, 400)
+
     def test_partner_dashboard_and_brady_dashboard(self):
         self.client.login(username='p1', password='pass')
         res = self.client.get('/api/deals/partner_dashboard/')
@@ -123,3 +152,390 @@ class DealTests(TestCase):
         self.assertEqual(self.expired.status, 'EXPIRED')
         # near expiry should trigger an email (mocked)
         self.assertTrue(mock_send_mail.called)
+
+    @patch('deals.management.commands.check_deal_expiry.send_mail')
+    def test_expiry_sends_digests_once_and_audits(self, mock_send_mail):
+        Deal.objects.create(partner=self.partner_org, end_customer_name='Soon2', project_name='SoonToo', estimated_value=5, product_category='RFID', deal_type='NEW', status='APPROVED', expiry_date=timezone.now().date() + timezone.timedelta(days=5), internal_owner=self.brady_user)
+        closed = Deal.objects.create(partner=self.partner_org, end_customer_name='Done', project_name='Won', estimated_value=5, product_category='RFID', deal_type='NEW', status='CLOSED_WON', expiry_date=timezone.now().date() - timezone.timedelta(days=5))
+        call_command('check_deal_expiry', stdout=io.StringIO())
+        # one digest per recipient covering both deals
+        recipients = sorted(call.args[3][0] for call in mock_send_mail.call_args_list)
+        self.assertEqual(recipients, ['b1@example.com', 'p1@example.com'])
+        partner_digest = next(c for c in mock_send_mail.call_args_list if c.args[3] == ['p1@example.com'])
+        self.assertIn('SoonExp', partner_digest.args[1])
+        self.assertIn('SoonToo', partner_digest.args[1])
+        audit = DealAudit.objects.get(deal=self.expired)
+        self.assertEqual((audit.old_status, audit.new_status), ('APPROVED', 'EXPIRED'))
+        closed.refresh_from_db()
+        self.assertEqual(closed.status, 'CLOSED_WON')
+
+        # a rerun has nothing new to send or expire
+        mock_send_mail.reset_mock()
+        call_command('check_deal_expiry', stdout=io.StringIO())
+        self.assertFalse(mock_send_mail.called)
+        self.assertEqual(DealAudit.objects.filter(deal=self.expired).count(), 1)
+
+    @patch('deals.management.commands.check_deal_expiry.send_mail')
+    def test_expiry_records_alerts_only_for_sent_digests(self, mock_send_mail):
+        soon = Deal.objects.create(partner=self.partner_org, end_customer_name='Soon2', project_name='SoonToo', estimated_value=5, product_category='RFID', deal_type='NEW', status='APPROVED', expiry_date=timezone.now().date() + timezone.timedelta(days=5), internal_owner=self.brady_user)
+
+        def send(subject, body, sender, to, **kwargs):
+            self.assertFalse(kwargs.get('fail_silently'))
+            if to == ['b1@example.com']:
+                raise ConnectionError('mail server down')
+
+        mock_send_mail.side_effect = send
+        err = io.StringIO()
+        call_command('check_deal_expiry', chunk_size=1, stdout=io.StringIO(), stderr=err)
+        # each chunk is mailed and recorded on its own; the owner's digest failed
+        self.assertEqual(sorted(c.args[3][0] for c in mock_send_mail.call_args_list), ['b1@example.com', 'p1@example.com', 'p1@example.com'])
+        self.assertIn('mail server down', err.getvalue())
+        self.assertEqual(list(DealExpiryAlert.objects.values_list('deal_id', flat=True)), [self.near_expiry.pk])
+
+        mock_send_mail.reset_mock()
+        mock_send_mail.side_effect = None
+        call_command('check_deal_expiry', stdout=io.StringIO())
+        self.assertEqual(sorted(c.args[3][0] for c in mock_send_mail.call_args_list), ['b1@example.com', 'p1@example.com'])
+        self.assertEqual(set(DealExpiryAlert.objects.values_list('deal_id', flat=True)), {self.near_expiry.pk, soon.pk})
+
+
+class DealChangeTrackingTests(TestCase):
+    def setUp(self):
+        self.partner_org = PartnerOrganisation.objects.create(name='TrackCo')
+        self.deal = Deal.objects.create(partner=self.partner_org, end_customer_name='ACME', project_name='Tracked', estimated_value=1000, product_category='PRINTERS', deal_type='NEW')
+
+    def test_dirty_fields_against_loaded_values(self):
+        deal = Deal.objects.get(pk=self.deal.pk)
+        self.assertEqual(deal.get_dirty_fields(), {})
+        deal.project_name = 'Renamed'
+        deal.estimated_value = deal.estimated_value  # unchanged assignment is not dirty
+        self.assertEqual(deal.get_dirty_fields(), {'project_name': 'Tracked'})
+        self.assertTrue(deal.has_changed('project_name'))
+        self.assertFalse(deal.has_changed('status'))
+
+    def test_save_writes_only_changed_columns_without_extra_select(self):
+        deal = Deal.objects.get(pk=self.deal.pk)
+        deal.project_name = 'Renamed'
+        with CaptureQueriesContext(connection) as ctx:
+            deal.save()
+        # project_name is also written to the search index
+        statements = [q['sql'] for q in ctx.captured_queries if 'SAVEPOINT' not in q['sql'] and 'deals_deal_fts' not in q['sql']]
+        self.assertEqual(len(statements), 1)
+        sql = statements[0]
+        self.assertTrue(sql.startswith('UPDATE'))
+        self.assertIn('project_name', sql)
+        self.assertNotIn('estimated_value', sql)
+        self.assertEqual(deal.get_dirty_fields(), {})
+
+    def test_documented_differences_from_a_full_save(self):
+        deal = Deal.objects.get(pk=self.deal.pk)
+
+        def touch(sender, instance, **kwargs):
+            instance.description = 'set in pre_save'
+
+        pre_save.connect(touch, sender=Deal)
+        try:
+            deal.project_name = 'Renamed'
+            deal.save()
+        finally:
+            pre_save.disconnect(touch, sender=Deal)
+        self.assertEqual(Deal.objects.get(pk=deal.pk).description, '')
+
+        Deal.objects.filter(pk=deal.pk).delete()
+        deal.project_name = 'Gone'
+        with self.assertRaisesMessage(DatabaseError, 'did not affect any rows'):
+            with transaction.atomic():
+                deal.save()
+        deal.save(force_insert=True)
+        self.assertEqual(Deal.objects.get(pk=deal.pk).project_name, 'Gone')
+
+    def test_status_change_audited_from_snapshot(self):
+        deal = Deal.objects.get(pk=self.deal.pk)
+        deal.status = 'SUBMITTED'
+        deal.save()
+        audit = DealAudit.objects.get(deal=deal)
+        self.assertEqual((audit.old_status, audit.new_status), ('DRAFT', 'SUBMITTED'))
+        # a later save without a status change adds no audit row
+        deal.project_name = 'Again'
+        deal.save()
+        self.assertEqual(DealAudit.objects.filter(deal=deal).count(), 1)
+
+    def test_refresh_resets_snapshot(self):
+        deal = Deal.objects.only('id', 'project_name').get(pk=self.deal.pk)
+        Deal.objects.filter(pk=deal.pk).update(status='SUBMITTED')
+        self.assertEqual(deal.status, 'SUBMITTED')  # deferred load
+        self.assertEqual(deal.get_dirty_fields(), {})
+
+
+class KeysetPaginationTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.partner_org = PartnerOrganisation.objects.create(name='PagedCo')
+        self.brady_user = User.objects.create_user(username='pb', password='pass', role='BRADY', email='pb@example.com')
+        # repeated values force the id tiebreaker to keep pages disjoint
+        Deal.objects.bulk_create([
+            Deal(partner=self.partner_org, end_customer_name=f'C{i}', project_name=f'P{i:02d}', estimated_value=(i % 7) * 100, product_category='PRINTERS', deal_type='NEW')
+            for i in range(45)
+        ])
+        self.client.login(username='pb', password='pass')
+
+    def _walk(self, url, params):
+        seen = []
+        res = self.client.get(url, params)
+        while True:
+            data = res.json()
+            seen.extend(d['id'] for d in data['results'])
+            if not data['next']:
+                return seen, data
+            res = self.client.get(data['next'])
+
+    def test_walks_every_row_once_in_sort_order(self):
+        ids, last = self._walk('/api/deals/brady_dashboard/', {'sort': '-estimated_value', 'page_size': 10})
+        expected = list(Deal.objects.order_by('-estimated_value', '-id').values_list('id', flat=True))
+        self.assertEqual(ids, expected)
+        # and back again from the last page
+        res = self.client.get(last['previous'])
+        self.assertEqual([d['id'] for d in res.json()['results']], expected[30:40])
+
+    def test_count_modes(self):
+        res = self.client.get('/api/deals/brady_dashboard/', {'count': 'exact'})
+        self.assertEqual(res.json()['count'], 45)
+        self.assertFalse(res.json()['count_is_estimate'])
+        with self.settings(DEAL_ESTIMATED_COUNT_CAP=20):
+            res = self.client.get('/api/deals/brady_dashboard/', {'count': 'estimate'})
+        self.assertEqual(res.json()['count'], 20)
+        self.assertTrue(res.json()['count_is_estimate'])
+        res = self.client.get('/api/deals/brady_dashboard/')
+        self.assertNotIn('count', res.json())
+
+    def test_unknown_sort_falls_back_to_default(self):
+        res = self.client.get('/api/deals/brady_dashboard/', {'sort': 'description'})
+        self.assertEqual(res.status_code, 200)
+        expected = list(Deal.objects.order_by('-updated_at', '-id').values_list('id', flat=True)[:25])
+        self.assertEqual([d['id'] for d in res.json()['results']], expected)
+
+
+class PartnerDealStatsTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.partner_org = PartnerOrganisation.objects.create(name='StatsCo')
+        self.other_org = PartnerOrganisation.objects.create(name='OtherStats')
+        self.partner_user = User.objects.create_user(username='sp', password='pass', role='PARTNER', partner_organisation=self.partner_org)
+        self.brady_user = User.objects.create_user(username='sb', password='pass', role='BRADY')
+        self.deal = Deal.objects.create(partner=self.partner_org, end_customer_name='A', project_name='S1', estimated_value=100, product_category='PRINTERS', deal_type='NEW')
+        Deal.objects.create(partner=self.other_org, end_customer_name='B', project_name='S2', estimated_value=50, product_category='LABELS', deal_type='NEW', status='SUBMITTED')
+        Deal.objects.create(partner=self.partner_org, end_customer_name='C', project_name='S3', estimated_value=10, product_category='RFID', deal_type='NEW', status='APPROVED', expiry_date=timezone.now().date() - timezone.timedelta(days=2))
+
+    def _rows(self):
+        return sorted(PartnerDealStats.objects.filter(deal_count__gt=0).values_list('partner_id', 'status', 'deal_count', 'total_value'))
+
+    def assertRollupMatchesDeals(self):
+        rows = self._rows()
+        call_command('rebuild_deal_stats', stdout=io.StringIO())
+        self.assertEqual(rows, self._rows())
+
+    def test_rollup_follows_writes(self):
+        self.deal.status = 'SUBMITTED'
+        self.deal.save()
+        self.deal.estimated_value = 250
+        self.deal.save()
+        self.assertRollupMatchesDeals()
+        call_command('check_deal_expiry', stdout=io.StringIO())
+        self.assertRollupMatchesDeals()
+        Deal.objects.get(project_name='S2').delete()
+        self.assertRollupMatchesDeals()
+
+    def test_overview_pages_and_api_read_rollup(self):
+        self.client.login(username='sp', password='pass')
+        with CaptureQueriesContext(connection) as ctx:
+            res = self.client.get('/deals/partner/overview/')
+        self.assertEqual(res.context['total_deals'], 2)
+        self.assertEqual(res.context['draft_deals'], 1)
+        self.assertEqual(res.context['total_value'], 110)
+        self.assertFalse([q for q in ctx.captured_queries if 'deals_deal"' in q['sql']])
+        res = self.client.get('/api/deals/overview/')
+        self.assertEqual(res.json()['total_deals'], 2)
+
+        self.client.login(username='sb', password='pass')
+        res = self.client.get('/deals/brady/overview/')
+        self.assertEqual(res.context['total_deals'], 3)
+        self.assertEqual(res.context['submitted_deals'], 1)
+        res = self.client.get('/api/deals/overview/', {'partner': self.other_org.id})
+        self.assertEqual(res.json()['total_deals'], 1)
+
+    def test_partner_overview_without_an_organisation_is_forbidden(self):
+        User.objects.create_user(username='orphan', password='pass', role='PARTNER')
+        self.client.login(username='orphan', password='pass')
+        self.assertEqual(self.client.get('/deals/partner/overview/').status_code, 403)
+        self.assertEqual(self.client.get('/api/deals/overview/').status_code, 403)
+        self.assertEqual(deal_stats.overview(partner_id=None)['total_deals'], 0)
+        self.assertEqual(deal_stats.overview(all_partners=True)['total_deals'], 3)
+
+
+class TransitionEngineTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.partner_org = PartnerOrganisation.objects.create(name='FlowCo')
+        self.brady_user = User.objects.create_user(username='fb', password='pass', role='BRADY')
+        self.deal = Deal.objects.create(partner=self.partner_org, end_customer_name='A', project_name='Flow', estimated_value=100, product_category='PRINTERS', deal_type='NEW', status='SUBMITTED')
+
+    def test_transition_writes_audit_outbox_and_stats(self):
+        deal = Deal.objects.only(*TRANSITION_FIELDS).get(pk=self.deal.pk)
+        transition(deal, 'APPROVED', user=self.brady_user)
+        self.assertEqual(deal.status, 'APPROVED')
+        self.assertIsNotNone(deal.expiry_date)
+        self.deal.refresh_from_db()
+        self.assertEqual(self.deal.status, 'APPROVED')
+        audit = DealAudit.objects.get(deal=self.deal)
+        self.assertEqual((audit.old_status, audit.new_status, audit.changed_by), ('SUBMITTED', 'APPROVED', self.brady_user))
+        self.assertTrue(OutboxEvent.objects.filter(deal=self.deal, new_status='APPROVED').exists())
+        self.assertEqual(PartnerDealStats.objects.get(partner=self.partner_org, status='APPROVED').deal_count, 1)
+        self.assertEqual(PartnerDealStats.objects.get(partner=self.partner_org, status='SUBMITTED').deal_count, 0)
+
+    def test_invalid_and_concurrent_transitions(self):
+        draft = Deal.objects.create(partner=self.partner_org, end_customer_name='B', project_name='Draft', estimated_value=1, product_category='PRINTERS', deal_type='NEW')
+        with self.assertRaises(InvalidTransition):
+            transition(draft, 'APPROVED')
+        stale = Deal.objects.get(pk=self.deal.pk)
+        transition(Deal.objects.get(pk=self.deal.pk), 'REJECTED', user=self.brady_user)
+        # the second reviewer loaded SUBMITTED but the row has moved on
+        with self.assertRaises(TransitionConflict):
+            transition(stale, 'APPROVED', user=self.brady_user)
+        self.deal.refresh_from_db()
+        self.assertEqual(self.deal.status, 'REJECTED')
+        self.assertEqual(DealAudit.objects.filter(deal=self.deal).count(), 1)
+
+    def test_api_approve_uses_fixed_queries(self):
+        # an existing APPROVED rollup row, so the stats delta is two plain UPDATEs
+        Deal.objects.create(partner=self.partner_org, end_customer_name='C', project_name='Done', estimated_value=1, product_category='PRINTERS', deal_type='NEW', status='APPROVED')
+        self.client.force_authenticate(self.brady_user)
+        with CaptureQueriesContext(connection) as ctx:
+            res = self.client.post(f'/api/deals/{self.deal.id}/approve/')
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.data['status'], 'APPROVED')
+        writes = [q['sql'] for q in ctx.captured_queries if q['sql'].startswith(('UPDATE', 'INSERT'))]
+        # deal UPDATE, audit INSERT, outbox INSERT, two stats UPDATEs, one upsert per analytics rollup
+        self.assertEqual(len(writes), 7)
+        res = self.client.post(f'/api/deals/{self.deal.id}/approve/')
+        self.assertEqual(res.status_code, 400)
+
+    def test_bulk_transition_reports_each_id(self):
+        other = PartnerOrganisation.objects.create(name='ElseCo')
+        second = Deal.objects.create(partner=other, end_customer_name='D', project_name='Second', estimated_value=50, product_category='LABELS', deal_type='NEW', status='UNDER_REVIEW')
+        draft = Deal.objects.create(partner=self.partner_org, end_customer_name='E', project_name='Draft', estimated_value=5, product_category='PRINTERS', deal_type='NEW')
+        self.client.force_authenticate(self.brady_user)
+        ids = [self.deal.id, second.id, draft.id, 999999]
+        with CaptureQueriesContext(connection) as ctx:
+            res = self.client.post('/api/deals/bulk_transition/', {'ids': ids, 'status': 'APPROVED'}, format='json')
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual((res.data['succeeded'], res.data['failed']), (2, 2))
+        results = {r['id']: r for r in res.data['results']}
+        self.assertTrue(results[self.deal.id]['ok'])
+        self.assertTrue(results[second.id]['ok'])
+        self.assertFalse(results[draft.id]['ok'])
+        self.assertEqual(results[999999]['error'], 'Not found')
+        self.assertEqual(Deal.objects.filter(status='APPROVED', expiry_date__isnull=False).count(), 2)
+        self.assertEqual(DealAudit.objects.filter(new_status='APPROVED', changed_by=self.brady_user).count(), 2)
+        self.assertEqual(OutboxEvent.objects.filter(new_status='APPROVED').count(), 2)
+        self.assertEqual(PartnerDealStats.objects.get(partner=other, status='APPROVED').deal_count, 1)
+        # one UPDATE per source status and one bulk INSERT each for audits and outbox events
+        updates = [q['sql'] for q in ctx.captured_queries if q['sql'].startswith('UPDATE "deals_deal"')]
+        inserts = [q['sql'] for q in ctx.captured_queries if q['sql'].startswith(('INSERT INTO "deals_dealaudit"', 'INSERT INTO "notifications_outboxevent"'))]
+        self.assertEqual(len(updates), 2)
+        self.assertEqual(len(inserts), 2)
+
+    def test_bulk_transition_scoped_to_caller(self):
+        partner_user = User.objects.create_user(username='fp', password='pass', role='PARTNER', partner_organisation=self.partner_org)
+        foreign = Deal.objects.create(partner=PartnerOrganisation.objects.create(name='NotMine'), end_customer_name='F', project_name='Foreign', estimated_value=1, product_category='PRINTERS', deal_type='NEW')
+        draft = Deal.objects.create(partner=self.partner_org, end_customer_name='G', project_name='Mine', estimated_value=1, product_category='PRINTERS', deal_type='NEW')
+        self.client.force_authenticate(partner_user)
+        res = self.client.post('/api/deals/bulk_transition/', {'ids': [self.deal.id], 'status': 'APPROVED'}, format='json')
+        self.assertEqual(res.status_code, 403)
+        res = self.client.post('/api/deals/bulk_transition/', {'ids': [draft.id, foreign.id], 'status': 'SUBMITTED'}, format='json')
+        results = {r['id']: r for r in res.data['results']}
+        self.assertTrue(results[draft.id]['ok'])
+        self.assertEqual(results[foreign.id]['error'], 'Not found')
+        foreign.refresh_from_db()
+        self.assertEqual(foreign.status, 'DRAFT')
+        res = self.client.post('/api/deals/bulk_transition/', {'ids': [], 'status': 'SUBMITTED'}, format='json')
+        self.assertEqual(res.status_code, 400)
+
+
+class DealRepresentationTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.partner_org = PartnerOrganisation.objects.create(name='ListCo')
+        self.brady_user = User.objects.create_user(username='lb', password='pass', role='BRADY')
+        self.client.force_authenticate(self.brady_user)
+        for i in range(4):
+            deal = Deal.objects.create(partner=self.partner_org, end_customer_name=f'C{i}', project_name=f'L{i}', estimated_value=i, product_category='PRINTERS', deal_type='NEW')
+            # a growing audit history per deal
+            DealAudit.objects.bulk_create(DealAudit(deal=deal, old_status='DRAFT', new_status='DRAFT', note='n') for _ in range(i * 3))
+        self.deal = deal
+
+    def _list_queries(self, url):
+        with CaptureQueriesContext(connection) as ctx:
+            res = self.client.get(url)
+        self.assertEqual(res.status_code, 200)
+        return res, [q['sql'] for q in ctx.captured_queries if 'SAVEPOINT' not in q['sql']]
+
+    def test_list_is_lean_and_query_count_flat(self):
+        res, queries = self._list_queries('/api/deals/')
+        self.assertNotIn('audit_trail', res.data['results'][0])
+        self.assertFalse(any('deals_dealaudit' in sql for sql in queries))
+        res, queries = self._list_queries('/api/deals/?expand=audit_trail')
+        self.assertEqual(sorted(len(d['audit_trail']) for d in res.data['results']), [0, 3, 6, 9])
+        # one prefetch for the whole page, whatever the history length
+        self.assertEqual(sum('deals_dealaudit' in sql for sql in queries), 1)
+
+    def test_sparse_fieldsets_select_fewer_columns(self):
+        res, queries = self._list_queries('/api/deals/?fields=project_name,estimated_value')
+        self.assertEqual(set(res.data['results'][0]), {'id', 'project_name', 'estimated_value'})
+        select = next(sql for sql in queries if sql.startswith('SELECT') and 'FROM "deals_deal"' in sql and 'COUNT' not in sql)
+        self.assertNotIn('end_customer_name', select)
+        self.assertNotIn('accounts_partnerorganisation', select)
+        res = self.client.get('/api/deals/brady_dashboard/?fields=status&sort=project_name')
+        self.assertEqual(set(res.data['results'][0]), {'id', 'status'})
+
+    def test_detail_includes_audit_trail(self):
+        res = self.client.get(f'/api/deals/{self.deal.id}/')
+        self.assertEqual(len(res.data['audit_trail']), 9)
+        res = self.client.get(f'/api/deals/{self.deal.id}/?fields=status')
+        self.assertEqual(set(res.data), {'id', 'status', 'audit_trail'})
+
+
+class DealAuditEndpointTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.partner_org = PartnerOrganisation.objects.create(name='AuditCo')
+        self.partner_user = User.objects.create_user(username='ap', password='pass', role='PARTNER', partner_organisation=self.partner_org)
+        self.other_user = User.objects.create_user(username='ao', password='pass', role='PARTNER', partner_organisation=PartnerOrganisation.objects.create(name='Else'))
+        self.deal = Deal.objects.create(partner=self.partner_org, end_customer_name='A', project_name='Audited', estimated_value=1, product_category='PRINTERS', deal_type='NEW')
+        DealAudit.objects.bulk_create(DealAudit(deal=self.deal, changed_by=self.partner_user, new_status='DRAFT', note=str(i)) for i in range(7))
+
+    def test_pages_newest_first_with_user_joined(self):
+        self.client.force_authenticate(self.partner_user)
+        load_principal(self.partner_user)
+        url = f'/api/deals/{self.deal.id}/audit/?page_size=3'
+        notes = []
+        while url:
+            with CaptureQueriesContext(connection) as ctx:
+                res = self.client.get(url)
+            self.assertEqual(res.status_code, 200)
+            # the deal lookup and one page query, with changed_by joined
+            self.assertEqual(len(ctx.captured_queries), 2)
+            notes += [entry['note'] for entry in res.data['results']]
+            self.assertEqual(res.data['results'][0]['changed_by_username'], 'ap')
+            url = res.data['next']
+        self.assertEqual(notes, [str(i) for i in range(6, -1, -1)])
+
+    def test_since_and_scoping(self):
+        self.client.force_authenticate(self.partner_user)
+        latest = DealAudit.objects.filter(deal=self.deal).order_by('-timestamp', '-id').first()
+        res = self.client.get(f'/api/deals/{self.deal.id}/audit/', {'since': latest.timestamp.isoformat()})
+        self.assertEqual(res.data['results'], [])
+        res = self.client.get(f'/api/deals/{self.deal.id}/audit/', {'since': 'yesterday'})
+        self.assertEqual(res.status_code, 400)
+        self.client.force_authenticate(self.other_user)
+        res = self.client.get(f'/api/deals/{self.deal.id}/audit/')
+        self.assertEqual(res.status_code, 404)
@@ -0,0 +1,107 @@
+import io
+from datetime import timedelta
+
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from deals import history
+from deals.models import Deal, DealAudit, DealStatusSnapshot
+from deals.testing import DealFixturesMixin
+from deals.transitions import transition
+
+
+class AsOfTests(DealFixturesMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.now = timezone.now()
+
+    def days_ago(self, days):
+        return self.now - timedelta(days=days)
+
+    def deal(self, created, moves, value=1000, org=None, **fields):
+        """A deal created ``created`` days ago that moved to each status in ``moves`` (status -> days ago)."""
+        deal = super().deal(org, **{'estimated_value': value, 'region': self.uki, **fields})
+        for target in moves:
+            transition(deal, target)
+        Deal.objects.filter(pk=deal.pk).update(created_at=self.days_ago(created))
+        for target, days in moves.items():
+            DealAudit.objects.filter(deal=deal, new_status=target).update(timestamp=self.days_ago(days))
+        return deal
+
+    def statuses(self, days, **kwargs):
+        return dict(history.deals_as_of(self.days_ago(days), **kwargs).values_list('id', 'as_of_status'))
+
+    def test_reconstructs_statuses_from_the_audit_trail(self):
+        a = self.deal(30, {'SUBMITTED': 20, 'APPROVED': 10, 'CLOSED_WON': 1})
+        b = self.deal(15, {'SUBMITTED': 15, 'REJECTED': 5})
+        c = self.deal(8, {})
+        # created straight into a status, so no audit row says what it was before
+        d = Deal.objects.create(partner=self.org, project_name='Imported', end_customer_name='C', estimated_value=5,
+                                product_category='RFID', deal_type='NEW', status='APPROVED')
+        Deal.objects.filter(pk=d.pk).update(created_at=self.days_ago(40))
+
+        self.assertEqual(self.statuses(25), {a.pk: 'DRAFT', d.pk: 'APPROVED'})
+        self.assertEqual(self.statuses(12), {a.pk: 'SUBMITTED', b.pk: 'SUBMITTED', d.pk: 'APPROVED'})
+        self.assertEqual(self.statuses(6), {a.pk: 'APPROVED', b.pk: 'SUBMITTED', c.pk: 'DRAFT', d.pk: 'APPROVED'})
+        self.assertEqual(self.statuses(0), {a.pk: 'CLOSED_WON', b.pk: 'REJECTED', c.pk: 'DRAFT', d.pk: 'APPROVED'})
+
+    def test_snapshots_give_the_same_answers_without_older_audit_rows(self):
+        a = self.deal(30, {'SUBMITTED': 20, 'APPROVED': 10, 'CLOSED_WON': 1})
+        b = self.deal(15, {'SUBMITTED': 15, 'REJECTED': 5})
+        self.deal(3, {'SUBMITTED': 2})
+        expected = {days: self.statuses(days) for days in (12, 6, 2, 0)}
+        snapshot = history.take_snapshot(self.days_ago(12))
+        self.assertEqual(snapshot.deal_count, 2)
+        self.assertEqual(dict(snapshot.rows.values_list('deal_id', 'status')), {a.pk: 'SUBMITTED', b.pk: 'SUBMITTED'})
+        # later queries only read audit rows newer than the checkpoint
+        DealAudit.objects.filter(timestamp__lte=snapshot.taken_at).delete()
+        for days, statuses in expected.items():
+            self.assertEqual(self.statuses(days), statuses, days)
+
+    def test_command_takes_and_prunes_checkpoints(self):
+        self.deal(5, {'SUBMITTED': 4})
+        for _ in range(3):
+            call_command('snapshot_deal_statuses', '--keep=2', stdout=io.StringIO())
+        self.assertEqual(DealStatusSnapshot.objects.count(), 2)
+        self.assertEqual([s.deal_count for s in DealStatusSnapshot.objects.all()], [1, 1])
+        self.assertEqual(history.latest_snapshot(timezone.now()), DealStatusSnapshot.objects.first())
+
+    def test_report_query_count_does_not_grow_with_history(self):
+        self.deal(10, {'SUBMITTED': 9}, org=self.other_org)
+
+        def queries():
+            with CaptureQueriesContext(connection) as ctx:
+                history.report(self.days_ago(5), group_by=['partner', 'status'])
+            return len(ctx.captured_queries)
+
+        before = queries()
+        for _ in range(20):
+            self.deal(10, {'SUBMITTED': 9, 'APPROVED': 8})
+        self.assertEqual(queries(), before)
+        self.assertEqual(before, 3)
+
+    def test_api_reports_as_of_a_date_and_scopes_partners(self):
+        self.deal(30, {'SUBMITTED': 20, 'APPROVED': 10}, value=100)
+        self.deal(30, {'SUBMITTED': 20}, value=10, org=self.other_org)
+        self.deal(2, {}, value=1)
+        day = self.days_ago(15).date().isoformat()
+        client = APIClient()
+        client.force_authenticate(self.brady)
+        body = client.get('/api/deals/as_of/', {'at': day}).json()
+        self.assertEqual([(r['status'], r['count'], r['value']) for r in body['rows']], [('SUBMITTED', 2, 110)])
+        self.assertIsNone(body['snapshot'])
+
+        body = client.get('/api/deals/as_of/', {'at': self.now.isoformat(), 'group_by': 'partner,status', 'status': 'APPROVED,DRAFT'}).json()
+        rows = [(r['partner_name'], r['status'], r['count']) for r in body['rows']]
+        self.assertEqual(sorted(rows), [('Northwind', 'APPROVED', 1), ('Northwind', 'DRAFT', 1)])
+
+        client.force_authenticate(self.partner)
+        body = client.get('/api/deals/as_of/', {'at': day, 'group_by': ''}).json()
+        self.assertEqual(body['rows'], [{'count': 1, 'value': 100}])
+
+        for query in ({}, {'at': 'yesterday'}, {'at': day, 'group_by': 'period'}):
+            self.assertEqual(client.get('/api/deals/as_of/', query).status_code, 400, query)
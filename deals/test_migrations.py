@@ -0,0 +1,45 @@
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import TransactionTestCase
+
+
+class RegionBackfillMigrationTests(TransactionTestCase):
+    # the region seed data must survive for the other tests
+    serialized_rollback = True
+
+    before = [('deals', '0006_deal_conflicts')]
+    after = [('deals', '0007_region_dimension')]
+
+    def migrate(self, targets):
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate(targets)
+        return executor.loader.project_state(targets).apps
+
+    def tearDown(self):
+        self.migrate(MigrationExecutor(connection).loader.graph.leaf_nodes())
+
+    def test_free_text_regions_are_matched_or_filed_under_other(self):
+        apps = self.migrate(self.before)
+        Partner = apps.get_model('accounts', 'PartnerOrganisation')
+        Deal = apps.get_model('deals', 'Deal')
+        partner = Partner.objects.create(name='Northwind')
+        texts = ['U.K.', 'germany', 'Other', 'other ', 'Atlantis', 'ATLANTIS!', 'Mars', 'Zürich', 'Zurich', '']
+        for text in texts:
+            Deal.objects.create(partner=partner, end_customer_name='C', project_name=text or 'blank', estimated_value=1,
+                                product_category='LABELS', deal_type='NEW', region=text)
+
+        apps = self.migrate(self.after)
+        Deal = apps.get_model('deals', 'Deal')
+        Region = apps.get_model('deals', 'Region')
+        regions = dict(Deal.objects.values_list('project_name', 'region__code'))
+        self.assertEqual(regions['U.K.'], 'UKI')
+        self.assertEqual(regions['germany'], 'DACH')
+        self.assertEqual(regions['Other'], 'OTHER')
+        self.assertEqual(regions['other '], 'OTHER')
+        self.assertEqual(regions['Atlantis'], regions['ATLANTIS!'])
+        self.assertEqual(regions['Zürich'], regions['Zurich'])
+        self.assertIsNone(regions['blank'])
+        for code in (regions['Atlantis'], regions['Mars'], regions['Zurich']):
+            self.assertTrue(Region.objects.get(code=code).path.startswith('other/'), code)
+        self.assertEqual(Region.objects.filter(code='OTHER').count(), 1)
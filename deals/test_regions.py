@@ -0,0 +1,102 @@
+from django.db import connection
+from django.test import Client, TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from deals import regions
+from deals.models import Deal, Region, RegionAlias
+from deals.testing import DealFixturesMixin
+
+
+class RegionTests(DealFixturesMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.na = Region.objects.get(code='NA')
+
+    def deal(self, region, org=None, **fields):
+        return super().deal(org, region=region, **fields)
+
+    def ids(self, response):
+        return sorted(d['id'] for d in response.json()['results'])
+
+    def test_resolve_spellings_and_prefixes(self):
+        for text in ('UKI', 'uk & ireland', 'U.K.', '  United   Kingdom ', 'emea/uki'):
+            self.assertEqual(regions.resolve(text), self.uki.pk, text)
+        self.assertIsNone(regions.resolve('Atlantis'))
+        self.assertEqual(regions.resolve('Deutschland'), self.dach.pk)
+        emea = set(Region.objects.filter(path__startswith='emea').values_list('pk', flat=True))
+        self.assertEqual(regions.resolve_prefix('emea'), emea)
+        self.assertEqual(regions.resolve_prefix('europe'), emea)
+        self.assertEqual(regions.resolve_prefix('nor'), {Region.objects.get(code='NORDICS').pk, self.na.pk})
+        self.assertEqual(regions.resolve_prefix(''), set())
+
+    def test_resolving_is_cached_and_dropped_on_alias_changes(self):
+        regions.resolve('uk')
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertEqual(regions.resolve('uk'), self.uki.pk)
+        self.assertEqual(len(ctx.captured_queries), 0)
+        RegionAlias.objects.create(region=self.dach, key='Bavaria ')
+        self.assertEqual(regions.resolve('bavaria'), self.dach.pk)
+
+    def test_api_filters_exact_and_prefix(self):
+        uk = self.deal(self.uki)
+        de = self.deal(self.dach)
+        us = self.deal(self.na)
+        client = APIClient()
+        client.force_authenticate(self.brady)
+        self.assertEqual(self.ids(client.get('/api/deals/', {'region': 'u.k.'})), [uk.pk])
+        self.assertEqual(self.ids(client.get('/api/deals/', {'region': 'emea'})), [])
+        self.assertEqual(self.ids(client.get('/api/deals/', {'region_prefix': 'emea'})), [uk.pk, de.pk])
+        self.assertEqual(self.ids(client.get('/api/deals/', {'region_prefix': 'amer'})), [us.pk])
+        self.assertEqual(self.ids(client.get('/api/deals/', {'region': 'atlantis'})), [])
+        body = client.get('/api/deals/brady_dashboard/', {'region_prefix': 'EMEA'}).json()
+        self.assertEqual(sorted(d['id'] for d in body['results']), [uk.pk, de.pk])
+
+    def test_api_reads_and_writes_regions_by_name_or_alias(self):
+        client = APIClient()
+        client.force_authenticate(self.partner)
+        payload = {'project_name': 'P', 'end_customer_name': 'C', 'estimated_value': '10', 'product_category': 'LABELS', 'deal_type': 'NEW'}
+        response = client.post('/api/deals/', {**payload, 'region': 'germany'}, format='json')
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual(response.json()['region'], 'DACH')
+        self.assertEqual(Deal.objects.get(pk=response.json()['id']).region_id, self.dach.pk)
+
+        response = client.post('/api/deals/', {**payload, 'region': 'Atlantis'}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('region', response.json())
+
+        response = client.post('/api/deals/', {**payload, 'region': ''}, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertIsNone(response.json()['region'])
+
+        # sparse fieldsets read the name from the cached map, not a join per row
+        self.deal(self.uki)
+        body = client.get('/api/deals/', {'fields': 'id,region'}).json()
+        self.assertEqual(sorted(str(d['region']) for d in body['results']), ['DACH', 'None', 'UK & Ireland'])
+
+    def test_region_rollup(self):
+        self.deal(self.uki, estimated_value=100)
+        self.deal(self.uki, estimated_value=50, status='APPROVED')
+        self.deal(self.dach, self.other_org, estimated_value=10)
+        self.deal(None, estimated_value=1)
+        client = APIClient()
+        client.force_authenticate(self.brady)
+        rows = client.get('/api/deals/regions/').json()
+        self.assertEqual([(r['region'], r['count'], r['value']) for r in rows], [('DACH', 1, 10), ('UKI', 2, 150), (None, 1, 1)])
+        self.assertEqual(rows[1]['by_status']['APPROVED'], {'count': 1, 'value': 50})
+
+        client.force_authenticate(self.partner)
+        rows = client.get('/api/deals/regions/').json()
+        self.assertEqual([(r['region'], r['count']) for r in rows], [('UKI', 2), (None, 1)])
+
+    def test_web_dashboard_filters_by_region_path(self):
+        uk = self.deal(self.uki)
+        self.deal(self.na)
+        client = Client()
+        client.force_login(self.brady)
+        response = client.get(reverse('deals:brady_deals'), {'region': 'emea'})
+        self.assertEqual([d.pk for d in response.context['deals']], [uk.pk])
+        self.assertContains(response, '<option value="emea/uki" > UK &amp; Ireland</option>', html=False)
+        response = client.get(reverse('deals:brady_overview'))
+        self.assertContains(response, 'UK &amp; Ireland')
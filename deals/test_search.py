@@ -0,0 +1,111 @@
+import io
+from unittest.mock import patch
+
+from django.core.management import call_command
+from django.db import connection
+from django.test import Client, TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from deals.models import Deal
+from deals.search import match_expression, search
+from deals.testing import DealFixturesMixin
+
+
+class DealSearchTests(DealFixturesMixin, TestCase):
+    def found(self, text, qs=None):
+        return list(search(qs if qs is not None else Deal.objects.all(), text).order_by('search_rank', 'id').values_list('pk', flat=True))
+
+    def test_index_follows_saves_deletes_and_partner_renames(self):
+        deal = self.deal(project_name='Warehouse labelling', description='Thermal printers for the Leeds site')
+        self.assertEqual(self.found('wareh'), [deal.pk])
+        self.assertEqual(self.found('leeds thermal'), [deal.pk])
+        self.assertEqual(self.found('northwind'), [deal.pk])
+
+        deal.project_name = 'Cold store'
+        deal.save()
+        self.assertEqual(self.found('warehouse'), [])
+        self.assertEqual(self.found('cold'), [deal.pk])
+
+        self.org.name = 'Fabrikam'
+        self.org.save()
+        self.assertEqual(self.found('northwind'), [])
+        self.assertEqual(self.found('fabrikam'), [deal.pk])
+
+        # saving the partner without renaming it leaves the index alone
+        with patch('deals.search.index_partner') as index_partner:
+            self.org.save()
+            self.org.name = 'Fabrikam Ltd'
+            self.org.save(update_fields=['name'])
+        index_partner.assert_called_once_with(self.org.pk)
+
+        deal.delete()
+        self.assertEqual(self.found('cold'), [])
+
+    def test_status_only_saves_skip_reindexing(self):
+        deal = Deal.objects.get(pk=self.deal(project_name='Scanner rollout').pk)
+        deal.status = 'SUBMITTED'
+        with CaptureQueriesContext(connection) as ctx:
+            deal.save()
+        self.assertFalse([q for q in ctx.captured_queries if 'deals_deal_fts' in q['sql']])
+        self.assertEqual(self.found('scanner'), [deal.pk])
+
+    def test_project_matches_rank_above_description_matches(self):
+        in_description = self.deal(project_name='Line refresh', description='Includes RFID tags')
+        in_project = self.deal(project_name='RFID tracking')
+        self.assertEqual(self.found('rfid'), [in_project.pk, in_description.pk])
+
+    def test_user_input_never_reaches_fts_syntax(self):
+        deal = self.deal(project_name='Acme OR and labels')
+        for text in ['acme"', 'acme OR', '"acme" AND (labels)', 'acme*', '(acme', 'acme -labels']:
+            self.assertIn(deal.pk, self.found(text), text)
+        self.assertIsNone(match_expression('  "*"  '))
+        self.assertEqual(self.found('***'), [])
+
+    def test_api_search_is_ranked_and_scoped_to_the_partner(self):
+        mine = self.deal(project_name='Harbour scanners')
+        mine_weaker = self.deal(project_name='Refresh', description='harbour office')
+        self.deal(self.other_org, project_name='Harbour printers')
+        client = APIClient()
+        client.force_authenticate(self.partner)
+        response = client.get('/api/deals/', {'q': 'harbour'})
+        self.assertEqual([d['id'] for d in response.json()['results']], [mine.pk, mine_weaker.pk])
+
+        client.force_authenticate(self.brady)
+        response = client.get('/api/deals/', {'q': 'harbour'})
+        self.assertEqual(response.json()['count'], 3)
+
+    def test_brady_dashboard_pages_through_ranked_results(self):
+        expected = [self.deal(project_name=f'Pallet labels {i}', description='pallet ' * i).pk for i in range(5)]
+        self.deal(project_name='Unrelated')
+        client = APIClient()
+        client.force_authenticate(self.brady)
+        seen = []
+        url = '/api/deals/brady_dashboard/?q=pallet&page_size=2'
+        while url:
+            body = client.get(url).json()
+            seen += [d['id'] for d in body['results']]
+            url = body['next']
+        self.assertEqual(sorted(seen), sorted(expected))
+        self.assertEqual(seen, self.found('pallet'))
+        # an explicit sort still applies within the matches
+        body = client.get('/api/deals/brady_dashboard/', {'q': 'pallet', 'sort': 'project_name'}).json()
+        self.assertEqual([d['project_name'] for d in body['results']], [f'Pallet labels {i}' for i in range(5)])
+
+    def test_web_brady_dashboard_search(self):
+        hit = self.deal(project_name='Kiosk printers')
+        self.deal(project_name='Other')
+        client = Client()
+        client.force_login(self.brady)
+        response = client.get(reverse('deals:brady_deals'), {'q': 'kiosk'})
+        self.assertEqual([d.pk for d in response.context['deals']], [hit.pk])
+        self.assertEqual(response.context['sort_by'], 'search_rank')
+        self.assertContains(response, 'Best Match')
+
+    def test_rebuild_command_catches_up_after_bulk_updates(self):
+        deal = self.deal(project_name='Forklift labels')
+        Deal.objects.filter(pk=deal.pk).update(project_name='Dock doors')
+        self.assertEqual(self.found('dock'), [])
+        call_command('rebuild_deal_search', stdout=io.StringIO())
+        self.assertEqual(self.found('dock'), [deal.pk])
@@ -1,7 +1,7 @@
 from django.test import TestCase, Client
 from django.urls import reverse
 from django.contrib.auth import get_user_model
-from .models import Deal
+from .models import Deal, DealAudit
 from accounts.models import PartnerOrganisation
 
 User = get_user_model()
@@ -44,3 +44,33 @@ class WebViewsTest(TestCase):
         resp = c.post(reverse('deals:approve_deal', args=[self.deal.id]))
         self.deal.refresh_from_db()
         self.assertEqual(self.deal.status, 'APPROVED')
+
+    def test_dashboard_keyset_pages(self):
+        for i in range(25):
+            Deal.objects.create(partner=self.partner_org, project_name=f'Bulk {i:02d}', end_customer_name='ACME', estimated_value=i, product_category='PRINTERS', deal_type='NEW')
+        c = Client()
+        c.login(username='buser', password='pass')
+        r = c.get(reverse('deals:brady_deals'), {'sort': 'project_name'})
+        self.assertEqual(r.status_code, 200)
+        first = [d.project_name for d in r.context['deals']]
+        self.assertEqual(first, sorted(first))
+        self.assertEqual(len(first), 20)
+        self.assertIsNone(r.context['previous_url'])
+        r = c.get(reverse('deals:brady_deals') + r.context['next_url'])
+        second = [d.project_name for d in r.context['deals']]
+        self.assertEqual(len(second), 6)
+        self.assertGreater(second[0], first[-1])
+        self.assertIsNone(r.context['next_url'])
+
+    def test_detail_timeline_loads_in_pages(self):
+        DealAudit.objects.bulk_create(DealAudit(deal=self.deal, changed_by=self.brady, new_status='DRAFT', note=f'entry {i:02d}') for i in range(25))
+        c = Client()
+        c.login(username='puser', password='pass')
+        r = c.get(reverse('deals:deal_detail', args=[self.deal.id]))
+        self.assertEqual(len(r.context['timeline']), 20)
+        self.assertContains(r, 'entry 24')
+        self.assertNotContains(r, 'entry 04')
+        r = c.get(r.context['timeline_older_url'])
+        self.assertEqual(len(r.context['timeline']), 5)
+        self.assertContains(r, 'entry 00')
+        self.assertIsNone(r.context['timeline_older_url'])
@@ -0,0 +1,33 @@
+"""Fixtures shared by the deals test modules."""
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+
+from accounts.models import PartnerOrganisation
+
+from .models import Deal, Region
+
+
+class DealFixturesMixin:
+    """Two partner organisations, a partner user of the first, a Brady user and the UKI and DACH regions.
+
+    Mix into a ``TestCase``; ``deal()`` creates a deal for ``org`` (default
+    ``self.org``) with plain defaults that ``fields`` override.
+    """
+
+    def setUp(self):
+        super().setUp()
+        # the region and stats caches outlive each test's transaction
+        cache.clear()
+        User = get_user_model()
+        self.org = PartnerOrganisation.objects.create(name='Northwind')
+        self.other_org = PartnerOrganisation.objects.create(name='Contoso')
+        self.partner = User.objects.create_user('partner', password='pass', role='PARTNER', partner_organisation=self.org)
+        self.brady = User.objects.create_user('brady', password='pass', role='BRADY')
+        self.uki = Region.objects.get(code='UKI')
+        self.dach = Region.objects.get(code='DACH')
+
+    def deal(self, org=None, **fields):
+        values = dict(partner=org or self.org, project_name='Project', end_customer_name='Customer', estimated_value=1000,
+                      product_category='LABELS', deal_type='NEW')
+        values.update(fields)
+        return Deal.objects.create(**values)
@@ -0,0 +1,95 @@
+"""In-memory change tracking for model instances.
+
+Instances loaded from the database remember the values they were loaded with,
+so callers (signals in particular) can tell what changed without re-reading
+the row, and ``save()`` only writes the columns that actually changed.
+"""
+
+_MISSING = object()
+
+
+class FieldTrackingMixin:
+    """Remember loaded field values and save only dirty columns.
+
+    ``save()`` switches to ``update_fields`` automatically when the instance
+    came from the database and the caller did not pass ``update_fields``
+    itself. ``auto_now`` fields are always included so timestamps still move.
+
+    That differs from a plain ``save()`` in two ways:
+
+    - If the row has been deleted meanwhile, the save raises ``DatabaseError``
+      ("Save with update_fields did not affect any rows") instead of inserting
+      it again. Pass ``force_insert=True`` to re-create it.
+    - The dirty columns are worked out before ``pre_save`` fires, so a column
+      a ``pre_save`` receiver assigns is not written. Assign derived columns in
+      ``save()`` before calling ``super()``, as ``Deal.save`` does for
+      ``customer_key``.
+    """
+
+    _loaded_values = None
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._snapshot()
+        return instance
+
+    def _snapshot(self, fields=None):
+        loaded = {} if fields is None or self._loaded_values is None else dict(self._loaded_values)
+        for field in self._meta.concrete_fields:
+            if fields is not None and field.attname not in fields and field.name not in fields:
+                continue
+            if field.attname in self.__dict__:
+                loaded[field.attname] = self.__dict__[field.attname]
+        self._loaded_values = loaded
+
+    def refresh_from_db(self, using=None, fields=None, **kwargs):
+        super().refresh_from_db(using=using, fields=fields, **kwargs)
+        self._snapshot(fields)
+
+    def mark_clean(self, fields=None):
+        """Treat the current values as persisted, e.g. after a queryset ``update()``."""
+        self._snapshot(fields)
+
+    @property
+    def is_tracked(self):
+        return self._loaded_values is not None
+
+    def get_original(self, field_name, default=None):
+        field = self._meta.get_field(field_name)
+        return (self._loaded_values or {}).get(field.attname, default)
+
+    def get_dirty_fields(self):
+        """Return ``{attname: original value}`` for every changed field.
+
+        Fields assigned after a deferred load are dirty, because there is no
+        loaded value to compare them against.
+        """
+        if self._loaded_values is None:
+            return {}
+        dirty = {}
+        for field in self._meta.concrete_fields:
+            if field.attname not in self.__dict__:
+                continue
+            original = self._loaded_values.get(field.attname, _MISSING)
+            if original is _MISSING or original != self.__dict__[field.attname]:
+                dirty[field.attname] = None if original is _MISSING else original
+        return dirty
+
+    def has_changed(self, field_name):
+        return self._meta.get_field(field_name).attname in self.get_dirty_fields()
+
+    def save(self, *args, **kwargs):
+        if (
+            not args
+            and self.is_tracked
+            and not self._state.adding
+            and kwargs.get('update_fields') is None
+            and not kwargs.get('force_insert')
+        ):
+            dirty = self.get_dirty_fields()
+            if self._meta.pk.attname not in dirty:
+                auto_now = [f.attname for f in self._meta.concrete_fields if getattr(f, 'auto_now', False)]
+                kwargs['update_fields'] = list(dict.fromkeys([*dirty, *auto_now]))
+        super().save(*args, **kwargs)
+        self._snapshot(kwargs.get('update_fields'))
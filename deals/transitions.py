@@ -0,0 +1,154 @@
+"""Deal state transitions as single conditional UPDATEs.
+
+``transition()`` moves one loaded deal with ``UPDATE ... WHERE pk = %s AND
+status = <the status it was loaded with>``, which only matches while that
+status is still one of ``Deal.TRANSITIONS[target]``. The audit row, the
+notification outbox event and the stats and analytics rollup deltas are written in the same
+transaction. A concurrent reviewer who got there first makes the UPDATE match
+nothing, which surfaces as TransitionConflict instead of a silent overwrite.
+"""
+from collections import Counter
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from monitoring.metrics import DEAL_TRANSITIONS
+
+from . import conflicts
+from .analytics import dims_of
+from .models import Deal, DealAudit
+from .stats import StatsDelta
+
+# columns a deal must have loaded to be transitioned
+TRANSITION_FIELDS = ('id', 'status', 'partner', 'estimated_value', 'expiry_date', 'updated_at', 'product_category', 'region', 'deal_type')
+
+
+class TransitionError(Exception):
+    pass
+
+
+class InvalidTransition(TransitionError):
+    """The deal's current status does not allow the requested target."""
+
+
+class TransitionConflict(TransitionError):
+    """The deal changed status after it was loaded."""
+
+
+def approval_expiry(when):
+    days = getattr(settings, 'DEAL_MIN_EXPIRY_DAYS', 90)
+    return when.date() + timedelta(days=days)
+
+
+def can_transition(status, target):
+    return status in Deal.TRANSITIONS.get(target, ())
+
+
+def transition_values(target, now):
+    values = {'status': target, 'updated_at': now}
+    if target == 'APPROVED':
+        values['expiry_date'] = approval_expiry(now)
+    return values
+
+
+def record_side_effects(changes, user=None, note=''):
+    """Write audit rows, outbox events and the stats delta for applied changes.
+
+    ``changes`` is a list of ``(deal_id, partner_id, estimated_value, old, new, dims)``
+    where ``dims`` is ``analytics.dims_of(deal)``.
+    """
+    from notifications.models import OutboxEvent
+
+    if not changes:
+        return
+    delta = StatsDelta()
+    audits = []
+    events = []
+    # reviewers see likely duplicates in the submission's audit note
+    warnings = conflicts.submission_notes(deal_id for deal_id, _, _, _, new, _ in changes if new == 'SUBMITTED')
+    for deal_id, partner_id, value, old, new, dims in changes:
+        delta.move(partner_id, old, new, value, dims=dims)
+        audit_note = '\n'.join(filter(None, [note, warnings.get(deal_id)]))
+        audits.append(DealAudit(deal_id=deal_id, changed_by=user, old_status=old, new_status=new, note=audit_note))
+        events.append(OutboxEvent(deal_id=deal_id, changed_by=user, old_status=old, new_status=new))
+    if len(audits) == 1:
+        audits[0].save()
+        events[0].save()
+    else:
+        DealAudit.objects.bulk_create(audits)
+        OutboxEvent.objects.bulk_create(events)
+    delta.apply()
+    count_transitions((old, new) for _, _, _, old, new, _ in changes)
+
+
+def count_transitions(pairs):
+    """Count ``(old, new)`` status changes once the transaction commits."""
+    totals = Counter(pairs)
+    transaction.on_commit(lambda: [DEAL_TRANSITIONS.inc(n, from_status=old, to_status=new) for (old, new), n in totals.items()])
+
+
+def transition(deal, target, user=None, note=''):
+    """Move ``deal`` to ``target`` and update the instance in place.
+
+    Raises InvalidTransition or TransitionConflict; nothing is written then.
+    """
+    old = deal.status
+    if not can_transition(old, target):
+        raise InvalidTransition(f'Cannot move a deal from {old} to {target}')
+    values = transition_values(target, timezone.now())
+    with transaction.atomic():
+        if not Deal.objects.filter(pk=deal.pk, status=old).update(**values):
+            raise TransitionConflict('The deal was changed by someone else; reload and try again')
+        record_side_effects([(deal.pk, deal.partner_id, deal.estimated_value, old, target, dims_of(deal))], user=user, note=note)
+    for field, value in values.items():
+        setattr(deal, field, value)
+    # the row now matches the instance; keep change tracking clean
+    deal.mark_clean(list(values))
+    return deal
+
+
+def bulk_transition(queryset, ids, target, user=None, note=''):
+    """Move many deals to ``target`` with one UPDATE per source status.
+
+    ``queryset`` scopes which deals the caller may touch, so permission checks
+    cost the single SELECT that reads the current statuses. Returns
+    ``{id: (ok, status_or_error)}`` for every requested id.
+    """
+    ids = list(dict.fromkeys(ids))
+    sources = Deal.TRANSITIONS.get(target, ())
+    rows = queryset.filter(pk__in=ids).order_by().values_list('id', 'status', 'partner_id', 'estimated_value', 'product_category', 'region_id', 'deal_type')
+    current = {row[0]: row for row in rows}
+
+    results = {}
+    groups = {}
+    for deal_id in ids:
+        row = current.get(deal_id)
+        if row is None:
+            results[deal_id] = (False, 'Not found')
+        elif row[1] not in sources:
+            results[deal_id] = (False, f'Cannot move a deal from {row[1]} to {target}')
+        else:
+            groups.setdefault(row[1], []).append(row)
+
+    now = timezone.now()
+    values = transition_values(target, now)
+    changes = []
+    with transaction.atomic():
+        for old, group in groups.items():
+            group_ids = [row[0] for row in group]
+            updated = Deal.objects.filter(pk__in=group_ids, status=old).update(**values)
+            if updated != len(group_ids):
+                # some rows moved concurrently; ours are the ones stamped with this run's time
+                mine = set(Deal.objects.filter(pk__in=group_ids, status=target, updated_at=now).values_list('id', flat=True))
+            else:
+                mine = set(group_ids)
+            for deal_id, _, partner_id, value, *dims in group:
+                if deal_id in mine:
+                    changes.append((deal_id, partner_id, value, old, target, tuple(dims)))
+                    results[deal_id] = (True, target)
+                else:
+                    results[deal_id] = (False, 'The deal was changed by someone else; reload and try again')
+        record_side_effects(changes, user=user, note=note)
+    return results
@@ -12,6 +12,7 @@ urlpatterns = [
     path('brady/overview/', web.BradyDashboardOverviewView.as_view(), name='brady_overview'),
     path('create/', web.DealCreateView.as_view(), name='create_deal'),
     path('<int:pk>/', web.DealDetailView.as_view(), name='deal_detail'),
+    path('<int:pk>/timeline/', web.DealTimelineView.as_view(), name='deal_timeline'),
     path('<int:pk>/submit/', web.SubmitDealView.as_view(), name='submit_deal'),
     path('<int:pk>/approve/', web.ApproveDealView.as_view(), name='approve_deal'),
     path('<int:pk>/reject/', web.RejectDealView.as_view(), name='reject_deal'),
@@ -1,15 +1,29 @@
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
+from rest_framework.permissions import SAFE_METHODS
 from rest_framework.response import Response
 from django.shortcuts import get_object_or_404
-from django.http import HttpResponse
-import csv
+from django.http import StreamingHttpResponse
 from django.conf import settings
-from datetime import timedelta
-from .models import Deal
-from .serializers import DealSerializer
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from .models import Deal, DealAudit
+from .serializers import AnalyticsQuerySerializer, AsOfQuerySerializer, AuditEntrySerializer, BulkTransitionSerializer, DealListSerializer, DealSerializer, query_list
 from .permissions import DealPermissions
 from .filters import DealFilter
+from .export import EXPORT_FORMATS, iter_rows
+from .pagination import AuditKeysetPagination, DealKeysetPagination, clean_sort
+from .conflicts import find_conflicts
+from .transitions import InvalidTransition, TransitionConflict, bulk_transition, transition
+from . import analytics as deal_analytics
+from . import history as deal_history
+from . import regions as deal_regions
+from . import stats as deal_stats
+from accounts.principal import get_principal
+
+
+# statuses only Brady reviewers may move deals into
+REVIEW_STATUSES = ('UNDER_REVIEW', 'APPROVED', 'REJECTED')
 
 
 class DealViewSet(viewsets.ModelViewSet):
@@ -19,58 +33,138 @@ class DealViewSet(viewsets.ModelViewSet):
     filterset_class = DealFilter
 
     def get_queryset(self):
-        user = self.request.user
+        principal = get_principal(self.request)
         qs = super().get_queryset()
-        if user.role == 'PARTNER':
-            return qs.filter(partner=user.partner_organisation)
+        if principal.is_partner:
+            qs = qs.filter(partner_id=principal.partner_id)
+        if self.request.method in SAFE_METHODS:
+            qs = self._narrow_for_read(qs)
+        return qs
+
+    def _narrow_for_read(self, qs):
+        # ?fields= becomes only(); the audit trail is prefetched only when it is rendered
+        wanted = query_list(self.request, 'fields')
+        if wanted:
+            columns = [f.name for f in Deal._meta.concrete_fields if f.name in wanted or f.attname in wanted]
+            # keyset paging reads the sort column of each row
+            columns.append(clean_sort(self.request.query_params.get('sort')).lstrip('-'))
+            qs = qs.select_related(None).only('id', 'partner', 'status', *columns)
+        if self.action == 'retrieve' or 'audit_trail' in query_list(self.request, 'expand'):
+            qs = qs.prefetch_related('audit_trail')
         return qs
 
+    def get_serializer_class(self):
+        if self.action in ('list', 'brady_dashboard'):
+            return DealListSerializer
+        return DealSerializer
+
     def perform_update(self, serializer):
         # pass the user for audit logging
         instance = serializer.save()
         # note: signals will use instance._changed_by set in serializer.update
 
+    def _transition(self, request, deal, target):
+        try:
+            transition(deal, target, user=request.user)
+        except InvalidTransition as exc:
+            return Response({'detail': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        except TransitionConflict as exc:
+            return Response({'detail': str(exc)}, status=status.HTTP_409_CONFLICT)
+        return Response(self.get_serializer(deal).data)
+
     @action(detail=True, methods=['post'])
     def submit(self, request, pk=None):
         deal = self.get_object()
-        if request.user.role == 'PARTNER' and deal.partner != request.user.partner_organisation:
+        principal = get_principal(request)
+        if principal.is_partner and not principal.owns(deal):
             return Response({'detail': 'Forbidden'}, status=status.HTTP_403_FORBIDDEN)
         if deal.status not in ('DRAFT',):
             return Response({'detail': 'Can only submit from Draft state'}, status=status.HTTP_400_BAD_REQUEST)
-        deal.status = 'SUBMITTED'
-        deal._changed_by = request.user
-        deal.save()
-        serializer = self.get_serializer(deal)
-        return Response(serializer.data)
+        return self._transition(request, deal, 'SUBMITTED')
 
     @action(detail=True, methods=['post'])
     def approve(self, request, pk=None):
         # Brady users only
-        if request.user.role not in ('BRADY', 'ADMIN'):
+        if not get_principal(request).is_staff_role:
             return Response({'detail': 'Forbidden'}, status=status.HTTP_403_FORBIDDEN)
-        deal = self.get_object()
-        deal.status = 'APPROVED'
-        # determine expiry within configured bounds; default to min
-        days = getattr(settings, 'DEAL_MIN_EXPIRY_DAYS', 90)
-        deal.expiry_date = (deal.updated_at or deal.created_at).date() + timedelta(days=days)
-        deal._changed_by = request.user
-        deal.save()
-        return Response(self.get_serializer(deal).data)
+        return self._transition(request, self.get_object(), 'APPROVED')
 
     @action(detail=True, methods=['post'])
     def reject(self, request, pk=None):
-        if request.user.role not in ('BRADY', 'ADMIN'):
+        if not get_principal(request).is_staff_role:
             return Response({'detail': 'Forbidden'}, status=status.HTTP_403_FORBIDDEN)
+        return self._transition(request, self.get_object(), 'REJECTED')
+
+    @action(detail=True, methods=['get'])
+    def audit(self, request, pk=None):
+        # newest first; ?cursor= pages back, ?since= returns only entries after a timestamp
         deal = self.get_object()
-        deal.status = 'REJECTED'
-        deal._changed_by = request.user
-        deal.save()
-        return Response(self.get_serializer(deal).data)
+        qs = DealAudit.objects.filter(deal=deal).select_related('changed_by')
+        since = request.query_params.get('since')
+        if since:
+            since_dt = parse_datetime(since)
+            if since_dt is None:
+                return Response({'detail': 'since must be an ISO 8601 timestamp'}, status=status.HTTP_400_BAD_REQUEST)
+            if timezone.is_naive(since_dt):
+                since_dt = timezone.make_aware(since_dt)
+            qs = qs.filter(timestamp__gt=since_dt)
+        paginator = AuditKeysetPagination()
+        page = paginator.paginate_queryset(qs, request, view=self)
+        return paginator.get_paginated_response(AuditEntrySerializer(page, many=True).data)
+
+    @action(detail=True, methods=['get'])
+    def conflicts(self, request, pk=None):
+        # likely duplicate registrations of the same customer and product; reviewers only
+        if not get_principal(request).is_staff_role:
+            return Response({'detail': 'Forbidden'}, status=status.HTTP_403_FORBIDDEN)
+        deal = self.get_object()
+        matches = find_conflicts(deal)
+        return Response({
+            'id': deal.pk,
+            'customer_key': deal.customer_key,
+            'conflicts': [
+                {
+                    'id': other.pk,
+                    'partner': other.partner_id,
+                    'partner_name': other.partner.name,
+                    'same_partner': other.partner_id == deal.partner_id,
+                    'project_name': other.project_name,
+                    'end_customer_name': other.end_customer_name,
+                    'status': other.status,
+                    'estimated_value': str(other.estimated_value),
+                    'created_at': other.created_at,
+                    'similarity': score,
+                }
+                for other, score in matches
+            ],
+        })
+
+    @action(detail=False, methods=['post'])
+    def bulk_transition(self, request):
+        # {"ids": [...], "status": "APPROVED", "note": ""} -> one result per id
+        payload = BulkTransitionSerializer(data=request.data)
+        payload.is_valid(raise_exception=True)
+        target = payload.validated_data['status']
+        if target in REVIEW_STATUSES and not get_principal(request).is_staff_role:
+            return Response({'detail': 'Forbidden'}, status=status.HTTP_403_FORBIDDEN)
+        results = bulk_transition(
+            self.get_queryset(),
+            payload.validated_data['ids'],
+            target,
+            user=request.user,
+            note=payload.validated_data['note'],
+        )
+        body = [
+            {'id': deal_id, 'ok': ok, 'status': detail} if ok else {'id': deal_id, 'ok': ok, 'error': detail}
+            for deal_id, (ok, detail) in results.items()
+        ]
+        succeeded = sum(1 for ok, _ in results.values() if ok)
+        return Response({'succeeded': succeeded, 'failed': len(body) - succeeded, 'results': body})
 
     @action(detail=False, methods=['get'])
     def partner_dashboard(self, request):
         # lists own deals with status, value, expiry
-        if request.user.role != 'PARTNER':
+        if not get_principal(request).is_partner:
             return Response({'detail': 'Forbidden'}, status=status.HTTP_403_FORBIDDEN)
         qs = self.filter_queryset(self.get_queryset())
         data = qs.values('id', 'project_name', 'status', 'estimated_value', 'expiry_date')
@@ -78,22 +172,79 @@ class DealViewSet(viewsets.ModelViewSet):
 
     @action(detail=False, methods=['get'])
     def brady_dashboard(self, request):
-        if request.user.role not in ('BRADY', 'ADMIN'):
+        if not get_principal(request).is_staff_role:
             return Response({'detail': 'Forbidden'}, status=status.HTTP_403_FORBIDDEN)
         qs = self.filter_queryset(self.get_queryset())
-        # allow filters & sorting via query params
-        page = self.paginate_queryset(qs)
+        # filters via query params; ?sort=, ?cursor= and ?count= drive keyset paging
+        paginator = DealKeysetPagination()
+        page = paginator.paginate_queryset(qs, request, view=self)
         serializer = self.get_serializer(page, many=True)
-        return self.get_paginated_response(serializer.data)
+        return paginator.get_paginated_response(serializer.data)
 
-    @action(detail=False, methods=['get'])
-    def export_csv(self, request):
+    def _export_response(self, request, export_format):
+        # partners get only their deals by get_queryset; filters still apply
         qs = self.filter_queryset(self.get_queryset())
-        # check permissions: partners get only their deals by get_queryset
-        response = HttpResponse(content_type='text/csv')
-        response['Content-Disposition'] = 'attachment; filename="deals_export.csv"'
-        writer = csv.writer(response)
-        writer.writerow(['id', 'partner', 'project_name', 'end_customer_name', 'status', 'estimated_value', 'expiry_date'])
-        for d in qs:
-            writer.writerow([d.id, d.partner.name, d.project_name, d.end_customer_name, d.status, str(d.estimated_value), d.expiry_date])
+        encoder, content_type, extension = EXPORT_FORMATS[export_format]
+        response = StreamingHttpResponse(encoder(iter_rows(qs)), content_type=content_type)
+        response['Content-Disposition'] = f'attachment; filename="deals_export.{extension}"'
         return response
+
+    @action(detail=False, methods=['get'])
+    def overview(self, request):
+        # constant-time figures from the PartnerDealStats rollup
+        principal = get_principal(request)
+        if principal.is_partner:
+            partner_id = principal.partner_id
+            if partner_id is None:
+                return Response({'detail': 'Forbidden'}, status=status.HTTP_403_FORBIDDEN)
+        else:
+            partner_id = request.query_params.get('partner') or None
+            if partner_id is not None and not partner_id.isdigit():
+                return Response({'detail': 'partner must be an id'}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(deal_stats.overview(partner_id=partner_id, all_partners=partner_id is None))
+
+    @action(detail=False, methods=['get'])
+    def regions(self, request):
+        # deal count and value per region and status; partners see their own deals only
+        principal = get_principal(request)
+        if principal.is_partner:
+            if principal.partner_id is None:
+                return Response({'detail': 'Forbidden'}, status=status.HTTP_403_FORBIDDEN)
+            return Response(deal_regions.rollup(partner_id=principal.partner_id))
+        partner_id = request.query_params.get('partner') or None
+        if partner_id is not None and not partner_id.isdigit():
+            return Response({'detail': 'partner must be an id'}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(deal_regions.rollup(partner_id=partner_id))
+
+    def _pipeline_report(self, request, query_serializer, report):
+        query = query_serializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        kwargs = query.report_kwargs()
+        principal = get_principal(request)
+        if principal.is_partner:
+            if principal.partner_id is None:
+                return Response({'detail': 'Forbidden'}, status=status.HTTP_403_FORBIDDEN)
+            kwargs['partners'] = [principal.partner_id]
+        return Response(report(**kwargs))
+
+    @action(detail=False, methods=['get'])
+    def analytics(self, request):
+        # pipeline figures from the precomputed rollups; ?group_by=region,period&interval=quarter&status=...
+        return self._pipeline_report(request, AnalyticsQuerySerializer, deal_analytics.report)
+
+    @action(detail=False, methods=['get'])
+    def as_of(self, request):
+        # counts and values by status at a past moment, from the audit trail; ?at=2026-03-31&group_by=status,region
+        return self._pipeline_report(request, AsOfQuerySerializer, deal_history.report)
+
+    @action(detail=False, methods=['get'])
+    def export_csv(self, request):
+        return self._export_response(request, 'csv')
+
+    @action(detail=False, methods=['get'])
+    def export(self, request):
+        # ``format`` is reserved by DRF for renderer negotiation
+        export_format = request.query_params.get('export_format', 'csv')
+        if export_format not in EXPORT_FORMATS:
+            return Response({'detail': f'Unknown export format. Choose one of: {", ".join(EXPORT_FORMATS)}'}, status=status.HTTP_400_BAD_REQUEST)
+        return self._export_response(request, export_format)
@@ -3,77 +3,83 @@ from django.shortcuts import render, get_object_or_404, redirect
 from django.urls import reverse_lazy, reverse
 from django.views.generic import ListView, DetailView, CreateView, View, TemplateView
 from django.contrib import messages
-from .models import Deal
+from .models import Deal, DealAudit
 from .forms import DealForm
 from accounts.models import PartnerOrganisation
+from accounts.principal import get_principal
+from . import regions
+from . import stats as deal_stats
+from .pagination import SEARCH_RANK, SORT_OPTIONS, page_links, paginate_keyset
+from .search import search
+from .transitions import TRANSITION_FIELDS, InvalidTransition, TransitionConflict, transition
 
 
 class RoleRequiredMixin(UserPassesTestMixin):
     role = None
 
     def test_func(self):
-        return self.request.user.is_authenticated and (self.request.user.role == self.role or self.request.user.is_superuser)
+        principal = get_principal(self.request)
+        return principal is not None and principal.has_role(self.role)
+
+
+class KeysetPaginationMixin:
+    """Cursor-paginate a ListView's queryset by the allowed ``?sort=`` column."""
+    page_size = 20
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        page = paginate_keyset(
+            self.object_list,
+            sort=self.request.GET.get('sort'),
+            cursor=self.request.GET.get('cursor'),
+            page_size=self.page_size,
+            count='estimate',
+        )
+        context['object_list'] = context[self.context_object_name] = page.items
+        context['page'] = page
+        context['is_paginated'] = page.has_next or page.has_previous
+        context.update(page_links(self.request, page))
+        context['sort_by'] = page.sort
+        context['sort_options'] = SORT_OPTIONS
+        return context
 
 
 class PartnerDashboardOverviewView(LoginRequiredMixin, RoleRequiredMixin, TemplateView):
     template_name = 'deals/partner_overview.html'
     role = 'PARTNER'
 
+    def test_func(self):
+        # without an organisation there are no figures to show; same as the API
+        return super().test_func() and get_principal(self.request).partner_id is not None
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        partner = self.request.user.partner_organisation
-        # Use aggregate for efficient counting and summing
-        from django.db.models import Count, Sum, Q
-        deals_qs = Deal.objects.filter(partner=partner)
-        stats = deals_qs.aggregate(
-            total_deals=Count('id'),
-            draft_deals=Count('id', filter=Q(status='DRAFT')),
-            submitted_deals=Count('id', filter=Q(status='SUBMITTED')),
-            approved_deals=Count('id', filter=Q(status='APPROVED')),
-            rejected_deals=Count('id', filter=Q(status='REJECTED')),
-            total_value=Sum('estimated_value')
-        )
-        context.update(stats)
-        context['total_value'] = stats['total_value'] or 0
+        # read from the PartnerDealStats rollup instead of aggregating deals
+        context.update(deal_stats.overview(partner_id=get_principal(self.request).partner_id))
         return context
 
 
-class PartnerDashboardView(LoginRequiredMixin, RoleRequiredMixin, ListView):
+class PartnerDashboardView(LoginRequiredMixin, RoleRequiredMixin, KeysetPaginationMixin, ListView):
     template_name = 'deals/partner_dashboard.html'
     context_object_name = 'deals'
     model = Deal
     role = 'PARTNER'
-    paginate_by = 20
 
     def get_queryset(self):
-        qs = Deal.objects.filter(partner=self.request.user.partner_organisation).select_related('partner')
+        qs = Deal.objects.filter(partner_id=get_principal(self.request).partner_id).select_related('partner')
         
         # Filter by status
         status = self.request.GET.get('status')
         if status:
             qs = qs.filter(status=status)
         
-        # Sort
-        sort_by = self.request.GET.get('sort', '-updated_at')
-        qs = qs.order_by(sort_by)
-        
+        # sorting and paging are applied by KeysetPaginationMixin
         return qs
     
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context['status_filter'] = self.request.GET.get('status', '')
-        context['sort_by'] = self.request.GET.get('sort', '-updated_at')
         context['deal_statuses'] = Deal.STATUS_CHOICES
-        context['sort_options'] = [
-            ('-updated_at', 'Last Updated (Newest)'),
-            ('updated_at', 'Last Updated (Oldest)'),
-            ('-created_at', 'Created (Newest)'),
-            ('created_at', 'Created (Oldest)'),
-            ('-estimated_value', 'Value (High to Low)'),
-            ('estimated_value', 'Value (Low to High)'),
-            ('project_name', 'Project Name (A-Z)'),
-            ('-project_name', 'Project Name (Z-A)'),
-        ]
         return context
 
 
@@ -83,27 +89,17 @@ class BradyDashboardOverviewView(LoginRequiredMixin, RoleRequiredMixin, Template
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        # Use aggregate for efficient counting and summing
-        from django.db.models import Count, Sum, Q
-        stats = Deal.objects.aggregate(
-            total_deals=Count('id'),
-            draft_deals=Count('id', filter=Q(status='DRAFT')),
-            submitted_deals=Count('id', filter=Q(status='SUBMITTED')),
-            approved_deals=Count('id', filter=Q(status='APPROVED')),
-            rejected_deals=Count('id', filter=Q(status='REJECTED')),
-            total_value=Sum('estimated_value')
-        )
-        context.update(stats)
-        context['total_value'] = stats['total_value'] or 0
+        # read from the PartnerDealStats rollup instead of scanning every deal
+        context.update(deal_stats.overview(all_partners=True))
+        context['region_rollup'] = regions.rollup()
         return context
 
 
-class BradyDashboardView(LoginRequiredMixin, RoleRequiredMixin, ListView):
+class BradyDashboardView(LoginRequiredMixin, RoleRequiredMixin, KeysetPaginationMixin, ListView):
     template_name = 'deals/brady_dashboard.html'
     context_object_name = 'deals'
     model = Deal
     role = 'BRADY'
-    paginate_by = 20
 
     def get_queryset(self):
         qs = Deal.objects.select_related('partner', 'internal_owner')
@@ -117,31 +113,31 @@ class BradyDashboardView(LoginRequiredMixin, RoleRequiredMixin, ListView):
         partner = self.request.GET.get('partner')
         if partner:
             qs = qs.filter(partner__id=partner)
+
+        # a region path; parents include their sub-regions
+        region = self.request.GET.get('region')
+        if region:
+            qs = regions.filter_prefix(qs, region)
+
+        q = self.request.GET.get('q', '').strip()
+        if q:
+            qs = search(qs, q)
         
-        # Sort
-        sort_by = self.request.GET.get('sort', '-updated_at')
-        qs = qs.order_by(sort_by)
-        
+        # sorting and paging are applied by KeysetPaginationMixin
         return qs
     
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
+        context['search_query'] = self.request.GET.get('q', '').strip()
+        if context['search_query']:
+            context['sort_options'] = [(SEARCH_RANK, 'Best Match'), *context['sort_options']]
         # Only fetch active partners with minimal fields
         context['partners'] = PartnerOrganisation.objects.filter(status='ACTIVE').only('id', 'name').order_by('name')
         context['status_filter'] = self.request.GET.get('status', '')
         context['partner_filter'] = self.request.GET.get('partner', '')
-        context['sort_by'] = self.request.GET.get('sort', '-updated_at')
+        context['regions'] = regions.choices()
+        context['region_filter'] = self.request.GET.get('region', '')
         context['deal_statuses'] = Deal.STATUS_CHOICES
-        context['sort_options'] = [
-            ('-updated_at', 'Last Updated (Newest)'),
-            ('updated_at', 'Last Updated (Oldest)'),
-            ('-created_at', 'Created (Newest)'),
-            ('created_at', 'Created (Oldest)'),
-            ('-estimated_value', 'Value (High to Low)'),
-            ('estimated_value', 'Value (Low to High)'),
-            ('project_name', 'Project Name (A-Z)'),
-            ('-project_name', 'Project Name (Z-A)'),
-        ]
         return context
 
 
@@ -153,7 +149,7 @@ class DealCreateView(LoginRequiredMixin, RoleRequiredMixin, CreateView):
     def form_valid(self, form):
         deal = form.save(commit=False)
         # Assign to partner automatically
-        deal.partner = self.request.user.partner_organisation
+        deal.partner_id = get_principal(self.request).partner_id
         deal._changed_by = self.request.user
         deal.save()
         messages.success(self.request, 'Deal created in Draft status.')
@@ -164,103 +160,107 @@ class DealDetailView(LoginRequiredMixin, DetailView):
     template_name = 'deals/deal_detail.html'
     model = Deal
     context_object_name = 'deal'
+    timeline_page_size = 20
+
+    def get_queryset(self):
+        return Deal.objects.select_related('partner', 'internal_owner', 'region')
 
     def get(self, request, *args, **kwargs):
-        deal = self.get_object()
+        self.object = deal = self.get_object()
         # Permission checks: partners only view their deals
-        if request.user.role == 'PARTNER' and deal.partner != request.user.partner_organisation:
+        principal = get_principal(request)
+        if principal.is_partner and not principal.owns(deal):
             messages.error(request, 'Forbidden')
             return redirect('deals:my_deals')
-        return super().get(request, *args, **kwargs)
+        return self.render_to_response(self.get_context_data(object=deal))
 
+    def get_timeline(self):
+        """One page of the audit timeline; older pages are fetched on demand."""
+        qs = DealAudit.objects.filter(deal=self.object).select_related('changed_by')
+        page = paginate_keyset(qs, sort='-timestamp', cursor=self.request.GET.get('cursor'), page_size=self.timeline_page_size, sort_fields=('timestamp',))
+        older_url = None
+        if page.next_cursor:
+            older_url = reverse('deals:deal_timeline', args=[self.object.pk]) + '?cursor=' + page.next_cursor
+        return {'timeline': page.items, 'timeline_older_url': older_url}
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context.update(self.get_timeline())
+        return context
+
+
+class DealTimelineView(DealDetailView):
+    """HTML fragment with the next page of a deal's audit timeline."""
+    template_name = 'deals/_timeline.html'
+
+
+class DealTransitionView(LoginRequiredMixin, View):
+    """POST-only view that moves a deal to ``target`` through deals.transitions."""
+    target = None
+    roles = None
+    partner_must_own = True
+    success_message = ''
+    invalid_message = ''
 
-class SubmitDealView(LoginRequiredMixin, View):
     def post(self, request, pk):
-        deal = get_object_or_404(Deal, pk=pk)
-        if request.user.role != 'PARTNER' or deal.partner != request.user.partner_organisation:
+        user = request.user
+        principal = get_principal(request)
+        if self.roles is not None and principal.role not in self.roles:
             messages.error(request, 'Forbidden')
             return redirect('deals:deal_detail', pk=pk)
-        if deal.status != 'DRAFT':
-            messages.warning(request, 'Only Draft deals can be submitted.')
+        deal = get_object_or_404(Deal.objects.only(*TRANSITION_FIELDS), pk=pk)
+        # Partners can only act on their own deals
+        if self.partner_must_own and principal.is_partner and not principal.owns(deal):
+            messages.error(request, 'Forbidden')
             return redirect('deals:deal_detail', pk=pk)
-        deal.status = 'SUBMITTED'
-        deal._changed_by = request.user
-        deal.save()
-        messages.success(request, 'Deal submitted for review.')
+        try:
+            transition(deal, self.target, user=user)
+        except InvalidTransition:
+            messages.warning(request, self.invalid_message)
+        except TransitionConflict as exc:
+            messages.warning(request, str(exc))
+        else:
+            messages.success(request, self.success_message)
         return redirect('deals:deal_detail', pk=pk)
 
 
-class ApproveDealView(LoginRequiredMixin, View):
-    def post(self, request, pk):
-        if request.user.role not in ('BRADY', 'ADMIN'):
-            messages.error(request, 'Forbidden')
-            return redirect('deals:deal_detail', pk=pk)
-        deal = get_object_or_404(Deal, pk=pk)
-        deal.status = 'APPROVED'
-        # set expiry
-        from django.conf import settings
-        from datetime import timedelta
-        days = getattr(settings, 'DEAL_MIN_EXPIRY_DAYS', 90)
-        deal.expiry_date = (deal.updated_at or deal.created_at).date() + timedelta(days=days)
-        deal._changed_by = request.user
-        deal.save()
-        messages.success(request, 'Deal approved.')
-        return redirect('deals:deal_detail', pk=pk)
+class SubmitDealView(DealTransitionView):
+    target = 'SUBMITTED'
+    roles = ('PARTNER',)
+    success_message = 'Deal submitted for review.'
+    invalid_message = 'Only Draft deals can be submitted.'
 
 
-class RejectDealView(LoginRequiredMixin, View):
-    def post(self, request, pk):
-        if request.user.role not in ('BRADY', 'ADMIN'):
-            messages.error(request, 'Forbidden')
-            return redirect('deals:deal_detail', pk=pk)
-        deal = get_object_or_404(Deal, pk=pk)
-        deal.status = 'REJECTED'
-        deal._changed_by = request.user
-        deal.save()
-        messages.success(request, 'Deal rejected.')
-        return redirect('deals:deal_detail', pk=pk)
+class ApproveDealView(DealTransitionView):
+    target = 'APPROVED'
+    roles = ('BRADY', 'ADMIN')
+    success_message = 'Deal approved.'
+    invalid_message = 'Only Submitted deals can be approved.'
 
 
-class CloseDealWonView(LoginRequiredMixin, View):
-    def post(self, request, pk):
-        deal = get_object_or_404(Deal, pk=pk)
-        # Partners can only close their own deals
-        if request.user.role == 'PARTNER' and deal.partner != request.user.partner_organisation:
-            messages.error(request, 'Forbidden')
-            return redirect('deals:deal_detail', pk=pk)
-        # Only approved deals can be closed won
-        if deal.status != 'APPROVED':
-            messages.warning(request, 'Only Approved deals can be closed won.')
-            return redirect('deals:deal_detail', pk=pk)
-        deal.status = 'CLOSED_WON'
-        deal._changed_by = request.user
-        deal.save()
-        messages.success(request, 'Deal marked as Closed Won.')
-        return redirect('deals:deal_detail', pk=pk)
+class RejectDealView(DealTransitionView):
+    target = 'REJECTED'
+    roles = ('BRADY', 'ADMIN')
+    success_message = 'Deal rejected.'
+    invalid_message = 'Only Submitted deals can be rejected.'
 
 
-class CloseDealLostView(LoginRequiredMixin, View):
-    def post(self, request, pk):
-        deal = get_object_or_404(Deal, pk=pk)
-        # Partners can only close their own deals
-        if request.user.role == 'PARTNER' and deal.partner != request.user.partner_organisation:
-            messages.error(request, 'Forbidden')
-            return redirect('deals:deal_detail', pk=pk)
-        # Only approved deals can be closed lost
-        if deal.status != 'APPROVED':
-            messages.warning(request, 'Only Approved deals can be closed lost.')
-            return redirect('deals:deal_detail', pk=pk)
-        deal.status = 'CLOSED_LOST'
-        deal._changed_by = request.user
-        deal.save()
-        messages.success(request, 'Deal marked as Closed Lost.')
-        return redirect('deals:deal_detail', pk=pk)
+class CloseDealWonView(DealTransitionView):
+    target = 'CLOSED_WON'
+    success_message = 'Deal marked as Closed Won.'
+    invalid_message = 'Only Approved deals can be closed won.'
+
+
+class CloseDealLostView(DealTransitionView):
+    target = 'CLOSED_LOST'
+    success_message = 'Deal marked as Closed Lost.'
+    invalid_message = 'Only Approved deals can be closed lost.'
 
 
 def my_deals_redirect(request):
     if not request.user.is_authenticated:
         return redirect('%s?next=%s' % (reverse_lazy('login'), request.path))
-    if request.user.role == 'PARTNER':
+    if get_principal(request).is_partner:
         return redirect('deals:partner_deals')
     return redirect('deals:brady_deals')
 
@@ -268,6 +268,6 @@ def my_deals_redirect(request):
 def dashboard_redirect(request):
     if not request.user.is_authenticated:
         return redirect('%s?next=%s' % (reverse_lazy('login'), request.path))
-    if request.user.role == 'PARTNER':
+    if get_principal(request).is_partner:
         return redirect('deals:partner_overview')
     return redirect('deals:brady_overview')
@@ -0,0 +1,209 @@
+import io
+import json
+import platform
+import statistics
+import time
+import tracemalloc
+
+import django
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, setup_test_environment, teardown_test_environment
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from accounts.synthetic import Generator
+from deals.models import Deal
+from notifications import cache as bell_cache
+
+# report fields compared against a baseline; any increase in query count fails
+TIMINGS = ('p50_ms', 'p90_ms')
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+class Command(BaseCommand):
+    help = 'Benchmark the hot portal paths against a throwaway seeded database and write a JSON report'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--partners', type=int, default=20)
+        parser.add_argument('--deals', type=int, default=2000)
+        parser.add_argument('--iterations', type=int, default=20)
+        parser.add_argument('--warmup', type=int, default=3)
+        parser.add_argument('--seed', type=int, default=42, help='Random seed, so runs are comparable')
+        parser.add_argument('--only', default='', help='Comma separated scenario names to run')
+        parser.add_argument('--output', default='bench_report.json')
+        parser.add_argument('--baseline', help='Earlier report to compare against')
+        parser.add_argument('--threshold', type=float, default=20.0, help='Allowed regression in percent')
+        parser.add_argument('--min-delta-ms', type=float, default=2.0, help='Ignore latency changes smaller than this')
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        # a throwaway database; the configured one is never touched
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            self.seed(options['partners'], options['deals'], options['seed'])
+            report = self.run(options)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        with open(options['output'], 'w') as fp:
+            json.dump(report, fp, indent=2)
+        for name, result in report['scenarios'].items():
+            self.stdout.write(
+                f"{name:24s} p50 {result['p50_ms']:8.2f}ms  p90 {result['p90_ms']:8.2f}ms  "
+                f"p99 {result['p99_ms']:8.2f}ms  queries {result['queries']:4d}  peak {result['peak_kib']:9.1f}KiB"
+            )
+        self.stdout.write(self.style.SUCCESS(f"Report written to {options['output']}"))
+
+        if options['baseline']:
+            with open(options['baseline']) as fp:
+                baseline = json.load(fp)
+            failures = self.compare(report, baseline, options['threshold'], options['min_delta_ms'])
+            if failures:
+                raise CommandError('Regressions against baseline:\n  ' + '\n  '.join(failures))
+            self.stdout.write(self.style.SUCCESS('No regressions against baseline'))
+
+    def seed(self, partner_count, deal_count, seed=0):
+        Generator(
+            partners=partner_count, users_per_partner=1, brady_users=1, deals=deal_count,
+            audit_depth=3, notifications=deal_count, seed=seed, prefix='bench', password='bench',
+        ).run()
+        get_user_model().objects.create_user('bench-admin', password='bench', role='ADMIN', is_staff=True)
+
+    def scenarios(self):
+        User = get_user_model()
+        brady = User.objects.get(username='bench-brady-0')
+        partner_user = User.objects.filter(role='PARTNER').order_by('pk').first()
+        deal = Deal.objects.filter(partner_id=partner_user.partner_organisation_id).order_by('pk').first()
+        submitted = Deal.objects.filter(status='SUBMITTED').order_by('pk').first()
+
+        api = APIClient()
+        api.force_authenticate(brady)
+        brady_web = Client()
+        brady_web.force_login(brady)
+        partner_web = Client()
+        partner_web.force_login(partner_user)
+
+        def get(client, url):
+            return lambda: client.get(url)
+
+        def export():
+            response = api.get('/api/deals/export_csv/')
+            b''.join(response.streaming_content)
+
+        def approve():
+            api.post(f'/api/deals/{submitted.pk}/approve/')
+
+        def bell():
+            # cold bell: outside a transaction the invalidation applies at once
+            bell_cache.invalidate_users([brady.pk])
+            bell_cache.get_bell(brady)
+
+        def expiry():
+            call_command('check_deal_expiry', stdout=io.StringIO())
+
+        # name -> (callable, whether it writes and must be rolled back)
+        return {
+            'api_list': (get(api, '/api/deals/'), False),
+            'api_detail': (get(api, f'/api/deals/{deal.pk}/'), False),
+            'api_brady_dashboard': (get(api, '/api/deals/brady_dashboard/'), False),
+            'api_overview': (get(api, '/api/deals/overview/'), False),
+            'web_partner_dashboard': (get(partner_web, reverse('deals:partner_deals')), False),
+            'web_brady_dashboard': (get(brady_web, reverse('deals:brady_deals')), False),
+            'web_partner_overview': (get(partner_web, reverse('deals:partner_overview')), False),
+            'web_brady_overview': (get(brady_web, reverse('deals:brady_overview')), False),
+            'web_deal_detail': (get(partner_web, reverse('deals:deal_detail', args=[deal.pk])), False),
+            'export_csv': (export, False),
+            'notification_bell': (bell, False),
+            'transition_approve': (approve, True),
+            'check_deal_expiry': (expiry, True),
+        }
+
+    def measure(self, func, writes, iterations, warmup):
+        """Time ``func``; writing scenarios are rolled back so every iteration sees the same data."""
+        def once():
+            if not writes:
+                return func()
+            with transaction.atomic():
+                func()
+                transaction.set_rollback(True)
+
+        for _ in range(warmup):
+            once()
+        timings = []
+        queries = 0
+        for _ in range(iterations):
+            with CaptureQueriesContext(connection) as ctx:
+                start = time.perf_counter()
+                once()
+                timings.append((time.perf_counter() - start) * 1000)
+            queries = max(queries, len([q for q in ctx.captured_queries if 'SAVEPOINT' not in q['sql']]))
+        # memory is measured in a separate pass; tracemalloc would distort the timings
+        tracemalloc.start()
+        once()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        return {
+            'p50_ms': round(percentile(timings, 50), 3),
+            'p90_ms': round(percentile(timings, 90), 3),
+            'p99_ms': round(percentile(timings, 99), 3),
+            'max_ms': round(max(timings), 3),
+            'mean_ms': round(statistics.mean(timings), 3),
+            'queries': queries,
+            'peak_kib': round(peak / 1024, 1),
+        }
+
+    def run(self, options):
+        scenarios = self.scenarios()
+        only = {name.strip() for name in options['only'].split(',') if name.strip()}
+        unknown = only - set(scenarios)
+        if unknown:
+            raise CommandError(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+        results = {}
+        for name, (func, writes) in scenarios.items():
+            if only and name not in only:
+                continue
+            results[name] = self.measure(func, writes, options['iterations'], options['warmup'])
+        return {
+            'meta': {
+                'created_at': timezone.now().isoformat(),
+                'partners': options['partners'],
+                'deals': options['deals'],
+                'iterations': options['iterations'],
+                'seed': options['seed'],
+                'database': connection.vendor,
+                'python': platform.python_version(),
+                'django': django.get_version(),
+            },
+            'scenarios': results,
+        }
+
+    def compare(self, report, baseline, threshold, min_delta_ms):
+        failures = []
+        for name, result in report['scenarios'].items():
+            before = baseline.get('scenarios', {}).get(name)
+            if before is None:
+                continue
+            if result['queries'] > before.get('queries', result['queries']):
+                failures.append(f"{name}: queries {before['queries']} -> {result['queries']}")
+            for metric in TIMINGS + ('peak_kib',):
+                old, new = before.get(metric), result[metric]
+                if not old or new <= old:
+                    continue
+                if metric in TIMINGS and new - old < min_delta_ms:
+                    # too small to tell from noise
+                    continue
+                growth = (new - old) / old * 100
+                if growth > threshold:
+                    failures.append(f'{name}: {metric} {old} -> {new} (+{growth:.0f}%)')
+        return failures
@@ -0,0 +1,283 @@
+"""Process-safe metrics registry served as Prometheus text from ``/metrics``.
+
+Each process keeps its counters and histograms in memory. When
+``METRICS_DIR`` is set, it also writes a snapshot to its own file there at
+most every ``METRICS_FLUSH_SECONDS`` and when it exits. The endpoint adds up
+every process's file, so any WSGI worker can answer a scrape. Without
+``METRICS_DIR`` only the answering process is reported.
+
+Files are named after the host and pid that wrote them. A scrape folds the
+files of this host's exited processes into ``exited.json`` and deletes them,
+so worker restarts do not leave a growing pile behind.
+"""
+import atexit
+import fcntl
+import json
+import os
+import socket
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+SIZE_BUCKETS = (0, 1, 2, 5, 10, 25, 50, 100, 250)
+EXITED = 'exited.json'
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._meta = {}
+        self._counters = defaultdict(float)
+        self._histograms = {}
+        self._last_flush = time.monotonic()
+        self._pid = None
+        self._name = None
+
+    def counter(self, name, help_text, labels=()):
+        self._meta[name] = ('counter', help_text, tuple(labels), None)
+        return Counter(self, name)
+
+    def histogram(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        self._meta[name] = ('histogram', help_text, tuple(labels), tuple(buckets))
+        return Histogram(self, name)
+
+    def _key(self, name, labels):
+        return name, tuple(str(labels.get(label, '')) for label in self._meta[name][2])
+
+    def inc(self, name, amount, labels):
+        key = self._key(name, labels)
+        with self._lock:
+            self._counters[key] += amount
+        self.maybe_flush()
+
+    def observe(self, name, value, labels):
+        key = self._key(name, labels)
+        buckets = self._meta[name][3]
+        with self._lock:
+            state = self._histograms.get(key)
+            if state is None:
+                state = self._histograms[key] = [[0] * len(buckets), 0.0, 0]
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    state[0][i] += 1
+                    break
+            state[1] += value
+            state[2] += 1
+        self.maybe_flush()
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'counters': [[name, list(labels), value] for (name, labels), value in self._counters.items()],
+                'histograms': [[name, list(labels), list(state[0]), state[1], state[2]] for (name, labels), state in self._histograms.items()],
+            }
+
+    @property
+    def _filename(self):
+        # recomputed after a fork; the start time keeps files apart when a pid is reused
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._name = f'{socket.gethostname()}-{self._pid}-{time.time_ns()}.json'
+        return self._name
+
+    def _directory(self):
+        return getattr(settings, 'METRICS_DIR', '') or None
+
+    def maybe_flush(self):
+        if time.monotonic() - self._last_flush >= getattr(settings, 'METRICS_FLUSH_SECONDS', 5):
+            self.flush()
+
+    def flush(self):
+        """Write this process's snapshot to METRICS_DIR, if configured."""
+        self._last_flush = time.monotonic()
+        directory = self._directory()
+        if not directory:
+            return
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, self._filename)
+        tmp = f'{path}.{threading.get_ident()}.tmp'
+        with open(tmp, 'w') as fp:
+            json.dump(self.snapshot(), fp)
+        os.replace(tmp, path)
+
+    def _exited(self, directory):
+        # only this host's pids can be checked; other hosts prune their own
+        prefix = f'{socket.gethostname()}-'
+        for filename in os.listdir(directory):
+            if not filename.startswith(prefix) or not filename.endswith('.json'):
+                continue
+            pid = filename[len(prefix):].split('-')[0]
+            if pid.isdigit() and not _alive(int(pid)):
+                yield filename
+
+    def prune(self):
+        """Fold the snapshots of exited processes into EXITED and delete them; returns how many went."""
+        directory = self._directory()
+        if not directory or not os.path.isdir(directory) or not any(self._exited(directory)):
+            return 0
+        with open(os.path.join(directory, '.lock'), 'w') as lock:
+            # concurrent scrapes must not fold the same file twice
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            exited = list(self._exited(directory))
+            if not exited:
+                return 0
+            counters, histograms = _merge(_read(os.path.join(directory, name)) for name in [EXITED, *exited])
+            path = os.path.join(directory, EXITED)
+            tmp = f'{path}.{os.getpid()}.tmp'
+            with open(tmp, 'w') as fp:
+                json.dump({
+                    'counters': [[name, list(labels), value] for (name, labels), value in counters.items()],
+                    'histograms': [[name, list(labels), *state] for (name, labels), state in histograms.items()],
+                }, fp)
+            os.replace(tmp, path)
+            for name in exited:
+                os.remove(os.path.join(directory, name))
+        return len(exited)
+
+    def collect(self):
+        """Merge every process's snapshot; this process contributes live values."""
+        snapshots = [self.snapshot()]
+        directory = self._directory()
+        if directory and os.path.isdir(directory):
+            self.prune()
+            for filename in os.listdir(directory):
+                if filename.endswith('.json') and filename != self._filename:
+                    snapshots.append(_read(os.path.join(directory, filename)))
+        return _merge(snapshots)
+
+    def render(self):
+        """Return every metric in the Prometheus text exposition format."""
+        counters, histograms = self.collect()
+        lines = []
+        for name, (kind, help_text, label_names, buckets) in sorted(self._meta.items()):
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            if kind == 'counter':
+                for (metric, labels), value in sorted(counters.items()):
+                    if metric == name:
+                        lines.append(f'{name}{_labels(label_names, labels)} {_number(value)}')
+                continue
+            for (metric, labels), (counts, total, count) in sorted(histograms.items()):
+                if metric != name:
+                    continue
+                cumulative = 0
+                for bound, bucket in zip(buckets, counts):
+                    cumulative += bucket
+                    lines.append(f'{name}_bucket{_labels(label_names, labels, le=_number(bound))} {cumulative}')
+                lines.append(f'{name}_bucket{_labels(label_names, labels, le="+Inf")} {count}')
+                lines.append(f'{name}_sum{_labels(label_names, labels)} {_number(total)}')
+                lines.append(f'{name}_count{_labels(label_names, labels)} {count}')
+        return '\n'.join(lines) + '\n'
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+
+class Counter:
+    def __init__(self, registry, name):
+        self.registry = registry
+        self.name = name
+
+    def inc(self, amount=1, **labels):
+        self.registry.inc(self.name, amount, labels)
+
+
+class Histogram:
+    def __init__(self, registry, name):
+        self.registry = registry
+        self.name = name
+
+    def observe(self, value, **labels):
+        self.registry.observe(self.name, value, labels)
+
+    def time(self, **labels):
+        return _Timer(self, labels)
+
+
+class _Timer:
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.started, **self.labels)
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _read(path):
+    # a file that vanished or was half written counts as empty
+    try:
+        with open(path) as fp:
+            return json.load(fp)
+    except (OSError, ValueError):
+        return {'counters': [], 'histograms': []}
+
+
+def _merge(snapshots):
+    counters = defaultdict(float)
+    histograms = {}
+    for snap in snapshots:
+        for name, labels, value in snap['counters']:
+            counters[name, tuple(labels)] += value
+        for name, labels, buckets, total, count in snap['histograms']:
+            state = histograms.setdefault((name, tuple(labels)), [[0] * len(buckets), 0.0, 0])
+            state[0] = [a + b for a, b in zip(state[0], buckets)]
+            state[1] += total
+            state[2] += count
+    return counters, histograms
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, **extra):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    pairs += [f'{n}="{v}"' for n, v in extra.items()]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _number(value):
+    return repr(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+registry = Registry()
+atexit.register(registry.flush)
+
+REQUEST_LATENCY = registry.histogram(
+    'portal_request_duration_seconds', 'Request latency by URL name.', labels=('view', 'method')
+)
+REQUEST_QUERIES = registry.histogram(
+    'portal_request_queries', 'Database queries per request by URL name.', labels=('view',), buckets=QUERY_BUCKETS
+)
+DEAL_TRANSITIONS = registry.counter(
+    'portal_deal_transitions_total', 'Deal status changes.', labels=('from_status', 'to_status')
+)
+NOTIFICATION_FANOUT = registry.histogram(
+    'portal_notification_fanout_recipients', 'Recipients per delivered outbox event.', buckets=SIZE_BUCKETS
+)
+EMAIL_SEND = registry.histogram(
+    'portal_email_send_seconds', 'Time spent handing a batch of emails to the mail backend.', labels=('source',)
+)
+EXPIRY_SWEEP = registry.counter(
+    'portal_expiry_sweep_total', 'check_deal_expiry results: runs, expired and alerted deals, digests sent and failed.', labels=('result',)
+)
@@ -0,0 +1,133 @@
+"""Per-request SQL and timing instrumentation.
+
+``RequestMetricsMiddleware`` counts queries and SQL time through a database
+execute wrapper, times the view and any TemplateResponse rendering, and
+reports the figures as a ``Server-Timing`` header. Requests over the
+configured thresholds are logged to ``monitoring.requests`` as one JSON line,
+including the most repeated query shapes (the usual sign of an N+1).
+
+Cost per query is one wrapper call and a dict increment; shapes are only
+normalised when a slow request is logged.
+"""
+import json
+import logging
+import re
+import time
+from collections import Counter
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+
+from .metrics import REQUEST_LATENCY, REQUEST_QUERIES
+
+logger = logging.getLogger('monitoring.requests')
+
+_IN_LIST = re.compile(r'IN \((?:%s, )*%s\)')
+_LIMIT = re.compile(r'\bLIMIT \d+(?: OFFSET \d+)?')
+
+
+def query_shape(sql):
+    """Collapse ``IN (%s, %s, ...)`` lists and LIMIT/OFFSET literals so batches and pages of any size share a shape."""
+    return _LIMIT.sub('LIMIT ?', _IN_LIST.sub('IN (...)', sql))
+
+
+class RequestMetrics:
+    """Figures collected for one request; available as ``request.metrics``."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.sql_time = 0.0
+        self.statements = Counter()
+        self.view_time = None
+        self.template_time = None
+        self.total_time = None
+        self._view_started = None
+        self._render_started = None
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.sql_time += time.perf_counter() - start
+            self.queries += 1
+            self.statements[sql] += 1
+
+    def repeated_queries(self, threshold=2, limit=5):
+        shapes = Counter()
+        for sql, count in self.statements.items():
+            shapes[query_shape(sql)] += count
+        return [(shape, count) for shape, count in shapes.most_common(limit) if count >= threshold]
+
+    def server_timing(self):
+        parts = [f'db;dur={self.sql_time * 1000:.1f};desc="{self.queries} queries"']
+        if self.view_time is not None:
+            parts.append(f'view;dur={self.view_time * 1000:.1f}')
+        if self.template_time is not None:
+            parts.append(f'tpl;dur={self.template_time * 1000:.1f}')
+        parts.append(f'total;dur={self.total_time * 1000:.1f}')
+        return ', '.join(parts)
+
+
+class RequestMetricsMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.header = getattr(settings, 'SERVER_TIMING_HEADER', True)
+        self.slow_ms = getattr(settings, 'SLOW_REQUEST_MS', 500)
+        self.slow_queries = getattr(settings, 'SLOW_REQUEST_QUERIES', 50)
+        self.repeat_threshold = getattr(settings, 'REPEATED_QUERY_THRESHOLD', 5)
+
+    def __call__(self, request):
+        metrics = request.metrics = RequestMetrics()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(metrics))
+            response = self.get_response(request)
+        metrics.total_time = time.perf_counter() - metrics.started
+        if metrics.view_time is None and metrics._view_started is not None:
+            metrics.view_time = metrics.total_time - (metrics._view_started - metrics.started)
+        match = getattr(request, 'resolver_match', None)
+        view = match.view_name if match else 'unresolved'
+        REQUEST_LATENCY.observe(metrics.total_time, view=view, method=request.method)
+        REQUEST_QUERIES.observe(metrics.queries, view=view)
+        if self.header:
+            response['Server-Timing'] = metrics.server_timing()
+        if metrics.total_time * 1000 >= self.slow_ms or metrics.queries >= self.slow_queries:
+            self.log_slow(request, response, metrics)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request.metrics._view_started = time.perf_counter()
+
+    def process_template_response(self, request, response):
+        metrics = request.metrics
+        now = time.perf_counter()
+        metrics.view_time = now - metrics._view_started
+        metrics._render_started = now
+
+        def rendered(response):
+            metrics.template_time = time.perf_counter() - metrics._render_started
+
+        response.add_post_render_callback(rendered)
+        return response
+
+    def log_slow(self, request, response, metrics):
+        match = getattr(request, 'resolver_match', None)
+        record = {
+            'method': request.method,
+            'path': request.path,
+            'view': match.view_name if match else None,
+            'status': response.status_code,
+            'total_ms': round(metrics.total_time * 1000, 1),
+            'view_ms': None if metrics.view_time is None else round(metrics.view_time * 1000, 1),
+            'template_ms': None if metrics.template_time is None else round(metrics.template_time * 1000, 1),
+            'sql_ms': round(metrics.sql_time * 1000, 1),
+            'queries': metrics.queries,
+            'repeated': [
+                {'sql': shape[:300], 'count': count}
+                for shape, count in metrics.repeated_queries(self.repeat_threshold)
+            ],
+        }
+        logger.warning(json.dumps(record))
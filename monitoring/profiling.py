@@ -0,0 +1,206 @@
+"""On-demand profiling of single requests for ADMIN users.
+
+An admin adds ``?_profile=1`` (deterministic, cProfile) or ``?_profile=sample``
+(stack sampling) to a URL, or sends the same value in an ``X-Profile``
+header. The request runs under the profiler with tracemalloc and a SQL log,
+and the result is written to ``PROFILE_DIR`` for the pages under
+``/monitoring/profiles/``. Requests without the flag only pay for the flag
+lookup.
+
+tracemalloc is process-wide, so only one profiled request at a time records
+allocations; a concurrent one, or any request while something else is
+tracing, is profiled without them.
+"""
+import cProfile
+import io
+import json
+import os
+import pstats
+import re
+import secrets
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+
+from django.conf import settings
+from django.db import connections
+
+from accounts.principal import get_principal
+
+PROFILE_ID = re.compile(r'^[0-9]{8}-[0-9]{6}-[0-9a-f]{6}$')
+MODES = {'1': 'cprofile', 'cprofile': 'cprofile', 'sample': 'sample'}
+_tracing = threading.Lock()
+
+
+def profile_dir():
+    return str(getattr(settings, 'PROFILE_DIR', os.path.join(settings.BASE_DIR, 'profiles')))
+
+
+class StackSampler:
+    """Record the profiled thread's stack every ``interval`` seconds."""
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.stacks = Counter()
+        self._thread_id = threading.get_ident()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self._thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})')
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def report(self, limit=40):
+        leaves = Counter()
+        for stack, count in self.stacks.items():
+            leaves[stack.rsplit(';', 1)[-1]] += count
+        total = sum(self.stacks.values()) or 1
+        lines = [f'{count:6d} {count * 100 / total:5.1f}%  {leaf}' for leaf, count in leaves.most_common(limit)]
+        return f'{sum(self.stacks.values())} samples every {self.interval * 1000:.0f}ms; hottest frames:\n' + '\n'.join(lines)
+
+
+class SQLLog:
+    def __init__(self):
+        self.entries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.entries.append({'sql': sql, 'ms': round((time.perf_counter() - start) * 1000, 3), 'many': many})
+
+
+def _memory_summary(snapshot, limit=15):
+    stats = snapshot.statistics('lineno')
+    return [{'where': str(stat.traceback), 'kib': round(stat.size / 1024, 1), 'count': stat.count} for stat in stats[:limit]]
+
+
+def list_profiles():
+    directory = profile_dir()
+    if not os.path.isdir(directory):
+        return []
+    profiles = []
+    for filename in sorted(os.listdir(directory), reverse=True):
+        if filename.endswith('.json'):
+            with open(os.path.join(directory, filename)) as fp:
+                profiles.append(json.load(fp))
+    return profiles
+
+
+def load_profile(profile_id):
+    if not PROFILE_ID.match(profile_id):
+        return None
+    path = os.path.join(profile_dir(), f'{profile_id}.json')
+    if not os.path.exists(path):
+        return None
+    with open(path) as fp:
+        return json.load(fp)
+
+
+def _prune(directory, keep):
+    profiles = sorted(f for f in os.listdir(directory) if f.endswith('.json'))
+    for filename in profiles[:-keep] if keep else []:
+        stem = filename[:-len('.json')]
+        for suffix in ('.json', '.prof'):
+            try:
+                os.remove(os.path.join(directory, stem + suffix))
+            except FileNotFoundError:
+                pass
+
+
+class ProfilingMiddleware:
+    """Profile a request when an ADMIN asks for it; place after AuthenticationMiddleware."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        flag = request.GET.get('_profile') or request.headers.get('X-Profile')
+        if not flag or flag not in MODES or not getattr(settings, 'PROFILING_ENABLED', True):
+            return self.get_response(request)
+        principal = get_principal(request)
+        if principal is None or not principal.is_admin:
+            return self.get_response(request)
+        return self.profile(request, MODES[flag])
+
+    def profile(self, request, mode):
+        profile_id = f'{time.strftime("%Y%m%d-%H%M%S")}-{secrets.token_hex(3)}'
+        directory = profile_dir()
+        os.makedirs(directory, exist_ok=True)
+        sql = SQLLog()
+        profiler = cProfile.Profile() if mode == 'cprofile' else StackSampler()
+
+        trace_memory = _tracing.acquire(blocking=False)
+        if trace_memory and tracemalloc.is_tracing():
+            # started by someone else, who will also stop it
+            _tracing.release()
+            trace_memory = False
+        peak, memory = None, []
+        try:
+            if trace_memory:
+                tracemalloc.start()
+            started = time.perf_counter()
+            with connections['default'].execute_wrapper(sql):
+                if mode == 'cprofile':
+                    profiler.enable()
+                else:
+                    profiler.start()
+                try:
+                    response = self.get_response(request)
+                finally:
+                    if mode == 'cprofile':
+                        profiler.disable()
+                    else:
+                        profiler.stop()
+            duration = time.perf_counter() - started
+            if trace_memory:
+                _, peak = tracemalloc.get_traced_memory()
+                memory = _memory_summary(tracemalloc.take_snapshot())
+        finally:
+            if trace_memory:
+                tracemalloc.stop()
+                _tracing.release()
+
+        if mode == 'cprofile':
+            profiler.dump_stats(os.path.join(directory, f'{profile_id}.prof'))
+            out = io.StringIO()
+            pstats.Stats(profiler, stream=out).sort_stats('cumulative').print_stats(40)
+            report = out.getvalue()
+        else:
+            report = profiler.report()
+        record = {
+            'id': profile_id,
+            'mode': mode,
+            'method': request.method,
+            'path': request.get_full_path(),
+            'user': request.user.get_username(),
+            'status': response.status_code,
+            'created_at': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'duration_ms': round(duration * 1000, 1),
+            'peak_memory_kib': None if peak is None else round(peak / 1024, 1),
+            'report': report,
+            'sql': sql.entries,
+            'memory': memory,
+        }
+        with open(os.path.join(directory, f'{profile_id}.json'), 'w') as fp:
+            json.dump(record, fp)
+        _prune(directory, getattr(settings, 'PROFILE_KEEP', 50))
+        response['X-Profile-Id'] = profile_id
+        return response
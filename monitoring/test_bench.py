@@ -0,0 +1,24 @@
+from django.test import SimpleTestCase
+
+from monitoring.management.commands.bench import Command, percentile
+
+
+class BenchCompareTests(SimpleTestCase):
+    def report(self, **values):
+        result = {'p50_ms': 10.0, 'p90_ms': 20.0, 'p99_ms': 30.0, 'queries': 3, 'peak_kib': 100.0}
+        result.update(values)
+        return {'scenarios': {'api_list': result}}
+
+    def test_percentile(self):
+        self.assertEqual(percentile(range(1, 101), 50), 51)
+        self.assertEqual(percentile([5], 99), 5)
+
+    def test_regressions_past_threshold_fail(self):
+        compare = Command().compare
+        baseline = self.report()
+        self.assertEqual(compare(self.report(p50_ms=11.0), baseline, 20, 2), [])
+        # large relative change but within the noise floor
+        self.assertEqual(compare(self.report(p50_ms=2.5), self.report(p50_ms=1.0), 20, 2), [])
+        failures = compare(self.report(p90_ms=30.0, queries=4), baseline, 20, 2)
+        self.assertEqual(len(failures), 2)
+        self.assertIn('queries 3 -> 4', failures[0])
@@ -0,0 +1,97 @@
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+from rest_framework.test import APIClient
+
+from accounts.models import PartnerOrganisation
+from deals.models import Deal
+from monitoring.metrics import Registry, registry
+
+User = get_user_model()
+
+
+class RegistryTests(TestCase):
+    def test_render_counters_and_histograms(self):
+        reg = Registry()
+        hits = reg.counter('hits_total', 'Hits.', labels=('kind',))
+        latency = reg.histogram('latency_seconds', 'Latency.', buckets=(0.1, 1.0))
+        hits.inc(kind='a')
+        hits.inc(2, kind='a')
+        latency.observe(0.05)
+        latency.observe(0.5)
+        latency.observe(5)
+        text = reg.render()
+        self.assertIn('# TYPE hits_total counter', text)
+        self.assertIn('hits_total{kind="a"} 3', text)
+        self.assertIn('latency_seconds_bucket{le="0.1"} 1', text)
+        self.assertIn('latency_seconds_bucket{le="1"} 2', text)
+        self.assertIn('latency_seconds_bucket{le="+Inf"} 3', text)
+        self.assertIn('latency_seconds_count 3', text)
+
+    def test_merges_other_process_snapshots(self):
+        with tempfile.TemporaryDirectory() as directory, override_settings(METRICS_DIR=directory):
+            reg = Registry()
+            hits = reg.counter('hits_total', 'Hits.', labels=('kind',))
+            hits.inc(kind='a')
+            reg.flush()
+            self.assertEqual(len(os.listdir(directory)), 1)
+            # another worker's snapshot
+            with open(os.path.join(directory, '99999-1.json'), 'w') as fp:
+                json.dump({'counters': [['hits_total', ['a'], 4]], 'histograms': []}, fp)
+            self.assertIn('hits_total{kind="a"} 5', reg.render())
+
+    def test_exited_process_files_are_folded_into_one(self):
+        with tempfile.TemporaryDirectory() as directory, override_settings(METRICS_DIR=directory):
+            reg = Registry()
+            hits = reg.counter('hits_total', 'Hits.', labels=('kind',))
+            hits.inc(kind='a')
+            reg.flush()
+            child = subprocess.Popen([sys.executable, '-c', 'pass'])
+            child.wait()
+            host = socket.gethostname()
+            for name, value in ((f'{host}-{child.pid}-1.json', 4), (f'{host}-{child.pid}-2.json', 2), (f'{host}-{os.getppid()}-3.json', 8)):
+                with open(os.path.join(directory, name), 'w') as fp:
+                    json.dump({'counters': [['hits_total', ['a'], value]], 'histograms': []}, fp)
+            self.assertIn('hits_total{kind="a"} 15', reg.render())
+            files = sorted(f for f in os.listdir(directory) if f.endswith('.json'))
+            self.assertEqual(files, sorted(['exited.json', reg._filename, f'{host}-{os.getppid()}-3.json']))
+            self.assertEqual(reg.prune(), 0)
+            # a later exit is added to what was folded before
+            with open(os.path.join(directory, f'{host}-{child.pid}-4.json'), 'w') as fp:
+                json.dump({'counters': [['hits_total', ['a'], 1]], 'histograms': []}, fp)
+            self.assertEqual(reg.prune(), 1)
+            self.assertIn('hits_total{kind="a"} 16', reg.render())
+
+
+@override_settings(METRICS_ALLOWED_IPS=['127.0.0.1'])
+class MetricsEndpointTests(TestCase):
+    def setUp(self):
+        registry.reset()
+
+    def test_requests_and_transitions_recorded(self):
+        org = PartnerOrganisation.objects.create(name='MetricCo')
+        brady = User.objects.create_user('mx', password='pass', role='BRADY')
+        deal = Deal.objects.create(partner=org, end_customer_name='A', project_name='M', estimated_value=1, product_category='PRINTERS', deal_type='NEW', status='SUBMITTED')
+        client = APIClient()
+        client.force_authenticate(brady)
+        with self.captureOnCommitCallbacks(execute=True):
+            client.post(f'/api/deals/{deal.id}/approve/')
+        text = self.client.get('/metrics').content.decode()
+        self.assertIn('portal_deal_transitions_total{from_status="SUBMITTED",to_status="APPROVED"} 1', text)
+        self.assertIn('portal_request_duration_seconds_count{view="deal-approve",method="POST"} 1', text)
+        self.assertIn('portal_request_queries_count{view="deal-approve"} 1', text)
+
+    @override_settings(METRICS_TOKEN='s3cret')
+    def test_access_control(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer s3cret').status_code, 200)
+
+    @override_settings(METRICS_ALLOWED_IPS=[])
+    def test_closed_without_a_token_or_allowed_addresses(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
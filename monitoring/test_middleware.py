@@ -0,0 +1,43 @@
+import json
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from accounts.models import PartnerOrganisation
+from deals.models import Deal
+from monitoring.middleware import RequestMetrics, query_shape
+
+User = get_user_model()
+
+
+class RequestMetricsMiddlewareTests(TestCase):
+    def setUp(self):
+        self.org = PartnerOrganisation.objects.create(name='MetricsCo')
+        self.brady = User.objects.create_user('mb', password='pass', role='BRADY')
+        Deal.objects.create(partner=self.org, end_customer_name='A', project_name='Timed', estimated_value=1, product_category='PRINTERS', deal_type='NEW')
+        self.client.login(username='mb', password='pass')
+
+    def test_server_timing_header(self):
+        res = self.client.get(reverse('deals:brady_deals'))
+        self.assertEqual(res.status_code, 200)
+        timing = res['Server-Timing']
+        for metric in ('db;dur=', 'view;dur=', 'tpl;dur=', 'total;dur='):
+            self.assertIn(metric, timing)
+        self.assertEqual(res.wsgi_request.metrics.queries, int(timing.split('desc="')[1].split()[0]))
+
+    @override_settings(SLOW_REQUEST_MS=0, REPEATED_QUERY_THRESHOLD=1)
+    def test_slow_requests_logged_as_json(self):
+        with self.assertLogs('monitoring.requests', level='WARNING') as logs:
+            self.client.get(reverse('deals:brady_deals'))
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual(record['view'], 'deals:brady_deals')
+        self.assertGreater(record['queries'], 0)
+        self.assertTrue(record['repeated'])
+
+    def test_repeated_shapes_ignore_in_list_length(self):
+        metrics = RequestMetrics()
+        metrics.statements['SELECT 1 WHERE id IN (%s, %s)'] += 1
+        metrics.statements['SELECT 1 WHERE id IN (%s)'] += 1
+        self.assertEqual(metrics.repeated_queries(threshold=2), [(query_shape('SELECT 1 WHERE id IN (%s)'), 2)])
+        self.assertEqual(query_shape('SELECT 1 LIMIT 25 OFFSET 50'), query_shape('SELECT 1 LIMIT 21'))
@@ -0,0 +1,69 @@
+import os
+import tempfile
+import tracemalloc
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from accounts.models import PartnerOrganisation
+
+User = get_user_model()
+
+
+class ProfilingTests(TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        override = override_settings(PROFILE_DIR=self.tmp.name)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.admin = User.objects.create_user('prof', password='pass', role='ADMIN')
+        self.brady = User.objects.create_user('nonprof', password='pass', role='BRADY')
+        PartnerOrganisation.objects.create(name='ProfCo')
+
+    def test_admin_profile_saved_and_viewable(self):
+        self.client.login(username='prof', password='pass')
+        res = self.client.get(reverse('notifications:list'), {'_profile': '1'})
+        self.assertEqual(res.status_code, 200)
+        profile_id = res['X-Profile-Id']
+        self.assertTrue(os.path.exists(os.path.join(self.tmp.name, f'{profile_id}.prof')))
+        page = self.client.get(reverse('monitoring:profile_detail', args=[profile_id]))
+        self.assertContains(page, 'cumulative')
+        self.assertTrue(page.context['profile']['sql'])
+        self.assertTrue(page.context['profile']['memory'])
+        self.assertContains(self.client.get(reverse('monitoring:profile_list')), profile_id)
+        self.assertEqual(self.client.get(reverse('monitoring:profile_download', args=[profile_id])).status_code, 200)
+        self.assertEqual(self.client.get(reverse('monitoring:profile_detail', args=['..'])).status_code, 404)
+
+    def test_sampling_mode_via_header(self):
+        self.client.login(username='prof', password='pass')
+        res = self.client.get(reverse('notifications:list'), HTTP_X_PROFILE='sample')
+        profile = self.client.get(reverse('monitoring:profile_detail', args=[res['X-Profile-Id']])).context['profile']
+        self.assertEqual(profile['mode'], 'sample')
+        self.assertIn('samples every', profile['report'])
+
+    def test_ignored_for_other_roles(self):
+        self.client.login(username='nonprof', password='pass')
+        res = self.client.get(reverse('notifications:list'), {'_profile': '1'})
+        self.assertNotIn('X-Profile-Id', res)
+        self.assertEqual(os.listdir(self.tmp.name), [])
+        self.assertEqual(self.client.get(reverse('monitoring:profile_list')).status_code, 403)
+
+    def test_superuser_without_the_admin_role_is_treated_like_its_role(self):
+        User.objects.create_superuser('root', password='pass', role='BRADY')
+        self.client.login(username='root', password='pass')
+        self.assertNotIn('X-Profile-Id', self.client.get(reverse('notifications:list'), {'_profile': '1'}))
+        self.assertEqual(self.client.get(reverse('monitoring:profile_list')).status_code, 403)
+
+    def test_memory_skipped_while_something_else_traces(self):
+        self.client.login(username='prof', password='pass')
+        tracemalloc.start()
+        self.addCleanup(tracemalloc.stop)
+        res = self.client.get(reverse('notifications:list'), {'_profile': '1'})
+        self.assertEqual(res.status_code, 200)
+        # the other tracer keeps running
+        self.assertTrue(tracemalloc.is_tracing())
+        page = self.client.get(reverse('monitoring:profile_detail', args=[res['X-Profile-Id']]))
+        self.assertEqual((page.context['profile']['peak_memory_kib'], page.context['profile']['memory']), (None, []))
+        self.assertContains(page, 'peak memory not recorded')
@@ -0,0 +1,10 @@
+from django.urls import path
+from . import views
+
+app_name = 'monitoring'
+
+urlpatterns = [
+    path('profiles/', views.profile_list, name='profile_list'),
+    path('profiles/<str:profile_id>/', views.profile_detail, name='profile_detail'),
+    path('profiles/<str:profile_id>/download/', views.profile_download, name='profile_download'),
+]
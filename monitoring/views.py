@@ -0,0 +1,66 @@
+import hmac
+import os
+from functools import wraps
+
+from django.conf import settings
+from django.contrib.auth.views import redirect_to_login
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseForbidden
+from django.shortcuts import render
+
+from accounts.principal import get_principal
+
+from . import profiling
+from .metrics import registry
+
+
+def _allowed(request):
+    token = getattr(settings, 'METRICS_TOKEN', '')
+    if token:
+        supplied = request.headers.get('Authorization', '').removeprefix('Bearer ').strip()
+        return hmac.compare_digest(supplied, token)
+    return request.META.get('REMOTE_ADDR') in getattr(settings, 'METRICS_ALLOWED_IPS', ())
+
+
+def metrics(request):
+    # scraped by Prometheus: either a bearer token or an allow-listed address; closed until one is configured
+    if not _allowed(request):
+        return HttpResponseForbidden('Forbidden')
+    return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+def _admin_required(view):
+    @wraps(view)
+    def wrapped(request, *args, **kwargs):
+        if not request.user.is_authenticated:
+            return redirect_to_login(request.get_full_path())
+        principal = get_principal(request)
+        # the same check as ProfilingMiddleware
+        if not principal.is_admin:
+            return HttpResponseForbidden('Forbidden')
+        return view(request, *args, **kwargs)
+    return wrapped
+
+
+@_admin_required
+def profile_list(request):
+    return render(request, 'monitoring/profile_list.html', {'profiles': profiling.list_profiles()})
+
+
+@_admin_required
+def profile_detail(request, profile_id):
+    profile = profiling.load_profile(profile_id)
+    if profile is None:
+        raise Http404('No such profile')
+    sql_ms = sum(entry['ms'] for entry in profile['sql'])
+    return render(request, 'monitoring/profile_detail.html', {'profile': profile, 'sql_ms': round(sql_ms, 1)})
+
+
+@_admin_required
+def profile_download(request, profile_id):
+    # raw cProfile data for snakeviz / pstats
+    if profiling.load_profile(profile_id) is None:
+        raise Http404('No such profile')
+    path = os.path.join(profiling.profile_dir(), f'{profile_id}.prof')
+    if not os.path.exists(path):
+        raise Http404('No cProfile data for this profile')
+    return FileResponse(open(path, 'rb'), as_attachment=True, filename=f'{profile_id}.prof')
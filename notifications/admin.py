@@ -1,8 +1,15 @@
 from django.contrib import admin
-from .models import Notification
+from .models import Notification, OutboxEvent
 
 
 @admin.register(Notification)
 class NotificationAdmin(admin.ModelAdmin):
-    list_display = ('recipient', 'verb', 'created_at', 'read')
-    list_filter = ('read',)
+    list_display = ('recipient', 'audience', 'verb', 'created_at', 'read')
+    list_filter = ('read', 'audience')
+
+
+@admin.register(OutboxEvent)
+class OutboxEventAdmin(admin.ModelAdmin):
+    list_display = ('deal', 'old_status', 'new_status', 'created_at', 'processed_at', 'attempts', 'next_attempt_at')
+    list_filter = ('new_status',)
+    readonly_fields = ('deal', 'changed_by', 'old_status', 'new_status', 'created_at', 'processed_at', 'attempts', 'next_attempt_at', 'last_error')
@@ -6,4 +6,5 @@ class NotificationsConfig(AppConfig):
     name = 'notifications'
 
     def ready(self):
-        pass
+        # keep the cached navbar bell in step with notification writes
+        import notifications.signals  # noqa: F401
@@ -0,0 +1,73 @@
+"""Per-user cache of the navbar bell: unread count plus the most recent items.
+
+Entries are keyed by a per-user and a per-role version number. Creating
+notifications bumps the version (a direct recipient's, or the audience role's
+for broadcasts), and read state changes bump the user's. Bumps wait for the
+transaction to commit and use the cache's atomic ``incr``, so a rollback or two
+concurrent marks cannot leave a wrong count behind. A page render therefore
+normally costs no notification queries at all.
+
+Invalidation only reaches other processes through a shared cache backend
+(memcached, Redis); with the default LocMemCache stale entries in other
+workers live until NOTIFICATION_BELL_CACHE_SECONDS expires them.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+BELL_LIMIT = 5
+
+_USER_VERSION_KEY = 'notifications:bell:user:{}'
+_ROLE_VERSION_KEY = 'notifications:bell:role:{}'
+
+
+def _timeout():
+    return getattr(settings, 'NOTIFICATION_BELL_CACHE_SECONDS', 300)
+
+
+def _bell_key(user):
+    user_key = _USER_VERSION_KEY.format(user.pk)
+    role_key = _ROLE_VERSION_KEY.format(user.role)
+    versions = cache.get_many([user_key, role_key])
+    return f'notifications:bell:{user.pk}:{versions.get(user_key, 0)}:{versions.get(role_key, 0)}'
+
+
+def _bump(key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, 1, None)
+
+
+def get_bell(user, limit=BELL_LIMIT):
+    """Return ``(unread_count, recent)``, where ``recent`` is a list of dicts."""
+    from .models import Notification
+
+    key = _bell_key(user)
+    data = cache.get(key)
+    if data is None or data['limit'] < limit:
+        visible = Notification.objects.for_user(user)
+        recent = list(visible.order_by('-created_at').values('id', 'verb', 'description', 'created_at', 'is_read')[:limit])
+        data = {'unread': visible.filter(is_read=False).count(), 'recent': recent, 'limit': limit}
+        cache.set(key, data, _timeout())
+    return data['unread'], data['recent'][:limit]
+
+
+def invalidate_users(user_ids):
+    """Drop cached bells once the surrounding transaction commits."""
+    user_ids = set(user_ids)
+    if user_ids:
+        transaction.on_commit(lambda: [_bump(_USER_VERSION_KEY.format(pk)) for pk in user_ids])
+
+
+def invalidate_roles(roles):
+    roles = set(roles)
+    if roles:
+        transaction.on_commit(lambda: [_bump(_ROLE_VERSION_KEY.format(role)) for role in roles])
+
+
+def invalidate_for(notifications):
+    """Invalidate every bell that newly created notifications appear in."""
+    invalidate_users(n.recipient_id for n in notifications if n.recipient_id)
+    invalidate_roles(n.audience for n in notifications if not n.recipient_id and n.audience)
+
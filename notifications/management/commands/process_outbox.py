@@ -0,0 +1,25 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from notifications.outbox import drain
+
+
+class Command(BaseCommand):
+    help = 'Deliver pending deal status notifications and emails from the outbox'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=getattr(settings, 'NOTIFICATION_OUTBOX_BATCH_SIZE', 100))
+        parser.add_argument('--loop', action='store_true', help='Keep polling instead of exiting once the outbox is empty')
+        parser.add_argument('--interval', type=float, default=2.0, help='Seconds to sleep between polls with --loop')
+
+    def handle(self, *args, **options):
+        while True:
+            processed = drain(batch_size=options['batch_size'])
+            if processed or not options['loop']:
+                self.stdout.write(self.style.SUCCESS(f'Processed {processed} outbox events'))
+            if not options['loop']:
+                return
+            if not processed:
+                time.sleep(options['interval'])
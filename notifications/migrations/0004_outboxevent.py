@@ -0,0 +1,35 @@
+# Generated by Django 4.2.30 on 2026-10-18 16:10
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('deals', '0002_alter_deal_created_at_alter_deal_end_customer_name_and_more'),
+        ('notifications', '0003_alter_notification_options_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OutboxEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('old_status', models.CharField(blank=True, max_length=20)),
+                ('new_status', models.CharField(max_length=20)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('processed_at', models.DateTimeField(blank=True, null=True)),
+                ('attempts', models.PositiveSmallIntegerField(default=0)),
+                ('last_error', models.TextField(blank=True)),
+                ('changed_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('deal', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='outbox_events', to='deals.deal')),
+            ],
+            options={
+                'ordering': ['id'],
+                'indexes': [models.Index(fields=['processed_at', 'id'], name='notificatio_process_55e62a_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,60 @@
+# Generated by Django 4.2.30 on 2026-10-18 16:13
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('accounts', '0002_alter_partnerorganisation_created_at_and_more'),
+        ('notifications', '0004_outboxevent'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BroadcastReadMark',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='+', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('read_until', models.DateTimeField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='NotificationReceipt',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('read', models.BooleanField(default=True)),
+                ('dismissed', models.BooleanField(default=False)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='notification',
+            name='audience',
+            field=models.CharField(blank=True, help_text='Role that receives this broadcast', max_length=20),
+        ),
+        migrations.AlterField(
+            model_name='notification',
+            name='recipient',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='notifications', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(fields=['audience', '-created_at'], name='notificatio_audienc_98ff43_idx'),
+        ),
+        migrations.AddField(
+            model_name='notificationreceipt',
+            name='notification',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='receipts', to='notifications.notification'),
+        ),
+        migrations.AddField(
+            model_name='notificationreceipt',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddConstraint(
+            model_name='notificationreceipt',
+            constraint=models.UniqueConstraint(fields=('notification', 'user'), name='uniq_notification_receipt'),
+        ),
+    ]
@@ -1,9 +1,49 @@
 from django.db import models
+from django.db.models import BooleanField, Case, Exists, F, OuterRef, Q, Subquery, Value, When
 from django.conf import settings
+from django.utils import timezone
+from . import cache as bell_cache
+
+
+class NotificationQuerySet(models.QuerySet):
+    def for_user(self, user):
+        """Direct notifications plus broadcasts to the user's role, with ``is_read`` merged in.
+
+        Broadcast rows are shared, so their read state comes from the user's
+        receipt if there is one, otherwise from their mark-all-read watermark.
+        """
+        receipts = NotificationReceipt.objects.filter(notification=OuterRef('pk'), user=user)
+        read_until = BroadcastReadMark.objects.filter(user=user).values('read_until')[:1]
+        visible = Q(recipient=user)
+        if user.role:
+            visible |= Q(recipient__isnull=True, audience=user.role, created_at__gte=user.date_joined)
+        return self.filter(visible).filter(~Exists(receipts.filter(dismissed=True))).annotate(
+            is_read=Case(
+                When(recipient__isnull=False, then=F('read')),
+                When(Exists(receipts.filter(read=True)), then=Value(True)),
+                When(Exists(receipts.filter(read=False)), then=Value(False)),
+                When(created_at__lte=Subquery(read_until), then=Value(True)),
+                default=Value(False),
+                output_field=BooleanField(),
+            )
+        )
+
+    def mark_all_read_for(self, user):
+        now = timezone.now()
+        self.filter(recipient=user, read=False).update(read=True)
+        BroadcastReadMark.objects.update_or_create(user=user, defaults={'read_until': now})
+        # the watermark now covers every older broadcast; only dismissals need keeping
+        NotificationReceipt.objects.filter(user=user, dismissed=False, notification__created_at__lte=now).delete()
+        bell_cache.invalidate_users([user.pk])
 
 
 class Notification(models.Model):
-    recipient = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='notifications', db_index=True)
+    """An in-app notification for one recipient, or a broadcast to every user of a role.
+
+    Broadcasts have no recipient; per-user read state lives in NotificationReceipt.
+    """
+    recipient = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, null=True, blank=True, related_name='notifications', db_index=True)
+    audience = models.CharField(max_length=20, blank=True, help_text='Role that receives this broadcast')
     changed_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True, related_name='notifications_created', db_index=True)
     verb = models.CharField(max_length=255)
     description = models.TextField(blank=True)
@@ -14,4 +54,77 @@ class Notification(models.Model):
         ordering = ['-created_at']
         indexes = [
             models.Index(fields=['recipient', 'read', '-created_at']),
+            models.Index(fields=['audience', '-created_at']),
+        ]
+
+    objects = NotificationQuerySet.as_manager()
+
+    @property
+    def is_broadcast(self):
+        return self.recipient_id is None
+
+    def mark_read_for(self, user, read=True):
+        was_read = getattr(self, 'is_read', None)
+        if not self.is_broadcast:
+            was_read = self.read
+            if self.read != read:
+                self.read = read
+                self.save(update_fields=['read'])
+        else:
+            NotificationReceipt.objects.update_or_create(notification=self, user=user, defaults={'read': read})
+        self.is_read = read
+        if was_read != read:
+            bell_cache.invalidate_users([user.pk])
+
+    def dismiss_for(self, user):
+        if self.is_broadcast:
+            NotificationReceipt.objects.update_or_create(notification=self, user=user, defaults={'dismissed': True})
+            bell_cache.invalidate_users([user.pk])
+        else:
+            self.delete()
+
+
+class NotificationReceipt(models.Model):
+    """One user's read or dismissed state for a broadcast notification."""
+    notification = models.ForeignKey(Notification, on_delete=models.CASCADE, related_name='receipts')
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='+')
+    read = models.BooleanField(default=True)
+    dismissed = models.BooleanField(default=False)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['notification', 'user'], name='uniq_notification_receipt'),
+        ]
+
+
+class BroadcastReadMark(models.Model):
+    """Broadcasts created at or before ``read_until`` count as read unless a receipt says otherwise."""
+    user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, primary_key=True, related_name='+')
+    read_until = models.DateTimeField()
+
+
+class OutboxEvent(models.Model):
+    """A deal status change waiting to be fanned out to notifications and email.
+
+    Rows are written in the same transaction as the status change and drained
+    by ``manage.py process_outbox``. A failed delivery is retried no sooner
+    than ``next_attempt_at``.
+    """
+    deal = models.ForeignKey('deals.Deal', on_delete=models.CASCADE, related_name='outbox_events')
+    changed_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    old_status = models.CharField(max_length=20, blank=True)
+    new_status = models.CharField(max_length=20)
+    created_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+
+    class Meta:
+        ordering = ['id']
+        indexes = [
+            models.Index(fields=['processed_at', 'id']),
         ]
+
+    def __str__(self):
+        return f"Deal {self.deal_id}: {self.old_status} -> {self.new_status}"
@@ -0,0 +1,159 @@
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from monitoring.metrics import EMAIL_SEND, NOTIFICATION_FANOUT
+
+from . import cache as bell_cache
+from .models import Notification, OutboxEvent
+
+logger = logging.getLogger(__name__)
+
+
+def enqueue_status_change(deal, old_status, new_status, changed_by=None):
+    """Record a status change for later fan-out; call inside the deal's transaction."""
+    return OutboxEvent.objects.create(deal=deal, changed_by=changed_by, old_status=old_status or '', new_status=new_status)
+
+
+def _recipients_by_event(events, deals):
+    """Resolve every recipient of a batch with a single user query."""
+    User = get_user_model()
+    partner_ids = {d.partner_id for d in deals.values()}
+    owner_ids = {d.internal_owner_id for d in deals.values() if d.internal_owner_id}
+    wants_brady = any(e.new_status == 'SUBMITTED' for e in events)
+
+    cond = Q(partner_organisation_id__in=partner_ids) | Q(pk__in=owner_ids)
+    if wants_brady:
+        cond |= Q(role='BRADY')
+    users = list(User.objects.filter(cond).only('id', 'email', 'role', 'partner_organisation_id'))
+    by_id = {u.pk: u for u in users}
+    by_partner = {}
+    for u in users:
+        if u.partner_organisation_id:
+            by_partner.setdefault(u.partner_organisation_id, []).append(u)
+    brady = [u for u in users if u.role == 'BRADY']
+
+    recipients = {}
+    for event in events:
+        deal = deals.get(event.deal_id)
+        if deal is None:
+            continue
+        found = {u.pk: u for u in by_partner.get(deal.partner_id, [])}
+        # for submitted deals, notify Brady users as well
+        if event.new_status == 'SUBMITTED':
+            found.update((u.pk, u) for u in brady)
+        # always include internal owner if present
+        if deal.internal_owner_id in by_id:
+            found[deal.internal_owner_id] = by_id[deal.internal_owner_id]
+        recipients[event.pk] = list(found.values())
+    return recipients
+
+
+def fan_out(events):
+    """Write in-app notifications for a batch and mark it processed.
+
+    Call inside a transaction. Returns the email messages to send once the transaction has committed.
+    """
+    from deals.models import Deal
+
+    deals = Deal.objects.select_related('partner').in_bulk({e.deal_id for e in events})
+    recipients = _recipients_by_event(events, deals)
+
+    notifications = []
+    messages = []
+    sizes = []
+    for event in events:
+        users = recipients.get(event.pk)
+        sizes.append(len(users or ()))
+        if not users:
+            continue
+        deal = deals[event.deal_id]
+        subject = f"Deal {deal} status changed to {event.new_status}"
+        body = f"Status changed from {event.old_status} to {event.new_status}."
+        # Brady staff share one broadcast row instead of a copy each
+        broadcast = event.new_status == 'SUBMITTED'
+        if broadcast:
+            notifications.append(Notification(audience='BRADY', changed_by_id=event.changed_by_id, verb=subject, description=body))
+        notifications.extend(
+            Notification(recipient=u, changed_by_id=event.changed_by_id, verb=subject, description=body)
+            for u in users
+            if not (broadcast and u.role == 'BRADY')
+        )
+        addresses = [u.email for u in users if u.email]
+        if addresses:
+            messages.append(EmailMessage(subject, body, settings.DEFAULT_FROM_EMAIL, addresses))
+
+    Notification.objects.bulk_create(notifications)
+    # bulk_create skips post_save, so refresh the affected bells explicitly
+    bell_cache.invalidate_for(notifications)
+    OutboxEvent.objects.filter(pk__in=[e.pk for e in events]).update(
+        processed_at=timezone.now(), attempts=F('attempts') + 1, last_error=''
+    )
+    # a batch that rolls back and is redone event by event must not be counted twice
+    transaction.on_commit(lambda: [NOTIFICATION_FANOUT.observe(size) for size in sizes])
+    return messages
+
+
+def claim_batch(batch_size):
+    """Lock the next pending events; call inside a transaction."""
+    max_attempts = getattr(settings, 'NOTIFICATION_OUTBOX_MAX_ATTEMPTS', 5)
+    due = Q(next_attempt_at__isnull=True) | Q(next_attempt_at__lte=timezone.now())
+    qs = OutboxEvent.objects.filter(due, processed_at__isnull=True, attempts__lt=max_attempts).order_by('id')
+    # concurrent workers skip each other's rows where the database supports it
+    return list(qs.select_for_update(skip_locked=True)[:batch_size])
+
+
+def _deliver(events):
+    """Fan out a claimed batch; returns the messages to send and how many events were delivered.
+
+    If the batch fails it is redone one event at a time, so a bad event only
+    sets back itself: its attempt is counted and its next one delayed.
+    """
+    if len(events) > 1:
+        try:
+            with transaction.atomic():
+                return fan_out(events), len(events)
+        except Exception:
+            logger.warning('Outbox batch %s failed; delivering its events one by one', [e.pk for e in events])
+    messages = []
+    delivered = 0
+    retry_seconds = getattr(settings, 'NOTIFICATION_OUTBOX_RETRY_SECONDS', 60)
+    for event in events:
+        try:
+            with transaction.atomic():
+                messages += fan_out([event])
+            delivered += 1
+        except Exception as exc:
+            logger.exception('Outbox delivery failed for event %s', event.pk)
+            OutboxEvent.objects.filter(pk=event.pk).update(
+                attempts=F('attempts') + 1, last_error=str(exc)[:2000],
+                next_attempt_at=timezone.now() + timedelta(seconds=retry_seconds * 2 ** event.attempts),
+            )
+    return messages, delivered
+
+
+def drain(batch_size=None, max_batches=None):
+    """Process pending outbox events batch by batch; return how many were delivered."""
+    batch_size = batch_size or getattr(settings, 'NOTIFICATION_OUTBOX_BATCH_SIZE', 100)
+    processed = 0
+    batches = 0
+    # one mail connection is reused for the whole drain
+    connection = get_connection(fail_silently=True)
+    while max_batches is None or batches < max_batches:
+        with transaction.atomic():
+            events = claim_batch(batch_size)
+            if not events:
+                break
+            messages, delivered = _deliver(events)
+        if messages:
+            with EMAIL_SEND.time(source='outbox'):
+                connection.send_messages(messages)
+        processed += delivered
+        batches += 1
+    return processed
@@ -2,7 +2,27 @@ from rest_framework import serializers
 from .models import Notification
 
 class NotificationSerializer(serializers.ModelSerializer):
+    read = serializers.BooleanField(source='is_read', required=False)
+
     class Meta:
         model = Notification
-        fields = ('id', 'recipient', 'verb', 'description', 'created_at', 'read')
-        read_only_fields = ('recipient', 'created_at')
+        fields = ('id', 'recipient', 'audience', 'verb', 'description', 'created_at', 'read')
+        read_only_fields = ('recipient', 'audience', 'created_at')
+
+    def validate(self, data):
+        # broadcasts are shared between users; only the read state is per user
+        if self.instance is not None and self.instance.is_broadcast and set(data) - {'is_read'}:
+            raise serializers.ValidationError('Only the read state of a broadcast notification can be changed')
+        return data
+
+    def create(self, validated_data):
+        validated_data['read'] = validated_data.pop('is_read', False)
+        return super().create(validated_data)
+
+    def update(self, instance, validated_data):
+        is_read = validated_data.pop('is_read', None)
+        if validated_data:
+            instance = super().update(instance, validated_data)
+        if is_read is not None:
+            instance.mark_read_for(self.context['request'].user, is_read)
+        return instance
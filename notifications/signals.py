@@ -0,0 +1,16 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from . import cache as bell_cache
+from .models import Notification
+
+
+@receiver(post_save, sender=Notification)
+def refresh_bell_on_save(sender, instance: Notification, created, update_fields=None, **kwargs):
+    # read-state changes patch the cached bell themselves
+    if created or set(update_fields or ()) != {'read'}:
+        bell_cache.invalidate_for([instance])
+
+
+@receiver(post_delete, sender=Notification)
+def refresh_bell_on_delete(sender, instance: Notification, **kwargs):
+    bell_cache.invalidate_for([instance])
@@ -1,14 +1,14 @@
 from django import template
-from django.urls import reverse
+from notifications.cache import BELL_LIMIT, get_bell
 
 register = template.Library()
 
 @register.inclusion_tag('notifications/bell.html', takes_context=True)
-def notifications_bell(context, limit=5):
+def notifications_bell(context, limit=BELL_LIMIT):
     user = context['user']
     if user.is_authenticated:
-        qs = user.notifications.order_by('-created_at')[:limit]
-        unread = user.notifications.filter(read=False).count()
+        # served from the per-user bell cache; see notifications.cache
+        unread, qs = get_bell(user, limit)
     else:
         qs = []
         unread = 0
@@ -1,9 +1,16 @@
 from django.test import TestCase
 from django.contrib.auth import get_user_model
 from rest_framework.test import APIClient
+from django.core import mail
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.core.management import call_command
+from django.utils import timezone
 from unittest.mock import patch
 from deals.models import Deal
-from notifications.models import Notification
+from monitoring.metrics import registry
+from notifications import outbox
+from notifications.models import Notification, OutboxEvent
 from accounts.models import PartnerOrganisation
 
 
@@ -18,24 +25,131 @@ class NotificationTests(TestCase):
         self.brady_user = User.objects.create_user(username='bu', password='pass', role='BRADY', email='bu@example.com')
         self.deal = Deal.objects.create(partner=self.partner_org, end_customer_name='ACME', project_name='Notify', estimated_value=100, product_category='PRINTERS', deal_type='NEW')
 
-    @patch('deals.signals.send_mail')
-    def test_submit_notifies_brady_and_partner(self, mock_send_mail):
+    def test_submit_notifies_brady_and_partner(self):
         self.client.login(username='pu', password='pass')
         res = self.client.post(f'/api/deals/{self.deal.id}/submit/')
         self.assertEqual(res.status_code, 200)
+        # fan-out is deferred to the outbox worker
+        self.assertFalse(Notification.objects.exists())
+        self.assertEqual(OutboxEvent.objects.filter(deal=self.deal, new_status='SUBMITTED').count(), 1)
+        call_command('process_outbox')
         # brady should get a notification
         self.assertTrue(Notification.objects.filter(verb__icontains='SUBMITTED').exists())
         # partner user should also get a notification
         self.assertTrue(Notification.objects.filter(recipient=self.partner_user, verb__icontains='SUBMITTED').exists())
         # email attempted
-        self.assertTrue(mock_send_mail.called)
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(set(mail.outbox[0].to), {'pu@example.com', 'bu@example.com'})
 
-    @patch('deals.signals.send_mail')
-    def test_approve_notifies_partner(self, mock_send_mail):
+    def test_approve_notifies_partner(self):
         self.deal.status = 'SUBMITTED'
         self.deal.save()
         self.client.login(username='bu', password='pass')
         res = self.client.post(f'/api/deals/{self.deal.id}/approve/')
         self.assertEqual(res.status_code, 200)
+        call_command('process_outbox')
         self.assertTrue(Notification.objects.filter(recipient=self.partner_user, verb__icontains='APPROVED').exists())
-        self.assertTrue(mock_send_mail.called)
+        self.assertTrue(any('APPROVED' in m.subject for m in mail.outbox))
+
+    def test_outbox_drain_is_batched_and_idempotent(self):
+        for i in range(3):
+            User.objects.create_user(username=f'pu{i}', password='pass', role='PARTNER', partner_organisation=self.partner_org, email=f'pu{i}@example.com')
+        self.deal.status = 'SUBMITTED'
+        self.deal.save()
+        self.deal.status = 'APPROVED'
+        self.deal.save()
+        # claim, deals, users, notification insert, outbox update, final empty claim;
+        # independent of recipient count
+        with CaptureQueriesContext(connection) as ctx:
+            call_command('process_outbox', batch_size=10)
+        statements = [q['sql'] for q in ctx.captured_queries if 'SAVEPOINT' not in q['sql']]
+        self.assertEqual(len(statements), 6)
+        self.assertEqual(Notification.objects.filter(verb__icontains='APPROVED').count(), 4)
+        self.assertEqual(len(mail.outbox), 2)
+        call_command('process_outbox')
+        self.assertEqual(Notification.objects.count(), 9)
+        self.assertFalse(OutboxEvent.objects.filter(processed_at__isnull=True).exists())
+
+    def test_failing_event_is_set_back_alone(self):
+        for status in ('SUBMITTED', 'APPROVED', 'CLOSED_WON'):
+            self.deal.status = status
+            self.deal.save()
+        bad = OutboxEvent.objects.get(new_status='APPROVED')
+        real_message = outbox.EmailMessage
+
+        def message(subject, *args):
+            # fails part-way through fan_out, after the batch's fan-out sizes were taken
+            if subject.endswith('APPROVED'):
+                raise RuntimeError('mail template broke')
+            return real_message(subject, *args)
+
+        registry.reset()
+        with patch('notifications.outbox.EmailMessage', message), self.assertLogs('notifications.outbox', 'ERROR'), \
+                self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(outbox.drain(), 2)
+        # the rolled-back batch is not counted, only the two delivered events
+        self.assertIn('portal_notification_fanout_recipients_count 2\n', registry.render())
+        bad.refresh_from_db()
+        self.assertIsNone(bad.processed_at)
+        self.assertEqual(bad.attempts, 1)
+        self.assertEqual(bad.last_error, 'mail template broke')
+        self.assertGreater(bad.next_attempt_at, timezone.now())
+        self.assertEqual(OutboxEvent.objects.filter(processed_at__isnull=False, attempts=1).count(), 2)
+        # not due yet, so not retried straight away
+        self.assertEqual(outbox.drain(), 0)
+
+        OutboxEvent.objects.filter(pk=bad.pk).update(next_attempt_at=timezone.now())
+        self.assertEqual(outbox.drain(), 1)
+        self.assertEqual(Notification.objects.filter(verb__icontains='APPROVED').count(), 1)
+
+
+class BroadcastNotificationTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.partner_org = PartnerOrganisation.objects.create(name='BroadcastPartner')
+        self.partner_user = User.objects.create_user(username='bp', password='pass', role='PARTNER', partner_organisation=self.partner_org, email='bp@example.com')
+        self.brady1 = User.objects.create_user(username='bb1', password='pass', role='BRADY', email='bb1@example.com')
+        self.brady2 = User.objects.create_user(username='bb2', password='pass', role='BRADY', email='bb2@example.com')
+        self.deal = Deal.objects.create(partner=self.partner_org, end_customer_name='ACME', project_name='Shared', estimated_value=100, product_category='PRINTERS', deal_type='NEW')
+        self.deal.status = 'SUBMITTED'
+        self.deal.save()
+        call_command('process_outbox')
+        self.broadcast = Notification.objects.get(audience='BRADY')
+
+    def test_submission_stores_one_shared_row(self):
+        self.assertIsNone(self.broadcast.recipient_id)
+        self.assertEqual(Notification.objects.filter(verb__icontains='SUBMITTED').count(), 2)
+        for user in (self.brady1, self.brady2):
+            self.assertEqual(list(Notification.objects.for_user(user).values_list('pk', 'is_read')), [(self.broadcast.pk, False)])
+        # partners do not see the Brady broadcast
+        self.assertEqual(Notification.objects.for_user(self.partner_user).filter(audience='BRADY').count(), 0)
+        # staff who join later do not inherit older broadcasts
+        late = User.objects.create_user(username='bb3', password='pass', role='BRADY')
+        self.assertFalse(Notification.objects.for_user(late).exists())
+
+    def test_read_state_is_per_user(self):
+        self.client.login(username='bb1', password='pass')
+        res = self.client.post(f'/api/notifications/{self.broadcast.pk}/mark_read/')
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(res.json()['read'])
+        self.assertTrue(Notification.objects.for_user(self.brady1).get().is_read)
+        self.assertFalse(Notification.objects.for_user(self.brady2).get().is_read)
+        # shared text cannot be edited through one user's copy
+        res = self.client.patch(f'/api/notifications/{self.broadcast.pk}/', {'verb': 'Changed'}, format='json')
+        self.assertEqual(res.status_code, 400)
+
+    def test_mark_all_read_uses_watermark(self):
+        self.client.login(username='bb2', password='pass')
+        self.client.post('/api/notifications/mark_all_read/')
+        self.assertTrue(Notification.objects.for_user(self.brady2).get().is_read)
+        self.assertEqual(self.broadcast.receipts.count(), 0)
+        res = self.client.post(f'/api/notifications/{self.broadcast.pk}/mark_unread/')
+        self.assertFalse(res.json()['read'])
+        self.assertFalse(Notification.objects.for_user(self.brady2).get().is_read)
+
+    def test_delete_only_hides_broadcast_for_requester(self):
+        self.client.login(username='bb1', password='pass')
+        res = self.client.delete(f'/api/notifications/{self.broadcast.pk}/')
+        self.assertEqual(res.status_code, 204)
+        self.assertFalse(Notification.objects.for_user(self.brady1).exists())
+        self.assertTrue(Notification.objects.for_user(self.brady2).exists())
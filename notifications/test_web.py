@@ -1,6 +1,9 @@
 from django.test import TestCase, Client
 from django.urls import reverse
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
 from notifications.models import Notification
 
 User = get_user_model()
@@ -8,6 +11,7 @@ User = get_user_model()
 
 class NotificationsWebTest(TestCase):
     def setUp(self):
+        cache.clear()
         self.user = User.objects.create_user('nuser', password='pass', role='BRADY', email='nuser@example.com')
         Notification.objects.create(recipient=self.user, verb='Test', description='Hello')
         Notification.objects.create(recipient=self.user, verb='Later', description='Another')
@@ -30,3 +34,59 @@ class NotificationsWebTest(TestCase):
         resp = c.post(reverse('notifications:mark_all_read'))
         self.assertEqual(resp.status_code, 302)
         self.assertEqual(Notification.objects.filter(recipient=self.user, read=False).count(), 0)
+
+    def _notification_queries(self, client, url):
+        with CaptureQueriesContext(connection) as ctx:
+            r = client.get(url)
+        self.assertEqual(r.status_code, 200)
+        return r, [q['sql'] for q in ctx.captured_queries if 'notifications_' in q['sql']]
+
+    def test_bell_is_cached_and_kept_current(self):
+        c = Client()
+        c.login(username='nuser', password='pass')
+        r, queries = self._notification_queries(c, reverse('deals:brady_deals'))
+        self.assertTrue(queries)
+        self.assertEqual(r.context['unread_count'], 2)
+        # later renders are served from the cache
+        r, queries = self._notification_queries(c, reverse('deals:brady_deals'))
+        self.assertEqual(queries, [])
+        self.assertEqual(r.context['unread_count'], 2)
+
+        # marking read drops the entry once committed
+        n = Notification.objects.filter(recipient=self.user).first()
+        with self.captureOnCommitCallbacks(execute=True):
+            c.post(reverse('notifications:mark_read', args=[n.id]))
+        r, queries = self._notification_queries(c, reverse('deals:brady_deals'))
+        self.assertTrue(queries)
+        self.assertEqual(r.context['unread_count'], 1)
+
+        # a new notification invalidates the entry
+        with self.captureOnCommitCallbacks(execute=True):
+            Notification.objects.create(recipient=self.user, verb='Fresh', description='New')
+        r, queries = self._notification_queries(c, reverse('deals:brady_deals'))
+        self.assertTrue(queries)
+        self.assertEqual(r.context['unread_count'], 2)
+        self.assertContains(r, 'Fresh')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            c.post(reverse('notifications:mark_all_read'))
+        r, queries = self._notification_queries(c, reverse('deals:brady_deals'))
+        self.assertEqual(r.context['unread_count'], 0)
+        r, queries = self._notification_queries(c, reverse('deals:brady_deals'))
+        self.assertEqual(queries, [])
+
+    def test_rolled_back_read_leaves_the_bell_alone(self):
+        c = Client()
+        c.login(username='nuser', password='pass')
+        self.assertEqual(c.get(reverse('deals:brady_deals')).context['unread_count'], 2)
+        with self.captureOnCommitCallbacks(execute=True):
+            try:
+                with transaction.atomic():
+                    Notification.objects.filter(recipient=self.user).first().mark_read_for(self.user)
+                    Notification.objects.mark_all_read_for(self.user)
+                    raise RuntimeError
+            except RuntimeError:
+                pass
+        r, queries = self._notification_queries(c, reverse('deals:brady_deals'))
+        self.assertEqual(queries, [])
+        self.assertEqual(r.context['unread_count'], 2)
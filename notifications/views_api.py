@@ -11,26 +11,28 @@ class NotificationViewSet(viewsets.ModelViewSet):
     permission_classes = [IsAuthenticated]
 
     def get_queryset(self):
-        return Notification.objects.filter(recipient=self.request.user).order_by('-created_at')
+        return Notification.objects.for_user(self.request.user).order_by('-created_at')
 
     def perform_create(self, serializer):
         serializer.save(recipient=self.request.user)
 
+    def perform_destroy(self, instance):
+        # broadcasts are only hidden for the requesting user
+        instance.dismiss_for(self.request.user)
+
     @action(detail=True, methods=['post'])
     def mark_read(self, request, pk=None):
         n = self.get_object()
-        n.read = True
-        n.save()
+        n.mark_read_for(request.user, True)
         return Response(self.get_serializer(n).data)
 
     @action(detail=True, methods=['post'])
     def mark_unread(self, request, pk=None):
         n = self.get_object()
-        n.read = False
-        n.save()
+        n.mark_read_for(request.user, False)
         return Response(self.get_serializer(n).data)
 
     @action(detail=False, methods=['post'])
     def mark_all_read(self, request):
-        Notification.objects.filter(recipient=request.user, read=False).update(read=True)
+        Notification.objects.mark_all_read_for(request.user)
         return Response({'marked': True})
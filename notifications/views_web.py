@@ -12,21 +12,20 @@ class NotificationsListView(LoginRequiredMixin, ListView):
     paginate_by = 50
 
     def get_queryset(self):
-        return Notification.objects.filter(recipient=self.request.user).select_related('changed_by').order_by('-created_at')
+        return Notification.objects.for_user(self.request.user).select_related('changed_by').order_by('-created_at')
 
 
 class MarkAsReadView(LoginRequiredMixin, View):
     def post(self, request, pk):
-        n = get_object_or_404(Notification.objects.only('id', 'read', 'recipient_id'), pk=pk, recipient=request.user)
-        if not n.read:
-            n.read = True
-            n.save(update_fields=['read'])
+        n = get_object_or_404(Notification.objects.for_user(request.user).only('id', 'read', 'recipient_id'), pk=pk)
+        if not n.is_read:
+            n.mark_read_for(request.user)
         messages.success(request, 'Notification marked as read.')
         return redirect('notifications:list')
 
 
 class MarkAllReadView(LoginRequiredMixin, View):
     def post(self, request):
-        Notification.objects.filter(recipient=request.user, read=False).update(read=True)
+        Notification.objects.mark_all_read_for(request.user)
         messages.success(request, 'All notifications marked as read.')
         return redirect('notifications:list')
@@ -0,0 +1,248 @@
+"""Query budgets for every URL in api/urls.py, deals/urls.py and notifications/urls.py.
+
+Each URL is requested as a partner, a Brady user and an admin, against a small
+dataset and again after the dataset has grown several times over. A request
+fails if it runs more queries than its budget, or if its queries differ between
+the two sizes: a query count that follows the row count is an N+1.
+"""
+import json
+import logging
+from collections import Counter
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.test import Client, TestCase
+from django.urls import reverse
+
+from accounts.models import PartnerOrganisation
+from accounts.synthetic import Generator, explicit_timestamps
+from api.urls import router
+from deals import analytics as deal_analytics
+from deals import stats as deal_stats
+from deals import urls as deal_urls
+from deals.models import Deal, DealAudit
+from monitoring.middleware import query_shape
+from notifications import urls as notification_urls
+from notifications.models import Notification
+
+User = get_user_model()
+ROLES = ('partner', 'brady', 'admin')
+
+
+class Case:
+    """One request against a URL name; ``args`` and ``data`` take the fixture."""
+
+    def __init__(self, budget, method='get', args=None, data=None, query=''):
+        self.budget = budget
+        self.method = method
+        self.args = args or (lambda f, role: [])
+        self.data = data
+        self.query = query
+
+
+def deal(status):
+    return lambda f, role: [f.deals[status].pk]
+
+
+def notification(f, role):
+    return [f.notifications[role].pk]
+
+
+def new_deal(f, role):
+    return {'project_name': 'Budget', 'end_customer_name': 'Budget Ltd', 'estimated_value': '1000',
+            'product_category': 'PRINTERS', 'region': 'DACH', 'deal_type': 'NEW'}
+
+
+# URL name -> requests made as every role; budgets are the most any role may use
+BUDGETS = {
+    'api-root': [Case(1)],
+    'deal-list': [
+        Case(3),
+        Case(3, query='?fields=id,project_name,status'),
+        Case(4, query='?expand=audit_trail'),
+        Case(8, method='post', data=new_deal),
+    ],
+    'deal-detail': [
+        Case(3, args=deal('DRAFT')),
+        Case(5, method='patch', args=deal('DRAFT'), data=lambda f, role: {'project_name': 'Renamed'}),
+    ],
+    'deal-submit': [Case(13, method='post', args=deal('DRAFT'))],
+    'deal-approve': [Case(10, method='post', args=deal('SUBMITTED'))],
+    'deal-reject': [Case(11, method='post', args=deal('SUBMITTED'))],
+    'deal-audit': [Case(3, args=deal('SUBMITTED'))],
+    'deal-conflicts': [Case(4, args=deal('SUBMITTED'))],
+    'deal-bulk-transition': [
+        Case(9, method='post', data=lambda f, role: {'ids': [f.deals['SUBMITTED'].pk, f.deals['DRAFT'].pk], 'status': 'APPROVED'}),
+        # submitting scores possible duplicates for the whole batch at once
+        Case(12, method='post', data=lambda f, role: {'ids': [d.pk for d in f.drafts], 'status': 'SUBMITTED'}),
+    ],
+    'deal-partner-dashboard': [Case(2)],
+    'deal-brady-dashboard': [Case(2), Case(3, query='?sort=-estimated_value&count=estimate')],
+    'deal-overview': [Case(2)],
+    'deal-regions': [Case(2)],
+    'deal-analytics': [
+        Case(3),
+        Case(4, query='?group_by=partner,region,period&interval=week&status=SUBMITTED,APPROVED'),
+    ],
+    'deal-as-of': [
+        Case(3, query='?at=2030-01-01'),
+        Case(4, query='?at=2030-01-01T00:00:00Z&group_by=partner,region,status&status=APPROVED,DRAFT'),
+    ],
+    'deal-export-csv': [Case(2)],
+    'deal-export': [Case(2, query='?export_format=ndjson')],
+    'notification-list': [Case(3)],
+    'notification-detail': [Case(2, args=notification)],
+    'notification-mark-read': [Case(3, method='post', args=notification)],
+    'notification-mark-unread': [Case(2, method='post', args=notification)],
+    'notification-mark-all-read': [Case(5, method='post')],
+    'deals:my_deals': [Case(1)],
+    'deals:dashboard': [Case(1)],
+    'deals:partner_deals': [Case(3)],
+    'deals:partner_overview': [Case(2)],
+    'deals:brady_deals': [Case(4)],
+    'deals:brady_overview': [Case(3)],
+    'deals:create_deal': [Case(3), Case(5, method='post', data=new_deal)],
+    'deals:deal_detail': [Case(3, args=deal('SUBMITTED'))],
+    'deals:deal_timeline': [Case(3, args=deal('SUBMITTED'))],
+    'deals:submit_deal': [Case(12, method='post', args=deal('DRAFT'))],
+    'deals:approve_deal': [Case(9, method='post', args=deal('SUBMITTED'))],
+    'deals:reject_deal': [Case(10, method='post', args=deal('SUBMITTED'))],
+    'deals:close_deal_won': [Case(10, method='post', args=deal('APPROVED'))],
+    'deals:close_deal_lost': [Case(10, method='post', args=deal('APPROVED'))],
+    'notifications:list': [Case(3)],
+    'notifications:mark_read': [Case(3, method='post', args=notification)],
+    'notifications:mark_all_read': [Case(5, method='post')],
+}
+
+
+def covered_url_names():
+    names = {p.name for p in router.urls if p.name}
+    names |= {f'deals:{p.name}' for p in deal_urls.urlpatterns}
+    names |= {f'notifications:{p.name}' for p in notification_urls.urlpatterns}
+    return names
+
+
+class QueryLog:
+    def __init__(self):
+        self.shapes = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        if 'SAVEPOINT' not in sql:
+            self.shapes[query_shape(sql)] += 1
+        return execute(sql, params, many, context)
+
+    @property
+    def count(self):
+        return sum(self.shapes.values())
+
+
+class QueryBudgetTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        Generator(partners=3, users_per_partner=1, brady_users=1, deals=12, audit_depth=2,
+                  notifications=12, seed=5, prefix='budget').run()
+        cls.org = PartnerOrganisation.objects.order_by('pk').first()
+        cls.users = {
+            'partner': User.objects.get(partner_organisation=cls.org),
+            'brady': User.objects.get(role='BRADY'),
+            'admin': User.objects.create_user('budget-admin', password='pass', role='ADMIN', is_staff=True),
+        }
+        cls.deals = {
+            status: Deal.objects.create(partner=cls.org, project_name=f'Budget {status}', end_customer_name='Budget Ltd',
+                                        estimated_value=1000, product_category='LABELS', deal_type='NEW', status=status)
+            for status in ('DRAFT', 'SUBMITTED', 'APPROVED')
+        }
+        cls.drafts = [
+            Deal.objects.create(partner=cls.org, project_name=f'Budget draft {i}', end_customer_name=name, estimated_value=10,
+                                product_category='LABELS', deal_type='NEW')
+            for i, name in enumerate(['Budget Ltd', 'Budget Logistics', 'Initech', 'Globex Corporation'] * 3)
+        ]
+        cls.notifications = {
+            role: Notification.objects.create(recipient=user, verb='Budget', description='Budget')
+            for role, user in cls.users.items()
+        }
+
+    def setUp(self):
+        # 403s and redirects for the wrong role are expected; keep them out of the output
+        logger = logging.getLogger('django.request')
+        self.addCleanup(logger.setLevel, logger.level)
+        logger.setLevel(logging.ERROR)
+
+    def grow(self):
+        """Several times more of everything each role can see, including the fixture deals' history."""
+        users = {'partner': {self.org.pk: [self.users['partner'].pk]}, 'brady': [self.users['brady'].pk, self.users['admin'].pk]}
+        other = PartnerOrganisation.objects.exclude(pk=self.org.pk).values_list('pk', flat=True).first()
+        generator = Generator(deals=120, audit_depth=3, notifications=180, seed=6)
+        with explicit_timestamps(Deal, DealAudit, Notification):
+            generator.create_deals([self.org.pk, other], [1, 1], users)
+            generator.create_notifications(users)
+        DealAudit.objects.bulk_create(
+            DealAudit(deal=d, changed_by=self.users['brady'], old_status=d.status, new_status=d.status, note='Budget note')
+            for d in self.deals.values() for _ in range(60)
+        )
+        deal_stats.rebuild()
+        deal_analytics.rebuild()
+
+    def request(self, name, case, role):
+        url = reverse(name, args=case.args(self, role)) + case.query
+        data = case.data(self, role) if case.data else None
+        client = Client()
+        client.force_login(self.users[role])
+        call = getattr(client, case.method)
+
+        def send():
+            if name.startswith(('deals:', 'notifications:')) or data is None:
+                response = call(url, data or {})
+            else:
+                response = call(url, json.dumps(data), content_type='application/json')
+            if response.streaming:
+                b''.join(response.streaming_content)
+            return response
+
+        cache.clear()
+        # the first request warms per-user caches; writes are rolled back so both see the same rows
+        with transaction.atomic():
+            send()
+            transaction.set_rollback(True)
+        log = QueryLog()
+        with transaction.atomic(), connection.execute_wrapper(log):
+            response = send()
+            transaction.set_rollback(True)
+        self.assertLess(response.status_code, 500, f'{case.method.upper()} {url} as {role}')
+        return response.status_code, log
+
+    def measure(self):
+        results = {}
+        for name, cases in BUDGETS.items():
+            for i, case in enumerate(cases):
+                for role in ROLES:
+                    results[name, i, role] = self.request(name, case, role)
+        return results
+
+    def test_every_url_has_a_budget(self):
+        self.assertEqual(covered_url_names() - set(BUDGETS), set())
+
+    def test_queries_within_budget_and_independent_of_row_count(self):
+        small = self.measure()
+        self.grow()
+        large = self.measure()
+        for (name, i, role), (status, log) in large.items():
+            case = BUDGETS[name][i]
+            label = f'{case.method.upper()} {name}{case.query} as {role}'
+            with self.subTest(label):
+                small_status, small_log = small[name, i, role]
+                self.assertEqual(status, small_status)
+                self.assertLessEqual(small_log.count, case.budget, self.describe(small_log))
+                grown = large[name, i, role][1].shapes - small_log.shapes
+                self.assertFalse(grown, 'queries grew with the dataset:\n' + self.describe(log, grown))
+                self.assertLessEqual(log.count, case.budget, self.describe(log))
+        # every URL must succeed for at least one role, or the budget checks nothing
+        for name, cases in BUDGETS.items():
+            for i, case in enumerate(cases):
+                with self.subTest(f'{name} #{i} reachable'):
+                    self.assertTrue(any(large[name, i, role][0] < 400 for role in ROLES))
+
+    def describe(self, log, shapes=None):
+        shapes = shapes or log.shapes
+        return f'{log.count} queries:\n' + '\n'.join(f'{n:4d} x {sql[:200]}' for sql, n in shapes.most_common())